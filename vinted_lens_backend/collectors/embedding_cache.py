@@ -0,0 +1,225 @@
+# collectors/embedding_cache.py
+# Cache disque adressé par contenu, partagé par les collecteurs :
+# URL -> sha256 de l'image -> embedding float16 (par version de modèle)
+#
+# Usage : python -m collectors.embedding_cache stats|evict [--path ...]
+
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+DEFAULT_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
+DEFAULT_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    image_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (image_hash, model)
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+# surcoût approximatif d'une ligne (clés, index) pour le calcul de taille
+ROW_OVERHEAD = 160
+
+
+class EmbeddingDiskCache:
+    """
+    Évite téléchargement + inférence pour une image déjà vue :
+
+    - URL connue et embedding présent pour ce modèle -> aucun accès réseau
+    - URL inconnue mais octets déjà vus (même sha256) -> pas d'inférence
+    - sinon : téléchargement, encodage, puis mise en cache
+
+    Les embeddings sont stockés en float16 (1 Ko pour 512 dims) et étiquetés
+    par version de modèle : changer de modèle/backend ne réutilise rien.
+    SQLite en WAL : plusieurs collecteurs (processus) peuvent partager le fichier.
+    Éviction LRU dès que la taille estimée dépasse `max_bytes`.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, model_version: str = "",
+                 max_bytes: int = DEFAULT_MAX_BYTES, evict_every: int = 1000):
+        self.path = os.path.abspath(path)
+        self.model_version = model_version
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._puts = 0
+
+        # métriques
+        self.url_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    # --- lecture ---
+    def _embedding(self, image_hash: str) -> Optional[np.ndarray]:
+        row = self._conn.execute(
+            "SELECT embedding FROM embeddings WHERE image_hash = ? AND model = ?",
+            (image_hash, self.model_version),
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE embeddings SET last_used = ? WHERE image_hash = ? AND model = ?",
+            (time.time(), image_hash, self.model_version),
+        )
+        return np.frombuffer(row[0], dtype=np.float16).astype(np.float32)
+
+    def get_by_url(self, url: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute("SELECT image_hash FROM urls WHERE url = ?", (url,)).fetchone()
+            return self._embedding(row[0]) if row else None
+
+    def get_by_hash(self, image_hash: str) -> Optional[np.ndarray]:
+        with self._lock:
+            return self._embedding(image_hash)
+
+    # --- écriture ---
+    def put_url(self, url: str, image_hash: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, image_hash, last_used) VALUES (?, ?, ?)",
+                (url, image_hash, time.time()),
+            )
+
+    def put(self, image_hash: str, embedding: np.ndarray, url: Optional[str] = None):
+        blob = np.asarray(embedding, dtype=np.float16).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (image_hash, model, embedding, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (image_hash, self.model_version, blob, now),
+            )
+            if url:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO urls (url, image_hash, last_used) VALUES (?, ?, ?)",
+                    (url, image_hash, now),
+                )
+            self._conn.execute("COMMIT")
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict()
+
+    # --- chemin principal ---
+    def get_or_compute(self, url: str, fetch: Callable[[str], bytes],
+                       encode: Callable[[bytes], np.ndarray]) -> np.ndarray:
+        """
+        Args:
+            fetch: url -> octets de l'image (appelé seulement si l'URL est inconnue)
+            encode: octets -> embedding (appelé seulement si le contenu est inconnu)
+        """
+        emb = self.get_by_url(url)
+        if emb is not None:
+            self.url_hits += 1
+            return emb
+
+        data = fetch(url)
+        image_hash = self.content_hash(data)
+        emb = self.get_by_hash(image_hash)
+        if emb is not None:
+            self.content_hits += 1
+            self.put_url(url, image_hash)
+            return emb
+
+        self.misses += 1
+        emb = np.asarray(encode(data), dtype=np.float32)
+        self.put(image_hash, emb, url=url)
+        return emb
+
+    # --- éviction ---
+    def size_bytes(self) -> int:
+        row = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(embedding)), 0) + COUNT(*) * ? FROM embeddings",
+            (ROW_OVERHEAD,),
+        ).fetchone()
+        urls = self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        return int(row[0]) + int(urls) * ROW_OVERHEAD
+
+    def _evict(self) -> int:
+        """Supprime les embeddings les moins récemment utilisés jusqu'à 90% de max_bytes"""
+        size = self.size_bytes()
+        if size <= self.max_bytes:
+            return 0
+        # une ligne ≈ embedding float16 512 dims + URL associée
+        n = max(1, (size - int(self.max_bytes * 0.9)) // (1024 + 2 * ROW_OVERHEAD))
+        self._conn.execute("BEGIN")
+        cur = self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (int(n),)
+        )
+        # URLs dont plus aucun embedding n'existe (tous modèles confondus)
+        self._conn.execute(
+            "DELETE FROM urls WHERE image_hash NOT IN (SELECT image_hash FROM embeddings)"
+        )
+        self._conn.execute("COMMIT")
+        return cur.rowcount
+
+    def evict(self) -> int:
+        with self._lock:
+            return self._evict()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            embeddings = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            models = self._conn.execute(
+                "SELECT model, COUNT(*) FROM embeddings GROUP BY model"
+            ).fetchall()
+            urls = self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            size = self.size_bytes()
+        return {
+            "path": self.path,
+            "model_version": self.model_version,
+            "embeddings": embeddings,
+            "by_model": dict(models),
+            "urls": urls,
+            "size_mb": round(size / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "url_hits": self.url_hits,
+            "content_hits": self.content_hits,
+            "misses": self.misses,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache disque des embeddings des collecteurs")
+    parser.add_argument("command", choices=["stats", "evict"])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_BYTES // 1024 // 1024)
+    args = parser.parse_args()
+
+    cache = EmbeddingDiskCache(args.path, max_bytes=args.max_mb * 1024 * 1024)
+    if args.command == "evict":
+        print(f"🧹 {cache.evict()} embedding(s) supprimé(s)")
+    print(cache.stats())
+    cache.close()
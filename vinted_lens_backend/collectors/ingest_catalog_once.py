@@ -1,16 +1,17 @@
-import os, sys, io, time
+import os, sys, asyncio
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, List
 
 sys.path.append(os.path.dirname(__file__) + "/..")
 
-import requests
-from PIL import Image
-import numpy as np
 from clickhouse_driver import Client
 
-from integrations.vinted_client import VintedClient
+from integrations.vinted_client import AsyncVintedClient
 from models.clip_model import CLIPService
+from collectors.embedding_cache import EmbeddingDiskCache
+from collectors.pipeline import IngestPipeline
+from collectors.watermarks import WatermarkStore
+from collectors.known_ids import KnownIds
 
 CLICKHOUSE_HOST = "localhost"
 CLICKHOUSE_DB = "vinted_lens"
@@ -86,132 +87,79 @@ def pick_created_updated(it: Dict[str, Any]):
     return created, updated
 
 
-# ------- image -> embedding -------
-def download_image(url: str, session: Optional[requests.Session] = None) -> Image.Image:
-    sess = session or requests.Session()
-    r = sess.get(url, headers={"Referer": "https://www.vinted.fr/catalog"}, timeout=15)
-    r.raise_for_status()
-    return Image.open(io.BytesIO(r.content)).convert("RGB")
-
-
-def encode_image(
-    url: str, clip: CLIPService, session: Optional[requests.Session] = None
-) -> List[float]:
-    img = download_image(url, session=session)
-    vec = clip.encode_image_pil(img)  # 512 floats
-    v = np.asarray(vec, dtype=np.float32)
-    n = np.linalg.norm(v)
-    if v.shape != (512,) or not np.isfinite(n) or n == 0:
-        raise RuntimeError("Embedding invalide")
-    return (v / n).astype(np.float32).tolist()
-
-
-# ------- inserts (TON schéma) -------
-def insert_products(db: Client, rows: List[tuple]):
-    if rows:
-        db.execute(
-            """
-            INSERT INTO vinted_lens.products
-            (id, title, price, platform, image_url, embedding, category, color, brand, size, condition, created_at, updated_at)
-            VALUES
-        """,
-            rows,
-        )
-
-
-def insert_product_embeddings(db: Client, rows: List[tuple]):
-    if rows:
-        db.execute(
-            """
-            INSERT INTO vinted_lens.product_embeddings
-            (product_id, embedding, norm)
-            VALUES
-        """,
-            rows,
-        )
+# ------- ligne products (TON schéma) -------
+def product_row(it: Dict[str, Any]) -> tuple:
+    created_at, updated_at = pick_created_updated(it)
+    return (
+        int(it["id"]),
+        it.get("title") or it.get("description") or "",
+        float(pick_price(it)),
+        "vinted",
+        pick_image_url(it),
+        pick_category(it),
+        str(it.get("colour") or it.get("color") or ""),
+        pick_brand(it),
+        pick_size(it),
+        pick_condition(it),
+        created_at,
+        updated_at,
+    )
 
 
 def main():
     CATALOG_ID = 10  # Robes (selon ce que tu as vu)
     PER_PAGE = 20
+    MAX_PAGES = 1
 
-    client = VintedClient(base="https://www.vinted.fr", min_interval_s=0.9)
     clip = CLIPService()
+    clip.load_model()   # backend effectif connu avant d'étiqueter le cache
+    cache = EmbeddingDiskCache(model_version=clip.model_version)
     db = ch()
 
-    params = {
-        "catalog_ids": str(CATALOG_ID),
-        "page": 1,
-        "per_page": PER_PAGE,
-        "order": "newest_first",
-    }
-    print(f"[DEBUG] params envoyés: {params}")
-
-    # --- appel API
-    data = client.search_by_params(params, referer_query=f"?catalog_ids={CATALOG_ID}")
-    if not isinstance(data, dict):
-        print("[ERROR] Réponse inattendue (pas un dict):", type(data))
-        return
-
-    # --- debug structure
-    print("[DEBUG] type(data) =", type(data))
-    print("[DEBUG] keys =", list(data.keys()))
-
-    # selon les versions, c'est 'items' ou 'catalog_items'
-    items = data.get("items") or data.get("catalog_items") or []
-    print(f"[PAGE 1] reçus={len(items)} pour catalog_ids={CATALOG_ID}")
-
-    if not items:
-        # dump court pour comprendre la forme
-        print("[DEBUG] Aperçu JSON:", str(data)[:800])
-        return
+    client = AsyncVintedClient(base="https://www.vinted.fr", min_interval_s=0.9)
+
+    async def fetch_page(page: int) -> List[Dict[str, Any]]:
+        params = {
+            "catalog_ids": str(CATALOG_ID),
+            "page": page,
+            "per_page": PER_PAGE,
+            "order": "newest_first",
+        }
+        print(f"[DEBUG] params envoyés: {params}")
+        data = await client.search_by_params(params, referer_query=f"?catalog_ids={CATALOG_ID}")
+        if not isinstance(data, dict):
+            print("[ERROR] Réponse inattendue (pas un dict):", type(data))
+            return []
+        # selon les versions, c'est 'items' ou 'catalog_items'
+        items = data.get("items") or data.get("catalog_items") or []
+        print(f"[PAGE {page}] reçus={len(items)} pour catalog_ids={CATALOG_ID}")
+        if not items:
+            # dump court pour comprendre la forme
+            print("[DEBUG] Aperçu JSON:", str(data)[:800])
+        return items
 
     # --- compte avant
     before_p = db.execute("SELECT count() FROM vinted_lens.products")[0][0]
     before_e = db.execute("SELECT count() FROM vinted_lens.product_embeddings")[0][0]
 
-    img_session = requests.Session()
-    rows_products, rows_embs = [], []
-
-    for it in items:
-        try:
-            pid = int(it["id"])
-            image_url = pick_image_url(it)
-            if not image_url:
-                raise RuntimeError("image_url introuvable")
-
-            emb = encode_image(image_url, clip, session=img_session)
-            norm = float(np.linalg.norm(np.asarray(emb, dtype=np.float32)))
-
-            title = it.get("title") or it.get("description") or ""
-            price = pick_price(it)
-            platform = "vinted"
-            category = pick_category(it)
-            color = it.get("colour") or it.get("color") or ""
-            brand = pick_brand(it)
-            size = pick_size(it)
-            condition = pick_condition(it)
-            created_at, updated_at = pick_created_updated(it)
-
-            rows_products.append((
-                pid, title, float(price), platform, image_url, emb, category, str(color),
-                brand, size, condition, created_at, updated_at
-            ))
-            rows_embs.append((pid, emb, norm))
-            time.sleep(0.1)  # cool-down image
-
-        except Exception as e:
-            print(f"  [!] skip id={it.get('id')} : {e}")
-
-    # --- insertions (en dehors du for/except)
-    insert_products(db, rows_products)
-    insert_product_embeddings(db, rows_embs)
+    # --- pages -> téléchargements concurrents -> CLIP batché -> inserts colonnaires
+    pipeline = IngestPipeline(clip, db, to_row=product_row, image_url=pick_image_url,
+                              cache=cache, client=client,
+                              watermarks=WatermarkStore(), watermark_key=f"catalog:{CATALOG_ID}",
+                              known_ids=KnownIds().load(db))
+
+    async def run():
+        async with client:
+            await pipeline.run(fetch_page, max_pages=MAX_PAGES)
+
+    asyncio.run(run())
 
     # --- compte après
     after_p = db.execute("SELECT count() FROM vinted_lens.products")[0][0]
     after_e = db.execute("SELECT count() FROM vinted_lens.product_embeddings")[0][0]
     print(f"[DELTA] +products={after_p - before_p}  +embeddings={after_e - before_e}")
+    print(f"[CACHE] {cache.stats()}")
+
 
-                
 if __name__ == "__main__":
     main()
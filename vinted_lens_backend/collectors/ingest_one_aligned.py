@@ -1,6 +1,6 @@
-import os, sys, io
+import os, sys
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple
 
 sys.path.append(os.path.dirname(__file__) + "/..")
 
@@ -11,6 +11,10 @@ from clickhouse_driver import Client
 
 from integrations.vinted_client import VintedClient
 from models.clip_model import CLIPService
+from models.preprocessing import decode_image
+from collectors.embedding_cache import EmbeddingDiskCache
+from database.clickhouse_setup import ClickHouseVectorDB
+from utils.vector_ops import l2_normalize
 
 CLICKHOUSE_HOST = "localhost"
 CLICKHOUSE_DB   = "vinted_lens"
@@ -76,47 +80,45 @@ def pick_created_updated(it: Dict[str, Any]) -> Tuple[datetime, datetime]:
     return created, updated
 
 # ---------- Image -> Embedding ----------
-def download_image(url: str, session: Optional[requests.Session] = None) -> Image.Image:
+def fetch_image_bytes(url: str, session: Optional[requests.Session] = None) -> bytes:
     sess = session or requests.Session()
     headers = {"Referer": "https://www.vinted.fr/catalog"}
     r = sess.get(url, headers=headers, timeout=15)
     r.raise_for_status()
-    return Image.open(io.BytesIO(r.content)).convert("RGB")
-
-def encode_image(url: str, clip: CLIPService, session: Optional[requests.Session] = None) -> List[float]:
-    img = download_image(url, session=session)
-    vec = clip.encode_image_pil(img)  # attendu: 512 floats
-    v = np.asarray(vec, dtype=np.float32)
-    # normalisation L2 pour que dot ≃ cosinus
-    n = np.linalg.norm(v)
-    if v.shape != (512,):
-        raise RuntimeError(f"Embedding shape {v.shape}, attendu (512,)")
-    if not np.isfinite(n) or n == 0:
+    return r.content
+
+def download_image(url: str, session: Optional[requests.Session] = None) -> Image.Image:
+    return decode_image(fetch_image_bytes(url, session=session))  # draft JPEG ~224px + EXIF + limite pixels
+
+def encode_image(url: str, clip: CLIPService, session: Optional[requests.Session] = None,
+                 cache: Optional[EmbeddingDiskCache] = None) -> np.ndarray:
+    def embed(data: bytes):
+        return clip.encode_image_pil(decode_image(data))  # np.ndarray float32 (512,)
+
+    if cache is None:
+        vec = embed(fetch_image_bytes(url, session=session))
+    else:
+        # URL ou contenu déjà vus : ni téléchargement ni inférence
+        vec = cache.get_or_compute(url, lambda u: fetch_image_bytes(u, session=session), embed)
+    if vec.shape != (512,):
+        raise RuntimeError(f"Embedding shape {vec.shape}, attendu (512,)")
+    # normalisation L2 (en place) pour que dot ≃ cosinus
+    v, valid = l2_normalize(vec)
+    if not valid:
         raise RuntimeError("Norme embedding invalide")
-    v = (v / n).astype(np.float32)
-    return v.tolist()
-
-# ---------- Inserts alignés sur TON schéma ----------
-def insert_products(db: Client, rows: List[tuple]):
-    db.execute("""
-        INSERT INTO vinted_lens.products
-        (id, title, price, platform, image_url, embedding, category, color, brand, size, condition, created_at, updated_at)
-        VALUES
-    """, rows)
-
-def insert_product_embeddings(db: Client, rows: List[tuple]):
-    db.execute("""
-        INSERT INTO vinted_lens.product_embeddings
-        (product_id, embedding, norm)
-        VALUES
-    """, rows)
+    return v
 
 def main():
     client = VintedClient(base="https://www.vinted.fr", min_interval_s=0.9)
     clip   = CLIPService()
+    clip.load_model()   # backend effectif connu avant d'étiqueter le cache
+    cache  = EmbeddingDiskCache(model_version=clip.model_version)
     db     = ch()
+    writer = ClickHouseVectorDB()
 
     # 1) on prend 1 page (robe), on gardera le 1er item pour test
+    CATALOG_ID = 10  # Robes
+    params = {"catalog_ids": str(CATALOG_ID), "page": 1, "per_page": 20, "order": "newest_first"}
     data = client.search_by_params(params, referer_query=f"?catalog_ids={CATALOG_ID}") or {}
     items = data.get("items") or data.get("catalog_items") or []
     assert items, "Aucun item"
@@ -137,21 +139,19 @@ def main():
     created_at, updated_at = pick_created_updated(it)
 
     # 2) embedding
-    emb = encode_image(image_url, clip, session=requests.Session())  # 512 floats normalisés
-    norm = float(np.linalg.norm(np.asarray(emb, dtype=np.float32)))  # ~1.0 (après normalisation, par sécurité)
+    emb = encode_image(image_url, clip, session=requests.Session(), cache=cache)  # (512,) float32 normalisé
 
     # 3) counts avant
     before_p = db.execute("SELECT count() FROM vinted_lens.products")[0][0]
     before_e = db.execute("SELECT count() FROM vinted_lens.product_embeddings")[0][0]
     print(f"[BEFORE] products={before_p} embeddings={before_e}")
 
-    # 4) insert dans TES colonnes
-    insert_products(db, [(
-        pid, title, float(price), platform, image_url, emb, category, str(color), brand, size, condition, created_at, updated_at
-    )])
-    insert_product_embeddings(db, [(
-        pid, emb, norm
-    )])
+    # 4) insert dans TES colonnes (INSERT Native, embedding float32 tel quel)
+    writer.add_products([{
+        "id": pid, "title": title, "price": float(price), "platform": platform,
+        "image_url": image_url, "category": category, "color": str(color), "brand": brand,
+        "size": size, "condition": condition, "created_at": created_at, "updated_at": updated_at,
+    }], emb[None, :])
 
     # 5) counts après
     after_p = db.execute("SELECT count() FROM vinted_lens.products")[0][0]
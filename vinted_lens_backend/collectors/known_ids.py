@@ -0,0 +1,252 @@
+# collectors/known_ids.py
+# Ensemble compact des ids déjà en base, chargé une fois par les collecteurs
+# (remplace un `WHERE id IN (...)` ClickHouse par page)
+#
+# Usage : python -m collectors.known_ids rebuild|stats [--path ...]
+
+import os
+import json
+import argparse
+import threading
+from typing import Callable, Iterable, Optional, Set
+
+import numpy as np
+
+from database.clickhouse_setup import LOCAL_ID_MIN
+
+try:
+    from pyroaring import BitMap64
+    PYROARING_AVAILABLE = True
+except ImportError:
+    PYROARING_AVAILABLE = False
+
+DEFAULT_PATH = os.environ.get("KNOWN_IDS_PATH", "known_ids")
+BLOOM_CAPACITY = int(os.environ.get("KNOWN_IDS_CAPACITY", "20000000"))
+BLOOM_FP_RATE = 0.001
+
+_M1 = np.uint64(0xBF58476D1CE4E5B9)
+_M2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 vectorisé"""
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * _M1
+        x = (x ^ (x >> np.uint64(27))) * _M2
+        return x ^ (x >> np.uint64(31))
+
+
+class BloomFilter:
+    """Filtre de Bloom sur uint64 (double hachage splitmix64), opérations vectorisées"""
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, fp_rate: float = BLOOM_FP_RATE,
+                 bits: Optional[np.ndarray] = None, k: Optional[int] = None):
+        m = int(-capacity * np.log(fp_rate) / (np.log(2) ** 2))
+        self.m = ((m + 63) // 64) * 64
+        self.k = k or max(1, int(round(self.m / capacity * np.log(2))))
+        self.capacity = capacity
+        self.bits = bits if bits is not None else np.zeros(self.m // 8, dtype=np.uint8)
+        self.m = len(self.bits) * 8
+
+    def _positions(self, ids: np.ndarray) -> np.ndarray:
+        h1 = _mix(ids)
+        h2 = _mix(h1) | np.uint64(1)
+        i = np.arange(self.k, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            return (h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(self.m)
+
+    def add(self, ids: np.ndarray):
+        pos = self._positions(ids).ravel()
+        np.bitwise_or.at(self.bits, (pos >> np.uint64(3)).astype(np.int64),
+                         (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8)))
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        pos = self._positions(ids)
+        hit = self.bits[(pos >> np.uint64(3)).astype(np.int64)] & \
+            (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8))
+        return (hit != 0).all(axis=1)
+
+
+class KnownIds:
+    """
+    Appartenance des ids produits, mise à jour à chaque insert et sauvegardée sur disque.
+
+    - pyroaring disponible : bitmap roaring 64 bits, exact
+    - sinon : filtre de Bloom ; un "peut-être" est confirmé par `confirm`
+      (requête ClickHouse sur ces seuls ids), un "non" est définitif
+
+    Snapshot : `<path>.roaring` ou `<path>.bloom.npy` + `<path>.json` (max_id,
+    max_local_id, count, rows). `rows` compte les lignes de products vues (chargement
+    + ajouts) : au chargement, les ids au-delà des deux marques du snapshot sont
+    rattrapés puis comparés à count() (métadonnées des parts, sans scan) ; si le
+    nombre de lignes a divergé autrement (backfill d'un autre process), rescan complet.
+
+    Deux marques croissantes : max_id pour les ids Vinted, max_local_id pour les ids
+    générés par new_product_ids (>= LOCAL_ID_MIN) ; un seul id local dans max_id
+    masquerait sinon tous les ids Vinted écrits ensuite par un autre process.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self.exact = PYROARING_AVAILABLE
+        self._lock = threading.Lock()
+        self._reset()
+
+        # métriques
+        self.lookups = 0
+        self.maybe = 0
+        self.false_positives = 0
+
+    def _reset(self):
+        self._bitmap = BitMap64() if self.exact else None
+        self._bloom = None if self.exact else BloomFilter()
+        self.count = 0
+        self.rows = 0
+        self.max_id = 0
+        self.max_local_id = 0
+
+    @property
+    def backend(self) -> str:
+        return "roaring" if self.exact else "bloom"
+
+    # --- appartenance ---
+    def add(self, ids: Iterable[int]):
+        arr = np.fromiter((int(x) for x in ids), dtype=np.uint64)
+        if not len(arr):
+            return
+        with self._lock:
+            if self.exact:
+                before = len(self._bitmap)
+                self._bitmap.update(arr)
+                self.count += len(self._bitmap) - before
+            else:
+                self._bloom.add(arr)
+                self.count += len(arr)
+            self.rows += len(arr)
+            local = arr >= LOCAL_ID_MIN
+            if not local.all():
+                self.max_id = max(self.max_id, int(arr[~local].max()))
+            if local.any():
+                self.max_local_id = max(self.max_local_id, int(arr[local].max()))
+
+    def candidates(self, ids: Iterable[int]) -> Set[int]:
+        """Ids possiblement connus (exacts avec roaring)"""
+        ids = [int(x) for x in ids]
+        self.lookups += len(ids)
+        if not ids:
+            return set()
+        with self._lock:
+            if self.exact:
+                return {i for i in ids if i in self._bitmap}
+            mask = self._bloom.contains(np.asarray(ids, dtype=np.uint64))
+        return {i for i, m in zip(ids, mask) if m}
+
+    def known(self, ids: Iterable[int], confirm: Callable[[list], Set[int]]) -> Set[int]:
+        """Ids déjà en base ; `confirm` n'est appelé que pour les positifs du Bloom"""
+        maybe = self.candidates(ids)
+        if self.exact or not maybe:
+            return maybe
+        self.maybe += len(maybe)
+        confirmed = confirm(sorted(maybe))
+        self.false_positives += len(maybe) - len(confirmed)
+        return confirmed
+
+    # --- persistance ---
+    def _files(self):
+        return f"{self.path}.json", (f"{self.path}.roaring" if self.exact else f"{self.path}.bloom.npy")
+
+    def save(self):
+        meta_path, data_path = self._files()
+        os.makedirs(os.path.dirname(os.path.abspath(data_path)), exist_ok=True)
+        with self._lock:
+            tmp = data_path + ".tmp"
+            if self.exact:
+                with open(tmp, "wb") as f:
+                    f.write(self._bitmap.serialize())
+            else:
+                with open(tmp, "wb") as f:
+                    np.save(f, self._bloom.bits)
+            os.replace(tmp, data_path)
+            meta = {"backend": self.backend, "count": self.count, "rows": self.rows,
+                    "max_id": self.max_id, "max_local_id": self.max_local_id}
+            if not self.exact:
+                meta.update(capacity=self._bloom.capacity, k=self._bloom.k)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _load_snapshot(self) -> bool:
+        meta_path, data_path = self._files()
+        if not (os.path.exists(meta_path) and os.path.exists(data_path)):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("backend") != self.backend:
+            return False
+        if self.exact:
+            with open(data_path, "rb") as f:
+                self._bitmap = BitMap64.deserialize(f.read())
+        else:
+            self._bloom = BloomFilter(meta["capacity"], bits=np.load(data_path), k=meta["k"])
+        self.count, self.max_id = int(meta["count"]), int(meta["max_id"])
+        self.max_local_id = int(meta.get("max_local_id", 0))
+        self.rows = int(meta.get("rows", -1))      # snapshot antérieur : forcera un rescan
+        if "max_local_id" not in meta or self.max_id >= LOCAL_ID_MIN:
+            self.rows = -1                          # max_id gonflé par un id local : rescan
+        return True
+
+    def load(self, db) -> "KnownIds":
+        """Snapshot + rattrapage incrémental, ou scan complet de products (clickhouse_driver)"""
+        total = int(db.execute("SELECT count() FROM vinted_lens.products")[0][0])
+        if self._load_snapshot():
+            new_ids = [r[0] for r in db.execute(
+                "SELECT id FROM vinted_lens.products WHERE (id > %(max_id)s AND id < %(local)s) "
+                "OR id > %(max_local_id)s",
+                {"max_id": self.max_id, "local": LOCAL_ID_MIN,
+                 "max_local_id": max(self.max_local_id, LOCAL_ID_MIN - 1)}
+            )]
+            self.add(new_ids)
+            if self.rows == total:
+                print(f"[KNOWN_IDS] snapshot {self.backend}: {self.count} ids (+{len(new_ids)} rattrapés)")
+                return self
+            print(f"[KNOWN_IDS] snapshot incohérent ({self.rows} lignes != {total}) -> rescan")
+            self._reset()
+        for block in db.execute_iter("SELECT id FROM vinted_lens.products",
+                                     settings={"max_block_size": 100000}, chunk_size=100000):
+            self.add(r[0] for r in block)
+        print(f"[KNOWN_IDS] scan complet {self.backend}: {self.count} ids")
+        self.save()
+        return self
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "count": self.count,
+            "rows": self.rows,
+            "max_id": self.max_id,
+            "max_local_id": self.max_local_id,
+            "lookups": self.lookups,
+            "bloom_maybe": self.maybe,
+            "bloom_false_positives": self.false_positives,
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(os.path.dirname(__file__) + "/..")
+    from clickhouse_driver import Client
+
+    parser = argparse.ArgumentParser(description="Ensemble des ids produits connus (collecteurs)")
+    parser.add_argument("command", choices=["rebuild", "stats"])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--host", default="localhost")
+    args = parser.parse_args()
+
+    known = KnownIds(args.path)
+    if args.command == "rebuild":
+        for suffix in (".json", ".roaring", ".bloom.npy"):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    known.load(Client(host=args.host, database="vinted_lens"))
+    print(known.stats())
@@ -0,0 +1,445 @@
+# collectors/pipeline.py
+# Moteur d'ingestion en pipeline : pages -> téléchargements -> CLIP (batché) -> inserts ClickHouse
+#
+# Les étapes tournent en parallèle, reliées par des files bornées : une étape
+# lente ralentit celles d'avant (back-pressure), la mémoire reste constante
+# quelle que soit la durée du run.
+
+import time
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from collectors.embedding_cache import EmbeddingDiskCache
+from collectors.watermarks import WatermarkStore, item_ts
+from collectors.known_ids import KnownIds
+from integrations.vinted_client import AsyncVintedClient
+from utils.vector_ops import l2_normalize
+from database.clickhouse_setup import ClickHouseVectorDB, PRODUCT_COLUMNS, PRODUCT_TIMESTAMPS
+
+# Ordre des champs des tuples renvoyés par to_row
+PRODUCT_FIELDS = PRODUCT_COLUMNS + PRODUCT_TIMESTAMPS
+_DONE = object()
+
+
+@dataclass
+class Job:
+    pid: int
+    image_url: str
+    row: tuple                          # ligne products (ordre PRODUCT_FIELDS)
+    data: Optional[bytes] = None
+    image_hash: Optional[str] = None
+    embedding: Optional[np.ndarray] = None
+
+
+@dataclass
+class StageStats:
+    name: str
+    items: int = 0
+    errors: int = 0
+    busy_s: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+
+    def report(self) -> Dict:
+        wall = time.perf_counter() - self.started
+        return {
+            "items": self.items,
+            "errors": self.errors,
+            "items_per_s": round(self.items / wall, 2) if wall > 0 else 0.0,
+            "busy_s": round(self.busy_s, 2),
+        }
+
+
+def already_have_ids(db, ids: Iterable[int]) -> set:
+    ids = list(set(int(x) for x in ids))
+    if not ids:
+        return set()
+    rows = db.execute("SELECT id FROM vinted_lens.products WHERE id IN %(ids)s", {"ids": tuple(ids)})
+    return {int(r[0]) for r in rows}
+
+
+class IngestPipeline:
+    """
+    Étapes (une tâche asyncio chacune, sauf téléchargements : `download_concurrency` tâches) :
+
+    1. pages : fetch_page(n) (coroutine, ou fonction synchrone exécutée hors
+       boucle), filtre `keep`, dédoublonnage (KnownIds en mémoire, sinon
+       requête ClickHouse par page) ; avec un
+       watermark, la pagination s'arrête à la première page qui l'atteint
+       (la zone de reprise d'un run interrompu est sautée sans arrêter la pagination)
+    2. téléchargement : AsyncVintedClient.fetch_image (HTTP/2, streaming borné,
+       budget 'images'), concurrence bornée ; cache disque consulté avant (URL)
+       et après (contenu) pour sauter réseau et inférence
+    3. encodage : micro-batchs de `encode_batch` images -> un seul forward CLIP
+    4. insertion : `writer.add_products` (INSERT Native, embeddings float32 tels
+       quels) par paquets de `insert_batch` (ou toutes les `insert_interval_s` secondes)
+
+    Le client ClickHouse `db` (clickhouse_driver, non thread-safe, lectures :
+    dédoublonnage) et `writer` ne sont utilisés que depuis un executor dédié à un seul thread.
+    """
+
+    def __init__(self, clip, db, to_row: Callable[[Dict[str, Any]], Optional[tuple]],
+                 image_url: Callable[[Dict[str, Any]], Optional[str]],
+                 keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 cache: Optional[EmbeddingDiskCache] = None, dedupe: bool = True,
+                 download_concurrency: int = 16, encode_batch: int = 32,
+                 encode_wait_ms: float = 50.0, insert_batch: int = 500,
+                 insert_interval_s: float = 5.0, queue_size: int = 256,
+                 report_every_s: float = 10.0, client: Optional[AsyncVintedClient] = None,
+                 watermarks: Optional[WatermarkStore] = None, watermark_key: Optional[str] = None,
+                 known_ids: Optional[KnownIds] = None,
+                 writer: Optional[ClickHouseVectorDB] = None):
+        self.clip = clip
+        self.db = db
+        self.writer = writer or ClickHouseVectorDB()
+        self.to_row = to_row
+        self.image_url = image_url
+        self.keep = keep
+        self.cache = cache
+        self.dedupe = dedupe
+        self.download_concurrency = download_concurrency
+        self.encode_batch = encode_batch
+        self.encode_wait_ms = encode_wait_ms
+        self.insert_batch = insert_batch
+        self.insert_interval_s = insert_interval_s
+        self.queue_size = queue_size
+        self.report_every_s = report_every_s
+        self.client = client        # None : client dédié créé (et fermé) par run()
+        self.watermarks = watermarks
+        self.known_ids = known_ids  # mis à jour après chaque insert réussi
+        self.watermark_key = watermark_key
+        self._high_id = 0
+        self._high_ts = 0
+        self._low_id = 0
+        self._page_failed = False
+        self._complete = False          # watermark atteint ou fin de pagination
+        self._resumed = False           # zone de reprise du watermark rejointe
+        self._failed_ids = set()        # échecs potentiellement transitoires, à reprendre
+
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clickhouse")
+        self.cpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip")
+        self.io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pages")
+
+        self.stats = {name: StageStats(name) for name in ("pages", "download", "encode", "insert")}
+        self.seen = 0
+        self.skipped = 0
+        self.cached = 0
+
+    # --- helpers ---
+    async def _in(self, executor, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    def report(self) -> Dict:
+        return {
+            "seen": self.seen,
+            "skipped_existing": self.skipped,
+            "cache_hits": self.cached,
+            "stages": {name: s.report() for name, s in self.stats.items()},
+            "rate_limits": self.client.rate_stats() if self.client is not None else None,
+            "known_ids": self.known_ids.stats() if self.known_ids is not None else None,
+        }
+
+    def _print_report(self, prefix: str = "[PIPE]"):
+        stages = "  ".join(f"{name}={s['items']} ({s['items_per_s']}/s)"
+                           for name, s in self.report()["stages"].items())
+        print(f"{prefix} vus={self.seen} déjà_en_base={self.skipped} cache={self.cached}  {stages}")
+        if self.client is not None:
+            rates = "  ".join(f"{name}={b.current_rate():.2f}/{b.rate:.2f} req/s"
+                              for name, b in self.client.limiter.buckets.items())
+            print(f"{' ' * len(prefix.strip())} débit: {rates}")
+
+    # --- 1. pages ---
+    async def _pages(self, fetch_page: Callable[[int], List[Dict]], max_pages: int,
+                     out: asyncio.Queue):
+        stats = self.stats["pages"]
+        mark = (self.watermarks.get(self.watermark_key)
+                if self.watermarks is not None and self.watermark_key else None)
+        if mark is not None:
+            print(f"[WATERMARK] {self.watermark_key}: id>{mark.max_id}")
+        try:
+            for page in range(1, max_pages + 1):
+                t0 = time.perf_counter()
+                try:
+                    if asyncio.iscoroutinefunction(fetch_page):
+                        items = await fetch_page(page)
+                    else:
+                        items = await self._in(self.io_executor, fetch_page, page)
+                except Exception as e:
+                    stats.errors += 1
+                    self._page_failed = True
+                    print(f"[PAGE {page}] erreur -> stop : {e}")
+                    break
+                if not items:
+                    print(f"[PAGE {page}] 0 item -> stop.")
+                    self._complete = True
+                    break
+                self.seen += len(items)
+                ids = [int(it["id"]) for it in items if "id" in it]
+                self._high_id = max([self._high_id] + ids)
+                if ids:
+                    self._low_id = min(ids + ([self._low_id] if self._low_id else []))
+                self._high_ts = max([self._high_ts] + [item_ts(it) for it in items])
+                crossed = False
+                if mark is not None:
+                    crossed = any(mark.reached(it) for it in items)
+                    self._resumed = self._resumed or any(mark.resumed(it) for it in items)
+                    items = [it for it in items if not mark.covers(it)]
+                if self.keep is not None:
+                    items = [it for it in items if self.keep(it)]
+                items = [it for it in items if "id" in it]
+
+                if self.dedupe and items:
+                    ids = [it["id"] for it in items]
+                    if self.known_ids is not None:
+                        # ClickHouse n'est interrogé que pour confirmer les positifs du Bloom
+                        have = await self._in(self.db_executor, self.known_ids.known, ids,
+                                              partial(already_have_ids, self.db))
+                    else:
+                        have = await self._in(self.db_executor, already_have_ids, self.db, ids)
+                    self.skipped += len(have)
+                    items = [it for it in items if int(it["id"]) not in have]
+                stats.busy_s += time.perf_counter() - t0
+                stats.items += 1
+
+                for it in items:
+                    url = self.image_url(it)
+                    row = self.to_row(it) if url else None
+                    if row is None:
+                        stats.errors += 1
+                        continue
+                    await out.put(Job(pid=int(it["id"]), image_url=url, row=row))
+
+                if crossed:
+                    print(f"[PAGE {page}] watermark atteint -> stop.")
+                    self._complete = True
+                    break
+        finally:
+            for _ in range(self.download_concurrency):
+                await out.put(_DONE)
+
+    # --- 2. téléchargements ---
+    async def _downloader(self, inp: asyncio.Queue,
+                          to_encode: asyncio.Queue, to_insert: asyncio.Queue):
+        stats = self.stats["download"]
+        while True:
+            job = await inp.get()
+            if job is _DONE:
+                return
+            t0 = time.perf_counter()
+            try:
+                if self.cache is not None:
+                    job.embedding = await self._in(None, self.cache.get_by_url, job.image_url)
+                if job.embedding is None:
+                    job.data = await self.client.fetch_image(job.image_url)
+                    stats.items += 1
+                    if self.cache is not None:
+                        job.image_hash = EmbeddingDiskCache.content_hash(job.data)
+                        job.embedding = await self._in(None, self.cache.get_by_hash, job.image_hash)
+                        if job.embedding is not None:
+                            await self._in(None, self.cache.put_url, job.image_url, job.image_hash)
+            except Exception as e:
+                stats.errors += 1
+                self._failed_ids.add(job.pid)
+                print(f"  [!] download id={job.pid} : {e}")
+                continue
+            finally:
+                stats.busy_s += time.perf_counter() - t0
+
+            if job.embedding is not None:
+                self.cached += 1
+                job.data = None
+                await to_insert.put(job)
+            else:
+                await to_encode.put(job)
+
+    # --- 3. encodage ---
+    async def _collect(self, inp: asyncio.Queue, max_size: int, max_wait_s: float) -> List:
+        """Premier élément (bloquant) puis ce qui arrive avant l'échéance ; _DONE termine le lot"""
+        batch = [await inp.get()]
+        if batch[0] is _DONE:
+            return batch
+        deadline = time.perf_counter() + max_wait_s
+        while len(batch) < max_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(inp.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            if item is _DONE:
+                break
+        return batch
+
+    def _encode_batch(self, jobs: List[Job]) -> List[Job]:
+        """Un forward CLIP pour tout le lot ; en cas d'image invalide, repli image par image"""
+        try:
+            embeddings = self.clip.encode_images([job.data for job in jobs])
+        except Exception:
+            if len(jobs) == 1:
+                raise
+            done = []
+            for job in jobs:
+                try:
+                    done.extend(self._encode_batch([job]))
+                except Exception as e:
+                    self.stats["encode"].errors += 1
+                    self._failed_ids.add(job.pid)
+                    print(f"  [!] encode id={job.pid} : {e}")
+            return done
+
+        embeddings, valid = l2_normalize(embeddings)
+
+        done = []
+        for job, emb, ok in zip(jobs, embeddings, valid):
+            if not ok:
+                self.stats["encode"].errors += 1
+                self._failed_ids.add(job.pid)
+                continue
+            job.embedding, job.data = emb, None
+            if self.cache is not None and job.image_hash:
+                self.cache.put(job.image_hash, emb, url=job.image_url)
+            done.append(job)
+        return done
+
+    async def _encoder(self, inp: asyncio.Queue, out: asyncio.Queue):
+        stats = self.stats["encode"]
+        finished = False
+        while not finished:
+            batch = await self._collect(inp, self.encode_batch, self.encode_wait_ms / 1000)
+            if batch[-1] is _DONE:
+                finished = True
+                batch = batch[:-1]
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            try:
+                jobs = await self._in(self.cpu_executor, self._encode_batch, batch)
+            except Exception as e:
+                stats.errors += len(batch)
+                self._failed_ids.update(job.pid for job in batch)
+                print(f"  [!] encode batch ({len(batch)}) : {e}")
+                continue
+            finally:
+                stats.busy_s += time.perf_counter() - t0
+            stats.items += len(jobs)
+            for job in jobs:
+                await out.put(job)
+        await out.put(_DONE)
+
+    # --- 4. insertion ---
+    def _insert(self, jobs: List[Job]):
+        """Un INSERT Native par table : colonnes + matrice (N, 512) float32 sans conversion"""
+        self.writer.add_products([dict(zip(PRODUCT_FIELDS, job.row)) for job in jobs],
+                                 np.stack([job.embedding for job in jobs]))
+
+    async def _inserter(self, inp: asyncio.Queue):
+        stats = self.stats["insert"]
+        finished = False
+        while not finished:
+            batch = await self._collect(inp, self.insert_batch, self.insert_interval_s)
+            if batch[-1] is _DONE:
+                finished = True
+                batch = batch[:-1]
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            try:
+                await self._in(self.db_executor, self._insert, batch)
+                stats.items += len(batch)
+                if self.known_ids is not None:
+                    self.known_ids.add(job.pid for job in batch)
+            except Exception as e:
+                stats.errors += len(batch)
+                self._failed_ids.update(job.pid for job in batch)
+                print(f"  [!] insert ({len(batch)} lignes) : {e}")
+            finally:
+                stats.busy_s += time.perf_counter() - t0
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_every_s)
+            self._print_report()
+
+    # --- run ---
+    async def run(self, fetch_page: Callable[[int], List[Dict]], max_pages: int = 10 ** 6) -> Dict:
+        """
+        Args:
+            fetch_page: numéro de page (1..) -> liste d'articles Vinted ; liste vide = fin
+            max_pages: nombre maximal de pages
+        """
+        to_download = asyncio.Queue(self.queue_size)
+        to_encode = asyncio.Queue(self.queue_size)
+        to_insert = asyncio.Queue(self.queue_size)
+        for s in self.stats.values():
+            s.started = time.perf_counter()
+
+        own_client = self.client is None
+        if own_client:
+            self.client = AsyncVintedClient(image_connections=self.download_concurrency)
+        reporter = asyncio.create_task(self._reporter())
+        encoder = asyncio.create_task(self._encoder(to_encode, to_insert))
+        inserter = asyncio.create_task(self._inserter(to_insert))
+        try:
+            # une page ou un téléchargeur en erreur n'interrompt pas les autres : les jobs
+            # déjà téléchargés / encodés vont jusqu'à l'insert
+            try:
+                results = await asyncio.gather(
+                    self._pages(fetch_page, max_pages, to_download),
+                    *(self._downloader(to_download, to_encode, to_insert)
+                      for _ in range(self.download_concurrency)),
+                    return_exceptions=True,
+                )
+            except BaseException:
+                # run annulé : l'encodeur et l'inserteur s'arrêtent avant les executors
+                encoder.cancel()
+                inserter.cancel()
+                await asyncio.gather(encoder, inserter, return_exceptions=True)
+                raise
+            error = next((r for r in results if isinstance(r, BaseException)), None)
+            await to_encode.put(_DONE)
+            await encoder
+            await inserter
+        finally:
+            reporter.cancel()
+            if own_client:
+                await self.client.aclose()
+            for executor in (self.db_executor, self.cpu_executor, self.io_executor):
+                executor.shutdown(wait=False)
+
+        if self.known_ids is not None:
+            self.known_ids.save()
+        if error is not None:
+            # zone parcourue incertaine (page interrompue) : le watermark ne bouge pas
+            self._print_report("\n❌ RÉSUMÉ (run interrompu)")
+            raise error
+        self._advance_watermark()
+        self._print_report("\n✅ RÉSUMÉ")
+        return self.report()
+
+    def _advance_watermark(self):
+        """
+        Met à jour le watermark (voir Watermark.after_run) :
+        - run complet (watermark atteint ou fin de pagination, aucune page en erreur) :
+          max_id avance, plafonné sous le plus petit id en échec (téléchargement,
+          décodage, encodage, insert) pour que le prochain run le reprenne
+        - run interrompu (max_pages, page en erreur) : max_id ne bouge pas, la zone
+          parcourue est gardée comme point de reprise
+        """
+        if self.watermarks is None or not self.watermark_key or not self._high_id:
+            return
+        complete = self._complete and not self._page_failed
+        failed_min = min(self._failed_ids) if self._failed_ids else None
+        mark = self.watermarks.record_run(self.watermark_key, self._high_id, self._high_ts,
+                                          self._low_id, complete, failed_min, self._resumed)
+        state = "complet" if complete else "interrompu"
+        if failed_min is not None:
+            state += f", {len(self._failed_ids)} échecs à reprendre (id>={failed_min})"
+        resume = (f", reprise [{mark.resume_min_id}, {mark.resume_max_id}]"
+                  if mark.resume_max_id else "")
+        print(f"[WATERMARK] {self.watermark_key}: id<={mark.max_id}{resume} (run {state})")
@@ -1,7 +1,4 @@
-import asyncio
 import requests
-from PIL import Image
-import io
 import time
 from datetime import datetime, timedelta
 import numpy as np
@@ -12,15 +9,17 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 # Imports locaux avec chemin corrigé
 try:
     from database.clickhouse_setup import ClickHouseVectorDB
+    from database.product_writer import ProductWriter
     CLICKHOUSE_AVAILABLE = True
 except ImportError:
     print("ClickHouse non disponible")
     CLICKHOUSE_AVAILABLE = False
     
 class ProductEmbeddingCollector:
-    def __init__(self, clip_service=None, vector_db=None):
+    def __init__(self, clip_service=None, vector_db=None, flush_size: int = 500):
         self.clip_service = clip_service
         self.vector_db = vector_db
+        self.flush_size = flush_size
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -39,30 +38,28 @@ class ProductEmbeddingCollector:
         
         collected_count = 0
         
-        # Simulation de collecte avec données réalistes
-        for i in range(limit):
-            try:
-                # Données produit simulées mais cohérentes
-                product_data = self._generate_realistic_product(gender, category, i)
-                
-                # Générer embedding de l'image
-                embedding = self._get_product_embedding(product_data['image_url'])
-                if embedding is not None:
-                    product_data['embedding'] = embedding
+        # Simulation de collecte avec données réalistes ; écriture par lots (ProductWriter)
+        with ProductWriter(self.vector_db, flush_size=self.flush_size) as writer:
+            for i in range(limit):
+                try:
+                    # Données produit simulées mais cohérentes
+                    product_data = self._generate_realistic_product(gender, category, i)
                     
-                    # Stocker en base
-                    product_id = self.vector_db.add_product(product_data)
-                    if product_id:
+                    # Générer embedding de l'image
+                    embedding = self._get_product_embedding(product_data['image_url'])
+                    if embedding is not None:
+                        writer.add(product_data, embedding)
                         collected_count += 1
                         if collected_count % 10 == 0:
                             print(f"  {collected_count}/{limit} produits traités...")
-                
-                # Rate limiting
-                time.sleep(0.1)
-                
-            except Exception as e:
-                print(f"Erreur produit {i}: {e}")
-                continue
+                    
+                    # Rate limiting
+                    time.sleep(0.1)
+                    
+                except Exception as e:
+                    print(f"Erreur produit {i}: {e}")
+                    continue
+        collected_count -= writer.failed
         
         print(f"✅ Collecte terminée: {collected_count} produits ajoutés")
         return collected_count
@@ -180,7 +177,6 @@ class ProductEmbeddingCollector:
 # Script de lancement
 if __name__ == "__main__":
     from models.clip_model import CLIPService
-    from database.clickhouse_setup import ClickHouseVectorDB
     
     print("Initialisation du collecteur...")
     clip_service = CLIPService()
@@ -0,0 +1,148 @@
+# collectors/watermarks.py
+# Watermarks de crawl incrémental : article le plus récent déjà ingéré par catalogue / requête
+#
+# Usage : python -m collectors.watermarks [show|reset <clé>] [--path ...]
+
+import os
+import json
+import time
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+DEFAULT_PATH = os.environ.get("CRAWL_WATERMARKS_PATH", "crawl_watermarks.json")
+
+
+def item_ts(it: Dict[str, Any]) -> int:
+    """created_at_ts de l'article (0 si absent)"""
+    ts = it.get("created_at_ts")
+    return int(ts) if isinstance(ts, (int, float)) and ts > 0 else 0
+
+
+@dataclass
+class Watermark:
+    max_id: int = 0
+    max_created_ts: int = 0
+    updated_at: float = 0.0
+    # Point de reprise : ids [resume_min_id, resume_max_id] déjà parcourus par un run
+    # interrompu (max_pages, page en erreur) avant d'atteindre max_id ; la zone
+    # ]max_id, resume_min_id[ reste à crawler
+    resume_min_id: int = 0
+    resume_max_id: int = 0
+
+    def reached(self, it: Dict[str, Any]) -> bool:
+        """
+        Article sous le watermark : la pagination peut s'arrêter. Les ids Vinted sont
+        croissants : l'id suffit ; created_at_ts sert quand l'id manque.
+        """
+        if "id" in it:
+            return int(it["id"]) <= self.max_id
+        ts = item_ts(it)
+        return bool(ts) and ts <= self.max_created_ts
+
+    def resumed(self, it: Dict[str, Any]) -> bool:
+        """Article dans la zone déjà parcourue par un run interrompu"""
+        return bool(self.resume_max_id) and "id" in it and \
+            self.resume_min_id <= int(it["id"]) <= self.resume_max_id
+
+    def covers(self, it: Dict[str, Any]) -> bool:
+        """Article déjà couvert par un run précédent"""
+        return self.reached(it) or self.resumed(it)
+
+    def after_run(self, high_id: int, high_ts: int, low_id: int, complete: bool,
+                  failed_min: Optional[int] = None, resumed: bool = False) -> "Watermark":
+        """
+        Watermark après un run ayant vu les ids [low_id, high_id] (pages contiguës
+        depuis la plus récente).
+
+        Args:
+            complete: le run a atteint max_id ou la fin de la pagination, sans page en erreur
+            failed_min: plus petit id en échec (téléchargement, décodage, encodage, insert) ;
+                la couverture s'arrête juste en dessous pour qu'il soit repris
+            resumed: le run a rejoint la zone de reprise (parcours contigu jusqu'à elle)
+        """
+        if not high_id:
+            return self
+        top = high_id if failed_min is None else min(high_id, failed_min - 1)
+        if complete:
+            max_id = max(self.max_id, top if failed_min is not None else max(top, self.resume_max_id))
+            max_ts = max(self.max_created_ts, high_ts) if failed_min is None else self.max_created_ts
+            # une zone de reprise encore au-dessus (au-delà d'un échec) reste valable
+            keep = self.resume_min_id > max_id
+            return Watermark(max_id, max_ts, time.time(),
+                             self.resume_min_id if keep else 0, self.resume_max_id if keep else 0)
+        # run interrompu : max_id ne bouge pas, la zone parcourue devient le point de reprise
+        lo = min(low_id, self.resume_min_id) if resumed and self.resume_max_id else low_id
+        if lo and lo > self.max_id and top >= lo:
+            return Watermark(self.max_id, self.max_created_ts, time.time(), lo, top)
+        return Watermark(self.max_id, self.max_created_ts, time.time(),
+                         self.resume_min_id, self.resume_max_id)
+
+
+class WatermarkStore:
+    """
+    Fichier JSON {clé: Watermark} (ex: "catalog:10", "query:robe"), remplacé
+    atomiquement à chaque avance. Un watermark ne recule jamais.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._marks: Dict[str, Watermark] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._marks = {k: Watermark(**v) for k, v in json.load(f).items()}
+
+    def get(self, key: str) -> Optional[Watermark]:
+        return self._marks.get(key)
+
+    def record_run(self, key: str, high_id: int, high_ts: int, low_id: int, complete: bool,
+                   failed_min: Optional[int] = None, resumed: bool = False) -> Watermark:
+        """Applique Watermark.after_run et sauvegarde"""
+        with self._lock:
+            mark = (self._marks.get(key) or Watermark()).after_run(
+                high_id, high_ts, low_id, complete, failed_min, resumed)
+            self._marks[key] = mark
+            self._save()
+            return mark
+
+    def advance(self, key: str, max_id: int, max_created_ts: int = 0) -> Watermark:
+        with self._lock:
+            mark = self._marks.get(key) or Watermark()
+            max_id = max(mark.max_id, int(max_id))
+            keep = mark.resume_min_id > max_id
+            mark = Watermark(max_id, max(mark.max_created_ts, int(max_created_ts)), time.time(),
+                             mark.resume_min_id if keep else 0, mark.resume_max_id if keep else 0)
+            self._marks[key] = mark
+            self._save()
+            return mark
+
+    def reset(self, key: str):
+        with self._lock:
+            self._marks.pop(key, None)
+            self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({k: asdict(v) for k, v in self._marks.items()}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {k: asdict(v) for k, v in self._marks.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watermarks du crawl incrémental")
+    parser.add_argument("command", nargs="?", default="show", choices=["show", "reset"])
+    parser.add_argument("key", nargs="?")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    store = WatermarkStore(args.path)
+    if args.command == "reset":
+        if not args.key:
+            parser.error("reset requiert une clé (ex: catalog:10)")
+        store.reset(args.key)
+    print(json.dumps(store.stats(), indent=2))
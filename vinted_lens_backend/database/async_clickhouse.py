@@ -0,0 +1,207 @@
+# database/async_clickhouse.py
+# Client ClickHouse asynchrone (httpx, connexions poolées) pour le chemin de requête de l'API
+
+import asyncio
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from database.clickhouse_setup import ClickHouseVectorDB, PRODUCT_COLUMNS, SEARCH_MANY_CHUNK
+from database.filter_planner import SearchFilters
+from database.native_format import decode_native
+
+
+class AsyncClickHouseVectorDB(ClickHouseVectorDB):
+    """
+    Même base que ClickHouseVectorDB (SQL, paramètres typés, décodage Native),
+    avec des variantes `a*` awaitables : la boucle asyncio n'est jamais bloquée
+    par une requête ClickHouse. Le scoring d'un index en mémoire (CPU) est
+    délégué à `executor`. Les méthodes synchrones restent utilisables (jobs, index).
+    """
+
+    def __init__(self, host="http://localhost:8123", database="vinted_lens",
+                 pool_size: int = 16, timeout_s: float = 10.0, executor=None, **kwargs):
+        super().__init__(host=host, database=database, pool_size=pool_size, **kwargs)
+        self.pool_size = pool_size
+        self.executor = executor
+        self.client = httpx.AsyncClient(
+            base_url=host,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout_s,
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    # --- transport ---
+    async def aexecute_query(self, query: str, params: Optional[Dict[str, Any]] = None,
+                             settings: Optional[Dict[str, Any]] = None):
+        try:
+            response = await self.client.post("/", content=query.encode('utf-8'),
+                                              params=self._query_params(params, settings))
+            response.raise_for_status()
+            return response.text.strip()
+        except Exception as e:
+            print(f"❌ Erreur requête: {e}")
+            return None
+
+    async def aquery_native(self, query: str, params: Optional[Dict[str, Any]] = None,
+                            settings: Optional[Dict[str, Any]] = None, form: bool = False) -> Dict[str, Any]:
+        if form:
+            url_params, fields = self._form_request(query + "\nFORMAT Native", params, settings)
+            response = await self.client.post("/", files=fields, params=url_params)
+        else:
+            response = await self.client.post("/", content=(query + "\nFORMAT Native").encode('utf-8'),
+                                              params=self._query_params(params, settings))
+        response.raise_for_status()
+        columns, _ = decode_native(response.content)
+        return columns
+
+    # --- recherche ---
+    async def afetch_products(self, ids: List[int], filters: Optional[SearchFilters] = None) -> Dict[int, Dict]:
+        if not len(ids):
+            return {}
+        columns = await self.aquery_native(*self._products_query(ids, filters))
+        return {row['id']: row for row in self._rows(columns, PRODUCT_COLUMNS)}
+
+    async def awith_metadata(self, ids, scores, filters: Optional[SearchFilters] = None) -> List[Dict]:
+        """(ids, scores) classés -> produits complets (ex: classement mis en cache)"""
+        return self._merge_metadata(ids, scores, await self.afetch_products(ids, filters))
+
+    async def asearch_exact(self, query_embedding: np.ndarray, limit: int = 10,
+                            platform_filter: Optional[str] = None,
+                            category_filter: Optional[str] = None, mode: str = 'ann',
+                            filters: Optional[SearchFilters] = None,
+                            raise_errors: bool = False) -> List[Dict]:
+        try:
+            start_time = time.time()
+            search_query, params = self._exact_search_query(
+                query_embedding, limit, platform_filter, category_filter, mode, filters
+            )
+            columns = await self.aquery_native(search_query, params)
+            ids, scores = columns.get('id', []), columns.get('similarity', [])
+            products = await self.awith_metadata(ids, scores)
+            print(f"🔍 Recherche ClickHouse: {len(products)} résultats en {time.time() - start_time:.3f}s")
+            return products
+        except Exception as e:
+            print(f"❌ Erreur recherche: {e}")
+            if raise_errors:
+                raise
+            return []
+
+    async def asearch_similar(self, query_embedding: np.ndarray, limit: int = 10,
+                              platform_filter: Optional[str] = None,
+                              category_filter: Optional[str] = None,
+                              mode: Optional[str] = None,
+                              filters: Optional[SearchFilters] = None,
+                              raise_errors: bool = False) -> List[Dict]:
+        mode = mode or self.search_mode
+        filters = SearchFilters.of(filters, platform_filter, category_filter)
+        if filters:
+            return (await self.asearch_filtered(query_embedding, limit, filters, mode, raise_errors))[0]
+        if mode == 'ann' and self.vector_index is not None:
+            try:
+                start_time = time.time()
+                ids, scores = await self._aindex_search(query_embedding, limit)
+                products = await self.awith_metadata(ids, scores)
+                print(f"🔍 Recherche index: {len(products)} résultats en {time.time() - start_time:.3f}s")
+                return products
+            except Exception as e:
+                print(f"⚠️ Index vectoriel indisponible, fallback scan exact: {e}")
+        return await self.asearch_exact(query_embedding, limit, mode=mode, raise_errors=raise_errors)
+
+    async def _aindex_search(self, query_embedding: np.ndarray, limit: int):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.vector_index.search,
+            np.asarray(query_embedding, dtype=np.float32), limit
+        )
+
+    async def asearch_filtered(self, query_embedding: np.ndarray, limit: int, filters: SearchFilters,
+                               mode: Optional[str] = None, raise_errors: bool = False) -> tuple:
+        """Version awaitable de search_filtered : (produits, FilterPlan exécuté)"""
+        mode = mode or self.search_mode
+        if self.planner.column_stats is None:
+            await asyncio.to_thread(self.planner.refresh)   # premier chargement, une seule fois
+        else:
+            self.planner.refresh_background()
+        plan = self.planner.plan(filters, limit)
+        if plan.strategy == 'postfilter':
+            try:
+                start_time = time.time()
+                ids, scores = await self._aphase1(query_embedding, plan.fetch, mode)
+                products = (await self.awith_metadata(ids, scores, filters))[:limit]
+                if len(products) >= limit or len(ids) < plan.fetch:
+                    print(f"🔍 Recherche post-filtrée ({plan.fetch} candidats): "
+                          f"{len(products)} résultats en {time.time() - start_time:.3f}s")
+                    return products, plan
+                self.planner.record_fallback(plan)
+            except Exception as e:
+                print(f"❌ Erreur recherche post-filtrée: {e}")
+                self.planner.record_fallback(plan)
+        return await self.asearch_exact(query_embedding, limit, mode='exact', filters=filters,
+                                        raise_errors=raise_errors), plan
+
+    async def _aphase1(self, query_embedding: np.ndarray, limit: int, mode: str):
+        """(ids, scores) classés sans filtre : index en mémoire (ann) ou SQL du mode"""
+        if mode == 'ann' and self.vector_index is not None:
+            try:
+                return await self._aindex_search(query_embedding, limit)
+            except Exception as e:
+                print(f"⚠️ Index vectoriel indisponible, fallback scan exact: {e}")
+        columns = await self.aquery_native(*self._exact_search_query(query_embedding, limit, mode=mode))
+        return columns.get('id', []), columns.get('similarity', [])
+
+    async def asearch_similar_many(self, query_embeddings: np.ndarray, limit: int = 10,
+                                   mode: Optional[str] = None,
+                                   filters: Optional[SearchFilters] = None) -> List[List[Dict]]:
+        """
+        Version awaitable de search_similar_many. Les tranches passent l'une après
+        l'autre : chacune est déjà un scan complet parallélisé par ClickHouse.
+        Modes non partageables : au plus pool_size / 2 recherches en vol (au-delà, httpx
+        attendrait une connexion jusqu'au PoolTimeout, et les recherches unitaires de
+        l'API gardent ainsi des connexions). Les erreurs sont propagées.
+        """
+        mode = mode or self.search_mode
+        queries = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        start_time = time.time()
+        if not self.batchable(mode):
+            slots = asyncio.Semaphore(max(1, self.pool_size // 2))
+
+            async def one(q: np.ndarray) -> List[Dict]:
+                async with slots:
+                    return await self.asearch_similar(q, limit, mode=mode, filters=filters, raise_errors=True)
+
+            return list(await asyncio.gather(*(one(q) for q in queries)))
+
+        norms = np.linalg.norm(queries, axis=1)
+        valid = np.flatnonzero(np.isfinite(norms) & (norms > 0))
+        results: List[List[Dict]] = [[] for _ in range(len(queries))]
+
+        for start in range(0, len(valid), SEARCH_MANY_CHUNK):
+            rows = valid[start:start + SEARCH_MANY_CHUNK]
+            ranked = await self._arank_many(queries[rows], limit, mode, filters)
+            metadata = await self.afetch_products(self._ranked_ids(ranked))
+            for row, (ids, scores) in zip(rows, ranked):
+                results[row] = self._merge_metadata(ids, scores, metadata)
+        print(f"🔍 Recherche multi-requêtes: {len(queries)} requêtes en {time.time() - start_time:.3f}s")
+        return results
+
+    async def _arank_many(self, queries: np.ndarray, limit: int, mode: str,
+                          filters: Optional[SearchFilters]) -> List[tuple]:
+        if mode == 'ann' and self.vector_index is not None and not filters:
+            try:
+                found = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.vector_index.search_many, queries, limit
+                )
+                return list(zip(*found))
+            except Exception as e:
+                print(f"⚠️ Index vectoriel indisponible, fallback scan exact: {e}")
+        columns = await self.aquery_native(*self._many_search_query(queries, limit, filters), form=True)
+        return self._ranked_rows(columns, len(queries))
+
+    async def aget_stats(self) -> Dict:
+        """Version légère de get_stats (total seulement) pour /health"""
+        total = await self.aexecute_query(self._count_query())
+        return {'total_products': int(total) if total else 0}
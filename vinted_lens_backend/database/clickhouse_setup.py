@@ -1,69 +1,235 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Any
 import time
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.native_format import decode_native, encode_native
+from utils.vector_ops import quantize_int8, to_bfloat16, sign_codes
+from database import ivf
+from database.filter_planner import FilterPlanner, SearchFilters
+
+EMBEDDING_DIM = 512     # CLIP ViT-B/32
+# new_product_ids : µs depuis l'epoch (~1.7e15), bien au-dessus des ids Vinted
+LOCAL_ID_MIN = 10 ** 15
+
+# Colonnes de métadonnées renvoyées par les recherches
+PRODUCT_COLUMNS = ['id', 'title', 'price', 'platform', 'image_url',
+                   'category', 'color', 'brand', 'size', 'condition']
+PRODUCT_TIMESTAMPS = ['created_at', 'updated_at']
+
+# Stockage compact optionnel des embeddings, scanné en phase 1 à la place de
+# product_embeddings (qui reste la copie pleine précision du re-rank) ;
+# créé / rempli par database/migrate_compact.py
+COMPACT_TABLES = {'int8': 'product_embeddings_int8', 'bfloat16': 'product_embeddings_bf16'}
+EMBEDDING_LAYOUTS = ('float32',) + tuple(COMPACT_TABLES)
+DEFAULT_EMBEDDING_LAYOUT = os.environ.get("EMBEDDING_LAYOUT", "float32")
+DEFAULT_RERANK = int(os.environ.get("EMBEDDING_RERANK", "200"))
+BFLOAT16_SETTINGS = {'allow_experimental_bfloat16_type': 1}
+
+# Modes de recherche (par requête) :
+#   exact  : scan Float32 complet de product_embeddings
+#   binary : préfiltre Hamming sur les codes de signe 512 bits (product_codes), re-rank Float32
+#   ann    : index en mémoire s'il est attaché, sinon phase 1 configurée (IVF / compact / Float32)
+SEARCH_MODES = ('exact', 'binary', 'ann')
+DEFAULT_SEARCH_MODE = os.environ.get("SEARCH_MODE", "ann")
+DEFAULT_BINARY_CANDIDATES = int(os.environ.get("BINARY_CANDIDATES", "2000"))
+CODES_TABLE = "product_codes"
+CODE_WORDS = 8      # 512 bits = 8 x UInt64
+TABLE_CHECK_S = 60
+
+# search_similar_many : requêtes par scan partagé. ~7 Ko de texte par vecteur (~235 Ko
+# pour 32) : la requête et ses paramètres partent dans le corps multipart, pas dans l'URL
+SEARCH_MANY_CHUNK = int(os.environ.get("SEARCH_MANY_CHUNK", "32"))
+
+# Index de saut de products (filtres de recherche) : nom, expression, type, granularité
+SKIP_INDEXES = [
+    ('idx_price', 'price', 'minmax', 4),
+    ('idx_category', 'category', 'set(1024)', 4),
+    ('idx_brand', 'brand', 'bloom_filter(0.01)', 4),
+    ('idx_size', 'size', 'set(256)', 4),
+]
+
+
+def escape_string(value: str) -> str:
+    """Échappement ClickHouse (format Escaped) : antislash, quote, tabulation, saut de ligne"""
+    return (value.replace('\\', '\\\\').replace("'", "\\'")
+            .replace('\t', '\\t').replace('\n', '\\n'))
+
+
+def format_query_param(value: Any) -> str:
+    """
+    Sérialise une valeur pour un paramètre typé ClickHouse ({name:Type}).
+    Une chaîne seule est lue au format Escaped ; dans un tableau, elle est entre quotes.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            # repr float32 le plus court qui se relit à l'identique : pas de perte de précision
+            return '[' + ','.join(map(str, value.astype(np.float32, copy=False).ravel())) + ']'
+        return '[' + ','.join(map(str, value.ravel().tolist())) + ']'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(f"'{escape_string(v)}'" if isinstance(v, str) else format_query_param(v)
+                              for v in value) + ']'
+    if isinstance(value, str):
+        return escape_string(value)
+    return str(value)
+
 
 class ClickHouseVectorDB:
-    def __init__(self, host="http://localhost:8123", database="vinted_lens"):
+    def __init__(self, host="http://localhost:8123", database="vinted_lens", pool_size: int = 16,
+                 embedding_layout: str = DEFAULT_EMBEDDING_LAYOUT, rerank: int = DEFAULT_RERANK,
+                 ivf_nprobe: int = ivf.DEFAULT_NPROBE, search_mode: str = DEFAULT_SEARCH_MODE,
+                 binary_candidates: int = DEFAULT_BINARY_CANDIDATES):
+        if embedding_layout not in EMBEDDING_LAYOUTS:
+            raise ValueError(f"embedding_layout inconnu: {embedding_layout} ({', '.join(EMBEDDING_LAYOUTS)})")
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"search_mode inconnu: {search_mode} ({', '.join(SEARCH_MODES)})")
         self.host = host
         self.database = database
+        # Mode par défaut de search_similar, et candidats du préfiltre binaire
+        self.search_mode = search_mode
+        self.binary_candidates = binary_candidates
+        self._tables: Dict[str, tuple] = {}
+        # Phase 1 sur la table compacte (int8 / bfloat16), re-rank exact des `rerank` meilleurs
+        self.embedding_layout = embedding_layout
+        self.rerank = rerank
+        # IVF : phase 1 limitée aux `ivf_nprobe` clusters les plus proches (0 = désactivé)
+        self.ivf_nprobe = ivf_nprobe
+        self.ivf: Optional[ivf.IVFCodebook] = None
+        self._ivf_checked = 0.0
         self.session = requests.Session()
         self.session.headers.update({
             'Content-Type': 'application/json'
         })
+        # Connexions keep-alive réutilisées entre requêtes (et entre threads)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Settings ajoutés à chaque requête (ex: log_comment pour les benchmarks)
+        self.default_settings: Dict[str, Any] = {}
+        # Index vectoriel en mémoire optionnel (ex: HNSWIndex), branché via attach_index
+        self.vector_index = None
+        # Choix prefilter / postfilter des recherches filtrées (statistiques de colonnes en cache)
+        self.planner = FilterPlanner(self)
+        # Génération d'ids produits (new_product_ids)
+        self._id_lock = threading.Lock()
+        self._last_id = 0
+        self.derived_errors: Dict[str, int] = {}    # table dérivée -> lots en échec (à réparer)
         
-    def execute_query(self, query: str, params: List = None):
-        """Exécute une requête ClickHouse"""
+    def _query_params(self, params: Optional[Dict[str, Any]],
+                      settings: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+        """Paramètres d'URL : base + settings (query_id, max_threads...) + param_<nom> typés"""
+        url_params = {'database': self.database}
+        url_params.update({k: str(v) for k, v in {**self.default_settings, **(settings or {})}.items()})
+        for name, value in (params or {}).items():
+            url_params[f'param_{name}'] = format_query_param(value)
+        return url_params
+
+    def _form_request(self, query: str, params: Optional[Dict[str, Any]],
+                      settings: Optional[Dict[str, Any]] = None) -> tuple:
+        """(paramètres d'URL, champs multipart) : requête et param_<nom> passent dans le corps"""
+        fields = {'query': (None, query)}
+        fields.update({f'param_{name}': (None, format_query_param(value))
+                       for name, value in (params or {}).items()})
+        return self._query_params(None, settings), fields
+
+    def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None,
+                      settings: Optional[Dict[str, Any]] = None):
+        """Exécute une requête ClickHouse (params: valeurs des placeholders {nom:Type})"""
         try:
-            url = f"{self.host}/?database={self.database}"
-            if params:
-                # Pour les requêtes avec paramètres
-                response = self.session.post(url, data=query, params={'param_' + str(i): p for i, p in enumerate(params)})
-            else:
-                response = self.session.post(url, data=query)
-            
+            response = self.session.post(self.host + "/", data=query.encode('utf-8'),
+                                         params=self._query_params(params, settings))
             response.raise_for_status()
             return response.text.strip()
         except Exception as e:
             print(f"❌ Erreur requête: {e}")
             return None
+
+    def query_native(self, query: str, params: Optional[Dict[str, Any]] = None,
+                     settings: Optional[Dict[str, Any]] = None, form: bool = False) -> Dict[str, Any]:
+        """
+        Exécute un SELECT et décode la réponse binaire colonnaire (FORMAT Native).
+        Lève une exception en cas d'erreur.
+
+        Args:
+            form: paramètres envoyés en multipart/form-data (gros vecteurs) plutôt qu'en URL
+
+        Returns:
+            nom de colonne -> np.ndarray (numérique, Array en 2D) ou list (String)
+        """
+        if form:
+            url_params, fields = self._form_request(query + "\nFORMAT Native", params, settings)
+            response = self.session.post(self.host + "/", files=fields, params=url_params)
+        else:
+            response = self.session.post(self.host + "/", data=(query + "\nFORMAT Native").encode('utf-8'),
+                                         params=self._query_params(params, settings))
+        response.raise_for_status()
+        columns, _ = decode_native(response.content)
+        return columns
+
+    @staticmethod
+    def _rows(columns: Dict[str, Any], names: List[str]) -> List[Dict]:
+        """Colonnes décodées -> liste de dicts produit"""
+        if not columns or not len(columns.get(names[0], [])):
+            return []
+        rows = []
+        for values in zip(*(columns[n] for n in names)):
+            row = dict(zip(names, values))
+            row['id'] = int(row['id'])
+            row['price'] = round(float(row['price']), 2)
+            rows.append(row)
+        return rows
     
-    def init_database(self):
-        """Initialise la base et les tables"""
-        print("🚀 Initialisation ClickHouse...")
-        
-        # 1. Créer la base de données
-        create_db = f"CREATE DATABASE IF NOT EXISTS {self.database}"
-        result = self.execute_query(create_db)
-        print("✅ Base de données créée")
-        
-        # 2. Créer la table principale des produits
-        create_table = f"""
-        CREATE TABLE IF NOT EXISTS {self.database}.products (
+    def products_table_ddl(self, table: str) -> str:
+        """DDL de la table products (schéma dénormalisé : l'embedding vit dans product_embeddings)"""
+        indexes = ",\n            ".join(f"INDEX {name} {expr} TYPE {kind} GRANULARITY {granularity}"
+                                          for name, expr, kind, granularity in SKIP_INDEXES)
+        return f"""
+        CREATE TABLE IF NOT EXISTS {self.database}.{table} (
             id UInt64,
             title String,
             price Float32,
             platform String,
             image_url String,
-            embedding Array(Float32),
             category String,
             color String,
             brand String,
             size String,
             condition String,
             created_at DateTime DEFAULT now(),
-            updated_at DateTime DEFAULT now()
+            updated_at DateTime DEFAULT now(),
+            {indexes}
         ) ENGINE = MergeTree()
-        ORDER BY (platform, category, id)
+        ORDER BY id
         PARTITION BY platform
-        SETTINGS index_granularity = 8192
+        SETTINGS index_granularity = 1024
         """
+
+    def init_database(self):
+        """Initialise la base et les tables"""
+        print("🚀 Initialisation ClickHouse...")
+        
+        # 1. Créer la base de données
+        create_db = f"CREATE DATABASE IF NOT EXISTS {self.database}"
+        result = self.execute_query(create_db)
+        print("✅ Base de données créée")
+        
+        # 2. Créer la table principale des produits (métadonnées seulement,
+        #    triée par id pour la phase 2 de la recherche : lookup par clé primaire)
+        create_table = self.products_table_ddl("products")
         
         result = self.execute_query(create_table)
+        # tables existantes : index de saut ajoutés (appliqués aux nouvelles parts ;
+        # python -m database.migrate_indexes les matérialise sur l'existant)
+        for sql in self.skip_index_ddl():
+            self.execute_query(sql)
         print("✅ Table products créée")
         
-        # 3. Créer index pour recherche rapide
+        # 3. Table étroite (id, embedding) : seule table scannée en phase 1
         create_index = f"""
         CREATE TABLE IF NOT EXISTS {self.database}.product_embeddings (
             product_id UInt64,
@@ -77,119 +243,415 @@ class ClickHouseVectorDB:
         result = self.execute_query(create_index)
         print("✅ Table embeddings créée")
         
+        # 4. Codes binaires (préfiltre du mode binary)
+        self.execute_query(self.codes_table_ddl())
+        print(f"✅ Table {CODES_TABLE} créée")
+        
+        # 5. Copie compacte scannée en phase 1 (optionnelle)
+        if self.compact_table:
+            self.execute_query(self.compact_table_ddl(self.embedding_layout),
+                               settings=BFLOAT16_SETTINGS if self.embedding_layout == 'bfloat16' else None)
+            print(f"✅ Table {self.compact_table} créée")
+        
         return True
+
+    def skip_index_ddl(self, materialize: bool = False) -> List[str]:
+        """ALTER idempotents ajoutant (ou matérialisant) les index de saut de products"""
+        if materialize:
+            return [f"ALTER TABLE {self.database}.products MATERIALIZE INDEX {name}"
+                    for name, _, _, _ in SKIP_INDEXES]
+        return [f"ALTER TABLE {self.database}.products ADD INDEX IF NOT EXISTS "
+                f"{name} {expr} TYPE {kind} GRANULARITY {granularity}"
+                for name, expr, kind, granularity in SKIP_INDEXES]
+
+    @property
+    def compact_table(self) -> Optional[str]:
+        return COMPACT_TABLES.get(self.embedding_layout)
+
+    def compact_table_ddl(self, layout: str) -> str:
+        """
+        DDL d'une copie compacte des embeddings (512 octets int8 + échelle, ou
+        1 Ko BFloat16 par ligne, contre 2 Ko en Float32)
+        """
+        columns = {
+            'int8': "embedding Array(Int8),\n            scale Float32,",
+            'bfloat16': "embedding Array(BFloat16),",
+        }[layout]
+        return f"""
+        CREATE TABLE IF NOT EXISTS {self.database}.{COMPACT_TABLES[layout]} (
+            product_id UInt64,
+            {columns}
+            norm Float32
+        ) ENGINE = MergeTree()
+        ORDER BY product_id
+        """
+
+    def codes_table_ddl(self) -> str:
+        """
+        Codes de signe 512 bits en 8 colonnes UInt64 (64 octets/ligne) : la distance de
+        Hamming se calcule en 8 bitCount(bitXor) sur colonnes simples, sans lambda ni offsets
+        """
+        words = ",\n            ".join(f"w{k} UInt64" for k in range(CODE_WORDS))
+        return f"""
+        CREATE TABLE IF NOT EXISTS {self.database}.{CODES_TABLE} (
+            product_id UInt64,
+            {words}
+        ) ENGINE = MergeTree()
+        ORDER BY product_id
+        """
+
+    def table_exists(self, table: str) -> bool:
+        """EXISTS TABLE, mis en cache (une absence est revérifiée toutes les TABLE_CHECK_S secondes)"""
+        cached = self._tables.get(table)
+        if cached and (cached[0] or time.time() - cached[1] < TABLE_CHECK_S):
+            return cached[0]
+        result = self.execute_query(f"EXISTS TABLE {self.database}.{table}")
+        exists = result == "1"
+        self._tables[table] = (exists, time.time())
+        return exists
+
+    def refresh_ivf(self, force: bool = False) -> Optional["ivf.IVFCodebook"]:
+        """Codebook IVF courant, relu en base au plus toutes les IVF_RELOAD_S secondes"""
+        if not force and time.time() - self._ivf_checked < ivf.RELOAD_S:
+            return self.ivf
+        self._ivf_checked = time.time()
+        book = ivf.load_codebook(self)
+        if book is not None and (self.ivf is None or book.version != self.ivf.version):
+            print(f"🧮 Codebook IVF v{book.version} chargé ({book.nlist} clusters)")
+            self.ivf = book
+        return self.ivf
+
+    def _compact_columns(self, ids: np.ndarray, embeddings: np.ndarray, norms: np.ndarray) -> List[tuple]:
+        if self.embedding_layout == 'int8':
+            q, scale = quantize_int8(embeddings)
+            return [('product_id', 'UInt64', ids), ('embedding', 'Array(Int8)', q),
+                    ('scale', 'Float32', scale), ('norm', 'Float32', norms)]
+        return [('product_id', 'UInt64', ids), ('embedding', 'Array(BFloat16)', to_bfloat16(embeddings)),
+                ('norm', 'Float32', norms)]
     
+    def insert_native(self, table: str, columns: List[tuple]):
+        """INSERT colonnaire binaire : un bloc Native dans le corps, une requête HTTP"""
+        names = ', '.join(name for name, _, _ in columns)
+        params = self._query_params(None, BFLOAT16_SETTINGS if any('BFloat16' in t for _, t, _ in columns) else None)
+        params['query'] = f"INSERT INTO {self.database}.{table} ({names}) FORMAT Native"
+        response = self.session.post(self.host + "/", data=encode_native(columns), params=params)
+        response.raise_for_status()
+
+    def new_product_ids(self, n: int) -> np.ndarray:
+        """Ids croissants basés sur l'horloge (µs), sans collision dans le processus"""
+        with self._id_lock:
+            start = max(int(time.time() * 1000000), self._last_id + 1)
+            self._last_id = start + n - 1
+        return np.arange(start, start + n, dtype=np.uint64)
+
+    def _product_columns(self, products: List[Dict], ids: np.ndarray) -> List[tuple]:
+        columns = [('id', 'UInt64', ids), ('title', 'String', [p.get('title', '') for p in products]),
+                   ('price', 'Float32', np.array([float(p.get('price') or 0) for p in products]))]
+        columns += [(name, 'String', [p.get(name, '') for p in products])
+                    for name in PRODUCT_COLUMNS[3:]]
+        # created_at / updated_at (datetime) si fournis pour tout le lot, sinon DEFAULT now()
+        for name in PRODUCT_TIMESTAMPS:
+            if all(p.get(name) is not None for p in products):
+                columns.append((name, 'DateTime',
+                                np.array([int(p[name].timestamp()) for p in products], dtype=np.uint32)))
+        return columns
+
+    def add_products(self, products: List[Dict], embeddings: np.ndarray) -> List[int]:
+        """
+        Ajoute un lot de produits : un INSERT Native par table pour tout le lot.
+
+        Args:
+            products: métadonnées (colonnes de PRODUCT_COLUMNS ; `id` optionnel, généré sinon ;
+                created_at / updated_at optionnels, en datetime)
+            embeddings: np.ndarray float32 (N, 512), ligne i = produit i
+
+        Returns:
+            ids des produits insérés (exception si products / product_embeddings échouent ;
+            les tables dérivées sont best-effort, voir derived_errors)
+        """
+        if not len(products):
+            return []
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(products), -1)
+        given = [p.get('id') for p in products]
+        missing = iter(self.new_product_ids(sum(pid is None for pid in given)))
+        ids = np.array([pid if pid is not None else next(missing) for pid in given], dtype=np.uint64)
+
+        # products d'abord : un id scoré en phase 1 a toujours ses métadonnées
+        self.insert_native('products', self._product_columns(products, ids))
+        norms = np.linalg.norm(embeddings, axis=1)
+        self.insert_native('product_embeddings', [
+            ('product_id', 'UInt64', ids),
+            ('embedding', 'Array(Float32)', embeddings),
+            ('norm', 'Float32', norms),
+        ])
+        # Tables dérivées : au-delà de ce point le lot est stocké, une erreur ici ne doit
+        # pas le faire compter en échec (il serait réinséré en double au prochain run).
+        # Les lignes manquantes sont reprises par migrate_compact / migrate_codes
+        # (ids absents uniquement) et `python -m database.ivf reconcile`.
+        if self.compact_table:
+            self._insert_derived(self.compact_table, "python -m database.migrate_compact", len(ids),
+                                 lambda: self._compact_columns(ids, embeddings, norms))
+        if self.table_exists(CODES_TABLE):
+            def code_columns():
+                codes = sign_codes(embeddings)
+                return [('product_id', 'UInt64', ids)] + \
+                    [(f'w{k}', 'UInt64', codes[:, k]) for k in range(CODE_WORDS)]
+            self._insert_derived(CODES_TABLE, "python -m database.migrate_codes", len(ids),
+                                 code_columns)
+        # affectation au cluster le plus proche : la table IVF suit les inserts
+        try:
+            book = self.refresh_ivf()
+        except Exception as e:
+            book = None
+            self._derived_failed(ivf.IVF_TABLE, "python -m database.ivf reconcile", len(ids), e)
+        if book is not None:
+            self._insert_derived(ivf.IVF_TABLE, "python -m database.ivf reconcile", len(ids),
+                                 lambda: ivf.ivf_columns(book, ids, embeddings, norms))
+        return [int(pid) for pid in ids]
+
+    def _insert_derived(self, table: str, repair: str, rows: int, columns):
+        """Insert best-effort d'une table dérivée de product_embeddings (`columns` : fabrique)"""
+        try:
+            self.insert_native(table, columns())
+        except Exception as e:
+            self._derived_failed(table, repair, rows, e)
+
+    def _derived_failed(self, table: str, repair: str, rows: int, error: Exception):
+        self.derived_errors[table] = self.derived_errors.get(table, 0) + 1
+        print(f"⚠️ Insert {table} en échec ({rows} lignes, produits déjà stockés) : {error} "
+              f"-> réparer avec `{repair}`")
+
     def add_product(self, product_data: Dict):
-        """Ajoute un produit avec son embedding"""
+        """Ajoute un produit avec son embedding (lot de 1 ; préférer add_products / ProductWriter)"""
         try:
-            # Générer ID unique basé sur timestamp
-            product_id = int(time.time() * 1000000) + np.random.randint(0, 1000)
-            
-            # Calculer la norme de l'embedding pour optimiser la recherche
-            embedding = product_data['embedding']
-            if isinstance(embedding, np.ndarray):
-                embedding = embedding.tolist()
-            
-            norm = float(np.linalg.norm(embedding))
-            
-            # Insérer dans la table principale
-            insert_product = f"""
-            INSERT INTO {self.database}.products 
-            (id, title, price, platform, image_url, embedding, category, color, brand, size, condition)
-            VALUES 
-            ({product_id}, '{product_data.get('title', '').replace("'", "''")}', 
-             {product_data.get('price', 0)}, '{product_data.get('platform', '')}',
-             '{product_data.get('image_url', '')}', {embedding},
-             '{product_data.get('category', '')}', '{product_data.get('color', '')}',
-             '{product_data.get('brand', '')}', '{product_data.get('size', '')}',
-             '{product_data.get('condition', '')}')
-            """
-            
-            result1 = self.execute_query(insert_product)
-            
-            # Insérer dans la table des embeddings
-            insert_embedding = f"""
-            INSERT INTO {self.database}.product_embeddings 
-            (product_id, embedding, norm)
-            VALUES ({product_id}, {embedding}, {norm})
-            """
-            
-            result2 = self.execute_query(insert_embedding)
-            
-            return product_id
+            product = {k: v for k, v in product_data.items() if k != 'embedding'}
+            return self.add_products([product], np.asarray(product_data['embedding'])[None, :])[0]
         except Exception as e:
             print(f"❌ Erreur ajout produit: {e}")
             return None
     
+    def attach_index(self, index):
+        """Branche un index vectoriel en mémoire (doit exposer search(query, k) -> (ids, scores))"""
+        self.vector_index = index
+        print(f"🧭 Index vectoriel attaché: {type(index).__name__}")
+
     def search_similar(self, query_embedding: np.ndarray, limit: int = 10, 
                       platform_filter: Optional[str] = None, 
-                      category_filter: Optional[str] = None):
-        """Recherche par similarité cosinus optimisée"""
+                      category_filter: Optional[str] = None, mode: Optional[str] = None,
+                      filters: Optional[SearchFilters] = None, raise_errors: bool = False):
+        """
+        Recherche par similarité cosinus optimisée (mode : exact / binary / ann, voir SEARCH_MODES).
+        Erreur ClickHouse : [] (ou exception avec raise_errors)
+        """
+        mode = mode or self.search_mode
+        filters = SearchFilters.of(filters, platform_filter, category_filter)
+        if filters:
+            return self.search_filtered(query_embedding, limit, filters, mode, raise_errors)[0]
+        # Index en mémoire : scoring local, ClickHouse ne sert qu'aux métadonnées
+        if mode == 'ann' and self.vector_index is not None:
+            try:
+                return self._search_with_index(query_embedding, limit)
+            except Exception as e:
+                print(f"⚠️ Index vectoriel indisponible, fallback scan exact: {e}")
+        return self.search_exact(query_embedding, limit, mode=mode, raise_errors=raise_errors)
+
+    def search_filtered(self, query_embedding: np.ndarray, limit: int, filters: SearchFilters,
+                        mode: Optional[str] = None, raise_errors: bool = False) -> tuple:
+        """
+        Recherche filtrée planifiée (voir database/filter_planner.py) :
+        - prefilter : scoring exact des seuls ids filtrés (index de saut de products,
+          puis clé primaire de product_embeddings via le IN)
+        - postfilter : phase 1 du mode sans filtre sur plan.fetch candidats, filtre
+          appliqué au lookup des métadonnées ; repli sur prefilter si trop peu restent
+
+        Returns:
+            (produits, FilterPlan exécuté)
+        """
+        mode = mode or self.search_mode
+        if self.planner.column_stats is None:
+            self.planner.refresh()          # premier chargement : attendu, une seule fois
+        else:
+            self.planner.refresh_background()
+        plan = self.planner.plan(filters, limit)
+        if plan.strategy == 'postfilter':
+            try:
+                start_time = time.time()
+                ids, scores = self._phase1(query_embedding, plan.fetch, mode)
+                products = self._with_metadata(ids, scores, filters)[:limit]
+                if len(products) >= limit or len(ids) < plan.fetch:
+                    print(f"🔍 Recherche post-filtrée ({plan.fetch} candidats): "
+                          f"{len(products)} résultats en {time.time() - start_time:.3f}s")
+                    return products, plan
+                self.planner.record_fallback(plan)
+            except Exception as e:
+                print(f"❌ Erreur recherche post-filtrée: {e}")
+                self.planner.record_fallback(plan)
+        return self.search_exact(query_embedding, limit, mode='exact', filters=filters,
+                                 raise_errors=raise_errors), plan
+
+    def _phase1(self, query_embedding: np.ndarray, limit: int, mode: str) -> tuple:
+        """(ids, scores) classés sans filtre : index en mémoire (ann) ou SQL du mode"""
+        if mode == 'ann' and self.vector_index is not None:
+            try:
+                return self.vector_index.search(np.asarray(query_embedding, dtype=np.float32), limit)
+            except Exception as e:
+                print(f"⚠️ Index vectoriel indisponible, fallback scan exact: {e}")
+        if mode == 'ann' and self.ivf_nprobe > 0:
+            self.refresh_ivf()
+        columns = self.query_native(*self._exact_search_query(query_embedding, limit, mode=mode))
+        return columns.get('id', []), columns.get('similarity', [])
+
+    def _search_with_index(self, query_embedding: np.ndarray, limit: int):
+        """Top-k via l'index en mémoire puis récupération des métadonnées par id"""
+        start_time = time.time()
+        ids, scores = self.vector_index.search(np.asarray(query_embedding, dtype=np.float32), limit)
+        products = self._with_metadata(ids, scores)
+
+        search_time = time.time() - start_time
+        print(f"🔍 Recherche index: {len(products)} résultats en {search_time:.3f}s")
+        return products
+
+    def _exact_search_query(self, query_embedding: np.ndarray, limit: int,
+                            platform_filter: Optional[str] = None,
+                            category_filter: Optional[str] = None, mode: str = 'ann',
+                            filters: Optional[SearchFilters] = None):
+        """SQL + paramètres typés de la phase 1 (partagés par les clients sync et async)"""
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        params = {
+            'query_embedding': query_embedding,
+            'query_norm': float(np.linalg.norm(query_embedding)),
+            'limit': int(limit),
+        }
+        
+        where_clause = self._filter_clause(SearchFilters.of(filters, platform_filter, category_filter), params)
+        
+        # Le vecteur est un paramètre typé, le texte SQL est constant
+        if mode == 'binary':
+            return self._binary_search_query(query_embedding, where_clause, params), params
+        if mode == 'ann' and self.ivf is not None and self.ivf_nprobe > 0:
+            return self._ivf_search_query(query_embedding, where_clause, params), params
+        if mode == 'ann' and self.compact_table:
+            return self._compact_search_query(where_clause, params), params
+        search_query = f"""
+        SELECT 
+            product_id AS id,
+            dotProduct(embedding, {{query_embedding:Array(Float32)}})
+                / (norm * {{query_norm:Float32}}) AS similarity
+        FROM {self.database}.product_embeddings
+        WHERE norm > 0 {where_clause}
+        ORDER BY similarity DESC
+        LIMIT {{limit:UInt32}}
+        """
+        return search_query, params
+
+    def _filter_clause(self, filters: Optional[SearchFilters], params: Dict[str, Any]) -> str:
+        """
+        Filtres de métadonnées (valeurs passées en paramètres typés) : semi-jointure
+        sur les seuls ids retenus, pas de JOIN complet
+        """
+        conditions = filters.conditions(params) if filters else []
+        if not conditions:
+            return ""
+        return (f" AND product_id IN (SELECT id FROM {self.database}.products "
+                f"WHERE {' AND '.join(conditions)})")
+
+    def _binary_search_query(self, query_embedding: np.ndarray, where_clause: str,
+                             params: Dict[str, Any]) -> str:
+        """
+        Préfiltre : les `binary_candidates` codes les plus proches en Hamming (64 octets lus
+        par ligne au lieu de 2 Ko), puis re-rank exact dotProduct sur product_embeddings.
+        Le re-rank lit les granules des candidats : le gain croît avec la taille de la table.
+        """
+        code = sign_codes(query_embedding)[0]
+        params.update({f'q{k}': int(code[k]) for k in range(CODE_WORDS)})
+        params['candidates'] = max(int(self.binary_candidates), params['limit'])
+        hamming = " + ".join(f"bitCount(bitXor(w{k}, {{q{k}:UInt64}}))" for k in range(CODE_WORDS))
+        return f"""
+        SELECT
+            product_id AS id,
+            dotProduct(embedding, {{query_embedding:Array(Float32)}})
+                / (norm * {{query_norm:Float32}}) AS similarity
+        FROM {self.database}.product_embeddings
+        WHERE norm > 0 AND product_id IN (
+            SELECT product_id
+            FROM {self.database}.{CODES_TABLE}
+            WHERE 1 {where_clause}
+            ORDER BY {hamming}
+            LIMIT {{candidates:UInt32}})
+        ORDER BY similarity DESC
+        LIMIT {{limit:UInt32}}
+        """
+
+    def _ivf_search_query(self, query_embedding: np.ndarray, where_clause: str,
+                          params: Dict[str, Any]) -> str:
+        """Phase 1 restreinte aux granules des `ivf_nprobe` clusters les plus proches (clé de tri)"""
+        params['clusters'] = self.ivf.probe(query_embedding, self.ivf_nprobe)
+        return f"""
+        SELECT 
+            product_id AS id,
+            dotProduct(embedding, {{query_embedding:Array(Float32)}})
+                / (norm * {{query_norm:Float32}}) AS similarity
+        FROM {self.database}.{ivf.IVF_TABLE}
+        WHERE cluster_id IN {{clusters:Array(UInt32)}} AND norm > 0 {where_clause}
+        ORDER BY similarity DESC
+        LIMIT {{limit:UInt32}}
+        """
+
+    def _compact_search_query(self, where_clause: str, params: Dict[str, Any]) -> str:
+        """
+        Phase 1 sur la table compacte (score approché). Avec rerank > 0, les
+        `rerank` meilleurs candidats sont re-classés en Float32 sur product_embeddings
+        (lookup par clé primaire), dans la même requête.
+        """
+        scale = " * scale" if self.embedding_layout == 'int8' else ""
+        approx = f"""
+            SELECT product_id,
+                dotProduct(embedding, {{query_embedding:Array(Float32)}}){scale}
+                    / (norm * {{query_norm:Float32}}) AS similarity
+            FROM {self.database}.{self.compact_table}
+            WHERE norm > 0 {where_clause}
+            ORDER BY similarity DESC
+            LIMIT {{candidates:UInt32}}"""
+        if self.rerank <= params['limit']:
+            params['candidates'] = params['limit']
+            return f"SELECT product_id AS id, similarity FROM ({approx})"
+        params['candidates'] = int(self.rerank)
+        return f"""
+        SELECT
+            product_id AS id,
+            dotProduct(embedding, {{query_embedding:Array(Float32)}})
+                / (norm * {{query_norm:Float32}}) AS similarity
+        FROM {self.database}.product_embeddings
+        WHERE product_id IN (SELECT product_id FROM ({approx}))
+        ORDER BY similarity DESC
+        LIMIT {{limit:UInt32}}
+        """
+
+    def search_exact(self, query_embedding: np.ndarray, limit: int = 10,
+                     platform_filter: Optional[str] = None,
+                     category_filter: Optional[str] = None, mode: str = 'ann',
+                     filters: Optional[SearchFilters] = None, raise_errors: bool = False):
+        """
+        Scan exact dotProduct dans ClickHouse (chemin de référence), en deux phases :
+        1. scoring sur la table étroite product_embeddings (id, embedding, norm) uniquement
+           (ou, selon `mode`, préfiltre binaire / IVF / copie compacte puis re-rank)
+        2. métadonnées des top-k par lookup sur la clé primaire de products
+
+        Erreur : [] (exception propagée avec raise_errors, ex: recherches multi-requêtes)
+        """
         try:
             start_time = time.time()
             
-            # Convertir embedding en liste
-            if isinstance(query_embedding, np.ndarray):
-                query_embedding = query_embedding.tolist()
+            # Phase 1 : scoring
+            if mode == 'ann' and self.ivf_nprobe > 0:
+                self.refresh_ivf()
+            search_query, params = self._exact_search_query(
+                query_embedding, limit, platform_filter, category_filter, mode, filters
+            )
+            columns = self.query_native(search_query, params)
             
-            query_norm = float(np.linalg.norm(query_embedding))
-            
-            # Construire les filtres
-            filters = []
-            if platform_filter:
-                filters.append(f"p.platform = '{platform_filter}'")
-            if category_filter:
-                filters.append(f"p.category = '{category_filter}'")
-            
-            where_clause = " AND " + " AND ".join(filters) if filters else ""
-            
-            # Requête optimisée avec similarité cosinus
-            search_query = f"""
-            SELECT 
-                p.id,
-                p.title,
-                p.price,
-                p.platform,
-                p.image_url,
-                p.category,
-                p.color,
-                p.brand,
-                p.size,
-                p.condition,
-                dotProduct(e.embedding, {query_embedding}) / (e.norm * {query_norm}) as similarity
-            FROM {self.database}.products p
-            JOIN {self.database}.product_embeddings e ON p.id = e.product_id
-            WHERE e.norm > 0 {where_clause}
-            ORDER BY similarity DESC
-            LIMIT {limit}
-            """
-            
-            result = self.execute_query(search_query)
-            
-            if not result:
-                return []
-            
-            # Parser les résultats
-            lines = result.strip().split('\n')
-            products = []
-            
-            for line in lines:
-                if line:
-                    parts = line.split('\t')
-                    if len(parts) >= 11:
-                        products.append({
-                            'id': int(parts[0]),
-                            'title': parts[1],
-                            'price': float(parts[2]),
-                            'platform': parts[3],
-                            'image_url': parts[4],
-                            'category': parts[5],
-                            'color': parts[6],
-                            'brand': parts[7],
-                            'size': parts[8],
-                            'condition': parts[9],
-                            'similarity': float(parts[10])
-                        })
+            # Phase 2 : métadonnées des gagnants uniquement
+            products = self._with_metadata(columns.get('id', []), columns.get('similarity', []))
             
             search_time = time.time() - start_time
             print(f"🔍 Recherche ClickHouse: {len(products)} résultats en {search_time:.3f}s")
@@ -198,8 +660,181 @@ class ClickHouseVectorDB:
             
         except Exception as e:
             print(f"❌ Erreur recherche: {e}")
+            if raise_errors:
+                raise
             return []
         
+    # --- recherche multi-requêtes ---
+    def batchable(self, mode: str) -> bool:
+        """
+        Vrai si le mode se ramène à un scan partagé entre requêtes : exact, ou ann servi
+        par l'index en mémoire (search_many) ou sans IVF ni table compacte (scan Float32).
+        binary / IVF / compact élaguent par requête : une requête par ligne.
+        """
+        if mode == 'exact':
+            return True
+        if mode != 'ann':
+            return False
+        if self.vector_index is not None:
+            return hasattr(self.vector_index, 'search_many')
+        return not (self.ivf is not None and self.ivf_nprobe > 0) and not self.compact_table
+
+    def search_similar_many(self, query_embeddings: np.ndarray, limit: int = 10,
+                            mode: Optional[str] = None,
+                            filters: Optional[SearchFilters] = None) -> List[List[Dict]]:
+        """
+        Top-k de chaque ligne d'une matrice (N, 512) :
+        - index en mémoire (ann, sans filtre) : un seul search_many (matmul / knn par lots)
+        - sinon, mode partageable : un scan de product_embeddings par tranche de
+          SEARCH_MANY_CHUNK requêtes (les N produits scalaires sont calculés à la lecture
+          de chaque ligne, top-k par requête via groupArraySorted)
+        - binary / IVF / compact : search_similar ligne par ligne
+
+        Returns:
+            une liste de produits par requête (vide si l'embedding est nul) ;
+            une erreur ClickHouse est propagée (pas de listes vides silencieuses)
+        """
+        mode = mode or self.search_mode
+        queries = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        start_time = time.time()
+        if not self.batchable(mode):
+            return [self.search_similar(q, limit, mode=mode, filters=filters, raise_errors=True)
+                    for q in queries]
+
+        norms = np.linalg.norm(queries, axis=1)
+        valid = np.flatnonzero(np.isfinite(norms) & (norms > 0))
+        results: List[List[Dict]] = [[] for _ in range(len(queries))]
+        for start in range(0, len(valid), SEARCH_MANY_CHUNK):
+            rows = valid[start:start + SEARCH_MANY_CHUNK]
+            ranked = self._rank_many(queries[rows], limit, mode, filters)
+            metadata = self.fetch_products(self._ranked_ids(ranked))
+            for row, (ids, scores) in zip(rows, ranked):
+                results[row] = self._merge_metadata(ids, scores, metadata)
+
+        print(f"🔍 Recherche multi-requêtes: {len(queries)} requêtes en {time.time() - start_time:.3f}s")
+        return results
+
+    def _rank_many(self, queries: np.ndarray, limit: int, mode: str,
+                   filters: Optional[SearchFilters]) -> List[tuple]:
+        if mode == 'ann' and self.vector_index is not None and not filters:
+            try:
+                return list(zip(*self.vector_index.search_many(queries, limit)))
+            except Exception as e:
+                print(f"⚠️ Index vectoriel indisponible, fallback scan exact: {e}")
+        columns = self.query_native(*self._many_search_query(queries, limit, filters), form=True)
+        return self._ranked_rows(columns, len(queries))
+
+    def _many_search_query(self, queries: np.ndarray, limit: int,
+                           filters: Optional[SearchFilters] = None):
+        """
+        Un seul scan pour toutes les requêtes : chaque ligne lue est scorée contre les
+        N vecteurs (arrayMap), arrayJoin donne (requête, score), puis groupArraySorted
+        garde les `limit` meilleurs par requête (mémoire N x limit, pas de tri global)
+        """
+        params = {
+            'queries': list(queries),
+            'query_norms': np.linalg.norm(queries, axis=1).astype(np.float32),
+        }
+        where_clause = self._filter_clause(filters, params)
+        query = f"""
+        SELECT qi, arrayMap(x -> x.2, best) AS ids, arrayMap(x -> -x.1, best) AS scores
+        FROM (
+            SELECT hit.1 AS qi, groupArraySorted({int(limit)})((-hit.2, product_id)) AS best
+            FROM (
+                SELECT product_id,
+                    arrayJoin(arrayMap((q, n, i) -> (i, dotProduct(embedding, q) / (norm * n)),
+                        {{queries:Array(Array(Float32))}}, {{query_norms:Array(Float32)}},
+                        arrayEnumerate({{query_norms:Array(Float32)}}))) AS hit
+                FROM {self.database}.product_embeddings
+                WHERE norm > 0 {where_clause}
+            )
+            GROUP BY qi
+        )
+        """
+        return query, params
+
+    @staticmethod
+    def _ranked_rows(columns: Dict[str, Any], n: int) -> List[tuple]:
+        """Colonnes (qi, ids, scores) -> [(ids, scores)] dans l'ordre des requêtes"""
+        ranked = [(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.float32))] * n
+        for qi, ids, scores in zip(columns.get('qi', []), columns.get('ids', []), columns.get('scores', [])):
+            ranked[int(qi) - 1] = (np.asarray(ids, dtype=np.uint64), np.asarray(scores, dtype=np.float32))
+        return ranked
+
+    @staticmethod
+    def _ranked_ids(ranked: List[tuple]) -> np.ndarray:
+        """Ids distincts de plusieurs classements (un seul lookup de métadonnées)"""
+        if not ranked:
+            return np.empty(0, dtype=np.uint64)
+        return np.unique(np.concatenate([np.asarray(ids, dtype=np.uint64) for ids, _ in ranked]))
+
+    @staticmethod
+    def _merge_metadata(ids, scores, metadata: Dict[int, Dict]) -> List[Dict]:
+        """Associe (ids, scores) classés à leurs métadonnées, en conservant l'ordre"""
+        products = []
+        for pid, score in zip(ids, scores):
+            meta = metadata.get(int(pid))
+            if meta is not None:
+                products.append({**meta, 'similarity': float(score)})
+        return products
+
+    def _with_metadata(self, ids, scores, filters: Optional[SearchFilters] = None) -> List[Dict]:
+        return self._merge_metadata(ids, scores, self.fetch_products(ids, filters))
+
+    def _products_query(self, ids: List[int], filters: Optional[SearchFilters] = None):
+        """SQL + paramètres du lookup de métadonnées par clé primaire (filtres éventuels en plus)"""
+        params = {'ids': np.asarray(ids, dtype=np.uint64)}
+        conditions = filters.conditions(params) if filters else []
+        query = f"""
+        SELECT {', '.join(PRODUCT_COLUMNS)}
+        FROM {self.database}.products
+        WHERE id IN {{ids:Array(UInt64)}}{''.join(' AND ' + c for c in conditions)}
+        """
+        return query, params
+
+    def fetch_products(self, ids: List[int], filters: Optional[SearchFilters] = None) -> Dict[int, Dict]:
+        """Métadonnées des produits pour une liste d'ids (sans embedding), hors filtres exclus"""
+        if not len(ids):
+            return {}
+        columns = self.query_native(*self._products_query(ids, filters))
+        return {row['id']: row for row in self._rows(columns, PRODUCT_COLUMNS)}
+
+    def fetch_embedding_ids(self) -> np.ndarray:
+        """Tous les product_id présents dans product_embeddings"""
+        columns = self.query_native(
+            f"SELECT product_id FROM {self.database}.product_embeddings WHERE norm > 0"
+        )
+        return columns.get('product_id', np.empty(0, dtype=np.uint64))
+
+    def fetch_embeddings(self, ids: Optional[List[int]] = None, batch_size: int = 5000):
+        """
+        Charge (ids, embeddings) depuis product_embeddings, par lots.
+
+        Args:
+            ids: ids à charger (None = toute la table)
+            batch_size: nombre d'ids par requête
+
+        Yields:
+            (np.ndarray uint64 (n,), np.ndarray float32 (n, 512))
+        """
+        if ids is None:
+            ids = self.fetch_embedding_ids()
+        ids = np.asarray(ids, dtype=np.uint64)
+
+        for start in range(0, len(ids), batch_size):
+            query = f"""
+            SELECT product_id, embedding
+            FROM {self.database}.product_embeddings
+            WHERE product_id IN {{ids:Array(UInt64)}} AND norm > 0
+            """
+            columns = self.query_native(query, {'ids': ids[start:start + batch_size]})
+            if not len(columns.get('product_id', [])):
+                continue
+            yield columns['product_id'], np.asarray(columns['embedding'], dtype=np.float32)
+
+    def _count_query(self) -> str:
+        return f"SELECT count() FROM {self.database}.products"
+
     def get_stats(self):
         """Statistiques de la base"""
         try:
@@ -215,7 +850,7 @@ class ClickHouseVectorDB:
             
             result = self.execute_query(stats_query)
             
-            total_query = f"SELECT count() FROM {self.database}.products"
+            total_query = self._count_query()
             total_result = self.execute_query(total_query)
             
             return {
@@ -0,0 +1,195 @@
+# database/embedding_store.py
+# Matrice d'embeddings memory-mappée (float16/float32) pour la recherche exacte hors ClickHouse
+
+import os
+import sys
+import json
+import time
+import numpy as np
+from typing import Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.vector_ops import blocked_top_k, l2_normalize
+
+META_FILE = "meta.json"
+EMBEDDINGS_FILE = "embeddings.bin"
+IDS_FILE = "ids.bin"
+
+
+class MmapEmbeddingStore:
+    """
+    Stockage contigu des embeddings sur disque :
+        <path>/embeddings.bin  lignes (dim,) en float16 ou float32, row-major
+        <path>/ids.bin         product_id uint64, même ordre
+        <path>/meta.json       dim, dtype, count (écrit en dernier, de façon atomique)
+
+    Les fichiers ne font que grossir (append-only). Les lecteurs mappent `count`
+    lignes en lecture seule : plusieurs workers uvicorn partagent donc les mêmes
+    pages via le page cache de l'OS. Un seul écrivain à la fois (job de sync).
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        self.dim = None
+        self.dtype = None
+        self.count = 0
+        self.embeddings = None
+        self.ids = None
+        self._meta_mtime = None
+        self._known_ids = None
+        self.refresh()
+
+    # --- création / ouverture ---
+    @classmethod
+    def create(cls, path: str, dim: int = 512, dtype: str = "float16") -> "MmapEmbeddingStore":
+        """Crée un store vide"""
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"dtype non supporté: {dtype}")
+        os.makedirs(path, exist_ok=True)
+        for name in (EMBEDDINGS_FILE, IDS_FILE):
+            open(os.path.join(path, name), "wb").close()
+        cls._write_meta(path, {"dim": dim, "dtype": dtype, "count": 0})
+        return cls(path, writable=True)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    @staticmethod
+    def _write_meta(path: str, meta: dict):
+        tmp = os.path.join(path, META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({**meta, "updated_at": time.time()}, f)
+        os.replace(tmp, os.path.join(path, META_FILE))
+
+    def refresh(self) -> bool:
+        """Re-mappe les fichiers si un écrivain a ajouté des lignes"""
+        meta_path = os.path.join(self.path, META_FILE)
+        st = os.stat(meta_path)
+        # os.replace crée un nouvel inode : (inode, mtime) change à chaque publication
+        mtime = (st.st_ino, st.st_mtime_ns)
+        if mtime == self._meta_mtime:
+            return False
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.count = meta["count"]
+        self._meta_mtime = mtime
+
+        if self.count == 0:
+            self.embeddings = np.empty((0, self.dim), dtype=self.dtype)
+            self.ids = np.empty(0, dtype=np.uint64)
+        else:
+            self.embeddings = np.memmap(os.path.join(self.path, EMBEDDINGS_FILE),
+                                        dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+            self.ids = np.memmap(os.path.join(self.path, IDS_FILE),
+                                 dtype=np.uint64, mode="r", shape=(self.count,))
+        return True
+
+    def __len__(self):
+        return self.count
+
+    # --- écriture (append-only) ---
+    def append(self, ids: np.ndarray, embeddings: np.ndarray) -> int:
+        """Ajoute des lignes en fin de fichier puis publie le nouveau count"""
+        if not self.writable:
+            raise RuntimeError("Store ouvert en lecture seule")
+        ids = np.asarray(ids, dtype=np.uint64)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(ids) == 0:
+            return 0
+        if embeddings.shape != (len(ids), self.dim):
+            raise ValueError(f"Embeddings {embeddings.shape}, attendu ({len(ids)}, {self.dim})")
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        rows = (embeddings / norms).astype(self.dtype)
+
+        # données d'abord, meta ensuite : un lecteur ne voit jamais de lignes partielles.
+        # Un crash entre les deux laisse des lignes au-delà de `count` : on les coupe
+        # avant d'écrire, sinon les ajouts suivants seraient décalés
+        for name, data, row_size in ((EMBEDDINGS_FILE, rows, self.dim * self.dtype.itemsize),
+                                     (IDS_FILE, ids, ids.itemsize)):
+            with open(os.path.join(self.path, name), "r+b") as f:
+                f.truncate(self.count * row_size)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(data).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._write_meta(self.path, {"dim": self.dim, "dtype": self.dtype.name,
+                                     "count": self.count + len(ids)})
+        self.refresh()
+        if self._known_ids is not None:
+            self._known_ids.update(int(i) for i in ids)
+        return len(ids)
+
+    def sync(self, db, batch_size: int = 20000) -> int:
+        """Ajoute les embeddings ClickHouse absents du store"""
+        if self._known_ids is None:
+            self._known_ids = set(int(i) for i in self.ids)
+        new_ids = [int(i) for i in db.fetch_embedding_ids() if int(i) not in self._known_ids]
+
+        added = 0
+        for ids, embeddings in db.fetch_embeddings(new_ids, batch_size=batch_size):
+            added += self.append(ids, embeddings)
+        if added:
+            print(f"➕ Store mmap: {added} nouveaux vecteurs (total {len(self)})")
+        return added
+
+    def update(self, db) -> int:
+        """Écrivain : synchronise depuis ClickHouse. Lecteur : re-mappe seulement."""
+        if self.writable:
+            return self.sync(db)
+        before = len(self)
+        self.refresh()
+        return len(self) - before
+
+    # --- recherche exacte ---
+    def search(self, query_embedding: np.ndarray, k: int = 10,
+               block_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """Retourne (ids, similarités) exacts, par matmul NumPy par blocs"""
+        self.refresh()
+        if self.count == 0:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.float32)
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        idx, scores = blocked_top_k(q, self.embeddings, k=k, block_size=block_size)
+        return np.asarray(self.ids[idx], dtype=np.uint64), scores
+
+    def search_many(self, query_embeddings: np.ndarray, k: int = 10,
+                    block_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, similarités) (Q, k) pour Q requêtes, en une seule passe sur le store"""
+        self.refresh()
+        q, _ = l2_normalize(np.array(query_embeddings, dtype=np.float32, ndmin=2))
+        if self.count == 0:
+            return np.empty((len(q), 0), dtype=np.uint64), np.empty((len(q), 0), dtype=np.float32)
+        idx, scores = blocked_top_k(q, self.embeddings, k=k, block_size=block_size)
+        return np.asarray(self.ids[idx], dtype=np.uint64), scores
+
+
+# Export / synchronisation en ligne de commande
+if __name__ == "__main__":
+    import argparse
+    from database.clickhouse_setup import ClickHouseVectorDB
+
+    parser = argparse.ArgumentParser(description="Exporte product_embeddings vers un store mmap")
+    parser.add_argument("--path", default="embedding_store")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    args = parser.parse_args()
+
+    db = ClickHouseVectorDB()
+    if MmapEmbeddingStore.exists(args.path):
+        store = MmapEmbeddingStore(args.path, writable=True)
+    else:
+        store = MmapEmbeddingStore.create(args.path, dtype=args.dtype)
+
+    start_time = time.time()
+    added = store.sync(db)
+    size_mb = len(store) * store.dim * store.dtype.itemsize / 1e6
+    print(f"✅ Store {args.path}: {len(store)} vecteurs ({size_mb:.1f} MB, {store.dtype.name}), "
+          f"+{added} en {time.time() - start_time:.1f}s")
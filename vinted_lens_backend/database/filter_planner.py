@@ -0,0 +1,276 @@
+# database/filter_planner.py
+# Planification des recherches filtrées (plateforme, catégorie, marque, taille, prix).
+#
+# La sélectivité des filtres est estimée sur des statistiques de colonnes de `products`
+# (comptes par valeur, quantiles de prix) mises en cache FILTER_STATS_TTL_S secondes :
+#
+#   prefilter  : peu de lignes attendues -> ids filtrés dans products (index de saut),
+#                puis scoring exact Float32 de ces seuls ids
+#   postfilter : filtre large -> phase 1 non filtrée (index en mémoire / IVF / compact)
+#                sur limit / sélectivité candidats, filtre appliqué au lookup des
+#                métadonnées ; repli sur prefilter s'il reste moins de `limit` résultats
+
+import os
+import math
+import time
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+FILTER_STATS_TTL_S = float(os.environ.get("FILTER_STATS_TTL_S", "300"))
+PREFILTER_MAX_ROWS = int(os.environ.get("PREFILTER_MAX_ROWS", "50000"))
+FILTER_OVERFETCH = float(os.environ.get("FILTER_OVERFETCH", "2.0"))        # marge sur limit / sélectivité
+FILTER_OVERFETCH_MAX = int(os.environ.get("FILTER_OVERFETCH_MAX", "2000"))
+STATS_MAX_VALUES = 10000        # valeurs suivies par colonne (les plus fréquentes)
+PRICE_QUANTILES = 100
+
+# Filtres d'égalité : colonnes de products (le paramètre typé porte le même nom)
+EQUALITY_COLUMNS = ('platform', 'category', 'brand', 'size')
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    platform: Optional[str] = None
+    category: Optional[str] = None
+    brand: Optional[str] = None
+    size: Optional[str] = None
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+
+    def __post_init__(self):
+        """Valide les valeurs (ValueError) : elles finissent en paramètres typés et dans np.interp"""
+        for col in EQUALITY_COLUMNS:
+            value = getattr(self, col)
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{col} doit être une chaîne")
+        for name in ('price_min', 'price_max'):
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"{name} doit être un nombre fini")
+            if value < 0:
+                raise ValueError(f"{name} doit être >= 0")
+            object.__setattr__(self, name, float(value))
+        if self.price_min is not None and self.price_max is not None and self.price_min > self.price_max:
+            raise ValueError("price_min > price_max")
+
+    @classmethod
+    def of(cls, filters: Optional["SearchFilters"] = None, platform: Optional[str] = None,
+           category: Optional[str] = None) -> "SearchFilters":
+        """Fusionne les anciens arguments platform_filter / category_filter"""
+        filters = filters or cls()
+        return cls(**{**asdict(filters), **{k: v for k, v in
+                                             (('platform', platform), ('category', category)) if v}})
+
+    def __bool__(self) -> bool:
+        return any(v is not None and v != "" for v in asdict(self).values())
+
+    def equalities(self) -> List[tuple]:
+        return [(col, getattr(self, col)) for col in EQUALITY_COLUMNS if getattr(self, col)]
+
+    def key(self) -> str:
+        """Clé stable (cache des classements)"""
+        return "&".join(f"{k}={v}" for k, v in asdict(self).items() if v is not None and v != "")
+
+    def conditions(self, params: Dict[str, Any]) -> List[str]:
+        """Conditions SQL sur products (valeurs ajoutées à `params` en paramètres typés)"""
+        conditions = []
+        for col, value in self.equalities():
+            conditions.append(f"{col} = {{{col}:String}}")
+            params[col] = value
+        if self.price_min is not None:
+            conditions.append("price >= {price_min:Float32}")
+            params['price_min'] = float(self.price_min)
+        if self.price_max is not None:
+            conditions.append("price <= {price_max:Float32}")
+            params['price_max'] = float(self.price_max)
+        return conditions
+
+    def matches(self, product: Dict) -> bool:
+        """Même filtre côté Python (sources hors ClickHouse)"""
+        for col, value in self.equalities():
+            if str(product.get(col, '')) != value:
+                return False
+        try:
+            price = float(product.get('price') or 0)
+        except (TypeError, ValueError):
+            return self.price_min is None and self.price_max is None
+        if self.price_min is not None and price < self.price_min:
+            return False
+        if self.price_max is not None and price > self.price_max:
+            return False
+        return True
+
+
+@dataclass
+class ColumnStats:
+    total: int
+    counts: Dict[str, Dict[str, int]]      # colonne -> valeur -> lignes (valeurs les plus fréquentes)
+    untracked: Dict[str, float]            # colonne -> lignes moyennes d'une valeur non suivie
+    price_bounds: np.ndarray               # min, quantiles, max : masse égale entre deux bornes
+    loaded_at: float
+
+    def selectivity(self, filters: SearchFilters) -> float:
+        """Fraction estimée des produits retenus (filtres supposés indépendants)"""
+        if not self.total:
+            return 0.0
+        s = 1.0
+        for col, value in filters.equalities():
+            rows = self.counts.get(col, {}).get(value)
+            if rows is None:
+                rows = self.untracked.get(col, 0.0)
+            s *= rows / self.total
+        if filters.price_min is not None or filters.price_max is not None:
+            s *= self.price_fraction(filters.price_min, filters.price_max)
+        return min(1.0, s)
+
+    def price_fraction(self, lo: Optional[float], hi: Optional[float]) -> float:
+        if not len(self.price_bounds):
+            return 1.0
+        cdf = np.linspace(0.0, 1.0, len(self.price_bounds))
+        upper = np.interp(hi, self.price_bounds, cdf) if hi is not None else 1.0
+        lower = np.interp(lo, self.price_bounds, cdf) if lo is not None else 0.0
+        return float(max(0.0, upper - lower))
+
+
+@dataclass
+class FilterPlan:
+    strategy: str                          # none | prefilter | postfilter
+    selectivity: Optional[float] = None
+    estimated_rows: Optional[int] = None
+    fetch: int = 0                         # candidats de phase 1 (postfilter)
+    fallback: bool = False                 # postfilter insuffisant, rejoué en prefilter
+    reason: str = ""
+
+    def describe(self) -> Dict:
+        plan = asdict(self)
+        if self.selectivity is not None:
+            plan['selectivity'] = round(self.selectivity, 6)
+        return plan
+
+
+class FilterPlanner:
+    """
+    Choisit prefilter / postfilter selon la sélectivité estimée des filtres.
+    `db` : ClickHouseVectorDB (query_native, database) ; les statistiques sont
+    rechargées au plus toutes les `ttl_s` secondes via refresh(), un seul
+    chargement à la fois. Sur le chemin des requêtes, refresh_background() :
+    les statistiques expirées restent servies pendant le rechargement.
+    """
+
+    def __init__(self, db, ttl_s: float = FILTER_STATS_TTL_S,
+                 prefilter_max_rows: int = PREFILTER_MAX_ROWS,
+                 overfetch: float = FILTER_OVERFETCH, overfetch_max: int = FILTER_OVERFETCH_MAX):
+        self.db = db
+        self.ttl_s = ttl_s
+        self.prefilter_max_rows = prefilter_max_rows
+        self.overfetch = overfetch
+        self.overfetch_max = overfetch_max
+        self.column_stats: Optional[ColumnStats] = None
+        self._checked = 0.0
+        self._refresh_lock = threading.Lock()
+        # métriques
+        self.plans: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self._checked >= self.ttl_s
+
+    def refresh(self, force: bool = False, wait: bool = True) -> Optional[ColumnStats]:
+        """
+        Recharge les statistiques si elles ont expiré (en cas d'échec, garde les précédentes).
+        Pendant un chargement, les autres appels l'attendent (wait) ou rendent les
+        statistiques courantes.
+        """
+        if not force and not self.stale:
+            return self.column_stats
+        if not self._refresh_lock.acquire(blocking=wait):
+            return self.column_stats
+        try:
+            if not force and not self.stale:    # rechargé pendant l'attente
+                return self.column_stats
+            self._checked = time.time()
+            try:
+                self.column_stats = self._load()
+            except Exception as e:
+                print(f"⚠️ Statistiques de filtres indisponibles: {e}")
+            return self.column_stats
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_background(self):
+        """Relance refresh dans un thread si les statistiques ont expiré (ne bloque pas)"""
+        if self.stale and not self._refresh_lock.locked():
+            threading.Thread(target=self.refresh, kwargs={'wait': False},
+                             name="filter-stats", daemon=True).start()
+
+    def _load(self) -> ColumnStats:
+        table = f"{self.db.database}.products"
+        levels = ", ".join(f"{q / PRICE_QUANTILES:g}" for q in range(1, PRICE_QUANTILES))
+        distinct = ", ".join(f"uniq({col}) AS u_{col}" for col in EQUALITY_COLUMNS)
+        summary = self.db.query_native(f"""
+            SELECT count() AS total, {distinct},
+                   min(toFloat64(price)) AS price_lo, max(toFloat64(price)) AS price_hi,
+                   quantiles({levels})(toFloat64(price)) AS price_q
+            FROM {table}""")
+        total = int(summary['total'][0])
+        counts, untracked = {}, {}
+        for col in EQUALITY_COLUMNS:
+            columns = self.db.query_native(f"""
+                SELECT {col} AS value, count() AS c
+                FROM {table}
+                GROUP BY value
+                ORDER BY c DESC
+                LIMIT {STATS_MAX_VALUES}""")
+            counts[col] = {str(v): int(c) for v, c in zip(columns.get('value', []), columns.get('c', []))}
+            rest = int(summary[f'u_{col}'][0]) - len(counts[col])
+            untracked[col] = (total - sum(counts[col].values())) / rest if rest > 0 else 0.0
+        bounds = np.empty(0)
+        if total:
+            bounds = np.concatenate([[summary['price_lo'][0]], np.asarray(summary['price_q'][0]),
+                                     [summary['price_hi'][0]]]).astype(np.float64)
+        print(f"📊 Statistiques de filtres: {total} produits, "
+              + ", ".join(f"{len(counts[c])} {c}" for c in EQUALITY_COLUMNS))
+        return ColumnStats(total, counts, untracked, bounds, time.time())
+
+    def plan(self, filters: SearchFilters, limit: int) -> FilterPlan:
+        plan = self._plan(filters, limit)
+        self.plans[plan.strategy] = self.plans.get(plan.strategy, 0) + 1
+        return plan
+
+    def _plan(self, filters: SearchFilters, limit: int) -> FilterPlan:
+        if not filters:
+            return FilterPlan("none")
+        stats = self.column_stats
+        if stats is None:
+            return FilterPlan("prefilter", reason="statistiques indisponibles")
+        selectivity = stats.selectivity(filters)
+        rows = int(round(selectivity * stats.total))
+        if rows <= self.prefilter_max_rows:
+            return FilterPlan("prefilter", selectivity, rows,
+                              reason=f"<= {self.prefilter_max_rows} lignes estimées")
+        fetch = max(limit, math.ceil(limit / selectivity * self.overfetch))
+        if fetch > self.overfetch_max:
+            return FilterPlan("prefilter", selectivity, rows,
+                              reason=f"sur-échantillonnage {fetch} > {self.overfetch_max}")
+        return FilterPlan("postfilter", selectivity, rows, fetch=fetch)
+
+    def record_fallback(self, plan: FilterPlan):
+        plan.fallback = True
+        self.fallbacks += 1
+
+    def stats(self) -> Dict:
+        column_stats = self.column_stats
+        return {
+            "plans": dict(self.plans),
+            "fallbacks": self.fallbacks,
+            "stats_rows": column_stats.total if column_stats else None,
+            "stats_age_s": round(time.time() - column_stats.loaded_at, 1) if column_stats else None,
+            "prefilter_max_rows": self.prefilter_max_rows,
+            "overfetch": self.overfetch,
+            "overfetch_max": self.overfetch_max,
+        }
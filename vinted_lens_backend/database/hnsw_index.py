@@ -0,0 +1,291 @@
+# database/hnsw_index.py
+# Index ANN (HNSW) en mémoire, construit depuis product_embeddings
+
+import os
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+    print("hnswlib non disponible (pip install hnswlib)")
+
+
+class _SharedLock:
+    """
+    Verrou partagé / exclusif (priorité à l'écrivain) : knn_query et add_items
+    peuvent tourner ensemble dans hnswlib, pas resize_index ni set_ef
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class HNSWIndex:
+    """
+    Index HNSW (produit scalaire sur embeddings normalisés) tenu dans le process de l'API.
+    - build(): construction parallèle depuis ClickHouse
+    - update(): ajout incrémental des nouveaux ids, sans reconstruction
+    - search(): top-k, retourne (ids, similarités)
+
+    update() tourne dans un thread (asyncio.to_thread) pendant que l'API cherche :
+    l'agrandissement de l'index et les changements d'ef sont exclusifs.
+    """
+
+    def __init__(self, dim: int = 512, M: int = 16, ef_construction: int = 200,
+                 ef_search: int = 64, num_threads: int = -1):
+        if not HNSWLIB_AVAILABLE:
+            raise RuntimeError("hnswlib requis pour HNSWIndex")
+
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.num_threads = num_threads
+        self.index = None
+        self._ids = set()
+        self.built_at = None
+        self._ef = ef_search            # ef effectif de l'index (>= ef_search, relevé au plus grand k)
+        self._lock = _SharedLock()
+
+    # --- construction ---
+    def _init_index(self, capacity: int):
+        self.index = hnswlib.Index(space='ip', dim=self.dim)
+        self.index.init_index(max_elements=max(capacity, 1),
+                              ef_construction=self.ef_construction, M=self.M)
+        self.index.set_ef(self.ef_search)
+        self._ef = self.ef_search
+
+    def _add(self, ids: np.ndarray, embeddings: np.ndarray):
+        """Ajoute un lot en agrandissant l'index si nécessaire"""
+        if len(ids) == 0:
+            return
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embeddings = embeddings / norms
+
+        needed = self.index.get_current_count() + len(ids)
+        if needed > self.index.get_max_elements():
+            # croissance géométrique pour amortir les resize
+            with self._lock.exclusive():
+                self.index.resize_index(max(needed, int(self.index.get_max_elements() * 1.5)))
+
+        with self._lock.shared():
+            self.index.add_items(embeddings, ids.astype(np.uint64), num_threads=self.num_threads)
+        self._ids.update(int(i) for i in ids)
+
+    def build(self, db, batch_size: int = 20000) -> int:
+        """Construit l'index complet depuis product_embeddings"""
+        start_time = time.time()
+        all_ids = db.fetch_embedding_ids()
+        self._ids = set()
+        self._init_index(len(all_ids))
+
+        for ids, embeddings in db.fetch_embeddings(all_ids.tolist(), batch_size=batch_size):
+            self._add(ids, embeddings)
+
+        self.built_at = time.time()
+        print(f"✅ HNSW construit: {len(self)} vecteurs en {time.time() - start_time:.1f}s "
+              f"(M={self.M}, ef_construction={self.ef_construction})")
+        return len(self)
+
+    def update(self, db, batch_size: int = 20000) -> int:
+        """Ajoute uniquement les ids absents de l'index"""
+        if self.index is None:
+            return self.build(db, batch_size=batch_size)
+
+        all_ids = db.fetch_embedding_ids()
+        new_ids = [int(i) for i in all_ids if int(i) not in self._ids]
+        if not new_ids:
+            return 0
+
+        added = 0
+        for ids, embeddings in db.fetch_embeddings(new_ids, batch_size=batch_size):
+            self._add(ids, embeddings)
+            added += len(ids)
+
+        print(f"➕ HNSW: {added} nouveaux vecteurs (total {len(self)})")
+        return added
+
+    # --- requêtes ---
+    def set_ef(self, ef_search: int):
+        """Règle le compromis rappel / latence à la requête"""
+        with self._lock.exclusive():
+            self.ef_search = ef_search
+            self._ef = ef_search
+            if self.index is not None:
+                self.index.set_ef(ef_search)
+
+    def _ensure_ef(self, k: int):
+        """ef doit être >= k pour obtenir k résultats : relevé une fois, pas à chaque requête"""
+        if k <= self._ef:
+            return
+        with self._lock.exclusive():
+            if k > self._ef:
+                self.index.set_ef(k)
+                self._ef = k
+
+    def _knn(self, q: np.ndarray, k: int):
+        self._ensure_ef(k)
+        with self._lock.shared():
+            return self.index.knn_query(q, k=k)
+
+    def search(self, query_embedding: np.ndarray, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """Retourne (ids, similarités) triés par similarité décroissante"""
+        if self.index is None or len(self) == 0:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.float32)
+
+        q = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        q = q / (np.linalg.norm(q) or 1.0)
+        k = min(k, len(self))
+        labels, distances = self._knn(q, k)
+
+        # espace 'ip' : distance = 1 - produit scalaire
+        return labels[0].astype(np.uint64), (1.0 - distances[0]).astype(np.float32)
+
+    def search_many(self, query_embeddings: np.ndarray, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, similarités) (Q, k) : un seul knn_query multi-requêtes (threads hnswlib)"""
+        q = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        if self.index is None or len(self) == 0:
+            return np.empty((len(q), 0), dtype=np.uint64), np.empty((len(q), 0), dtype=np.float32)
+
+        q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        k = min(k, len(self))
+        labels, distances = self._knn(q, k)
+        return labels.astype(np.uint64), (1.0 - distances).astype(np.float32)
+
+    def __len__(self):
+        return len(self._ids)
+
+    # --- persistance ---
+    def save(self, path: str):
+        self.index.save_index(path)
+        print(f"💾 HNSW sauvegardé: {path}")
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        self.index = hnswlib.Index(space='ip', dim=self.dim)
+        self.index.load_index(path)
+        self.index.set_ef(self.ef_search)
+        self._ef = self.ef_search
+        self._ids = set(int(i) for i in self.index.get_ids_list())
+        self.built_at = time.time()
+        print(f"📂 HNSW chargé: {len(self)} vecteurs depuis {path}")
+        return True
+
+    # --- qualité ---
+    def recall_report(self, db, k: int = 10, n_queries: int = 100,
+                      ef_values: Optional[List[int]] = None, seed: int = 0) -> Dict:
+        """
+        Mesure le recall@k de l'index contre le scan exact ClickHouse.
+        Les requêtes sont des embeddings de la base, légèrement bruités.
+        """
+        ids = list(self._ids)
+        if not ids:
+            return {'k': k, 'n_queries': 0, 'results': []}
+
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(ids, size=min(n_queries, len(ids)), replace=False).tolist()
+        queries = np.concatenate([e for _, e in db.fetch_embeddings(sample)])
+        queries = queries + rng.normal(0, 0.02, queries.shape).astype(np.float32)
+
+        # vérité terrain une seule fois
+        truth = []
+        for q in queries:
+            exact = db.search_exact(q, limit=k)
+            truth.append({p['id'] for p in exact})
+
+        results = []
+        previous_ef = self.ef_search
+        for ef in (ef_values or [self.ef_search]):
+            self.set_ef(ef)
+            hits = 0
+            total = 0
+            latencies = []
+            for q, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                found, _ = self.search(q, k)
+                latencies.append(time.perf_counter() - t0)
+                hits += len(expected & {int(i) for i in found})
+                total += len(expected)
+            results.append({
+                'ef_search': ef,
+                'recall': round(hits / total, 4) if total else 0.0,
+                'latency_ms_p50': round(float(np.percentile(latencies, 50)) * 1000, 3),
+                'latency_ms_p99': round(float(np.percentile(latencies, 99)) * 1000, 3),
+            })
+        self.set_ef(previous_ef)
+
+        return {'k': k, 'n_queries': len(queries), 'M': self.M, 'results': results}
+
+
+# Construction / rapport en ligne de commande
+if __name__ == "__main__":
+    import argparse
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from database.clickhouse_setup import ClickHouseVectorDB
+
+    parser = argparse.ArgumentParser(description="Construit l'index HNSW et mesure le recall")
+    parser.add_argument("--path", default="hnsw_index.bin")
+    parser.add_argument("--M", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--incremental", action="store_true",
+                        help="charge l'index existant et n'ajoute que les nouveaux ids")
+    args = parser.parse_args()
+
+    db = ClickHouseVectorDB()
+    index = HNSWIndex(M=args.M, ef_construction=args.ef_construction)
+    if args.incremental and index.load(args.path):
+        index.update(db)
+    else:
+        index.build(db)
+    index.save(args.path)
+
+    report = index.recall_report(db, k=args.k, n_queries=args.queries, ef_values=args.ef)
+    print(f"📊 recall@{report['k']} sur {report['n_queries']} requêtes (M={report['M']})")
+    for r in report['results']:
+        print(f"  ef={r['ef_search']:4d}  recall={r['recall']:.3f}  "
+              f"p50={r['latency_ms_p50']:.3f}ms  p99={r['latency_ms_p99']:.3f}ms")
@@ -0,0 +1,352 @@
+# database/ivf.py
+# Quantificateur grossier IVF (k-means sphérique) pour ne scanner dans ClickHouse
+# que les clusters les plus proches de la requête.
+#
+#   ivf_codebooks              version, nlist, lignes d'entraînement, distorsion de référence
+#   ivf_centroids              (version, cluster_id) -> centroïde
+#   product_embeddings_ivf     copie de product_embeddings triée par (cluster_id, product_id) :
+#                              `WHERE cluster_id IN (...)` ne lit que les granules des clusters sondés
+#
+# product_embeddings reste la source de vérité (triée par product_id : lookups, re-rank).
+#
+# Usage : python -m database.ivf train|reconcile|drift|watch [--nlist N] [--interval S]
+
+import os
+import sys
+import time
+import argparse
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.vector_ops import l2_normalize
+
+IVF_TABLE = "product_embeddings_ivf"
+DEFAULT_NPROBE = int(os.environ.get("IVF_NPROBE", "0"))              # 0 = scan complet
+RELOAD_S = float(os.environ.get("IVF_RELOAD_S", "60"))
+DRIFT_TOLERANCE = float(os.environ.get("IVF_DRIFT_TOLERANCE", "0.15"))
+DRIFT_MAX_GROWTH = float(os.environ.get("IVF_DRIFT_MAX_GROWTH", "2.0"))
+DRIFT_MAX_IMBALANCE = float(os.environ.get("IVF_DRIFT_MAX_IMBALANCE", "10.0"))
+DRIFT_SAMPLE = 20000
+POINTS_PER_CENTROID = 256       # échantillon d'entraînement max par centroïde
+ASSIGN_BLOCK = 65536
+
+
+def default_nlist(n_rows: int) -> int:
+    """~4·sqrt(N) clusters, puissance de 2 bornée à [16, 4096]"""
+    target = 4 * np.sqrt(max(n_rows, 1))
+    return int(2 ** np.clip(np.round(np.log2(target)), 4, 12))
+
+
+@dataclass
+class IVFCodebook:
+    version: int
+    centroids: np.ndarray              # (nlist, dim) float32, normalisés
+    trained_rows: int = 0
+    distortion: float = 0.0            # 1 - cos moyen au centroïde, sur l'entraînement
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    # --- affectation ---
+    def assign(self, embeddings: np.ndarray) -> np.ndarray:
+        """Cluster le plus proche (cosinus) de chaque ligne -> uint32 (N,)"""
+        x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        out = np.empty(len(x), dtype=np.uint32)
+        for start in range(0, len(x), ASSIGN_BLOCK):
+            block = x[start:start + ASSIGN_BLOCK]
+            out[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Les `nprobe` clusters les plus proches de la requête"""
+        scores = self.centroids @ np.asarray(query, dtype=np.float32).ravel()
+        nprobe = min(nprobe, self.nlist)
+        return np.argpartition(-scores, nprobe - 1)[:nprobe].astype(np.uint32)
+
+    def distortion_of(self, embeddings: np.ndarray) -> float:
+        x, _ = l2_normalize(np.array(embeddings, dtype=np.float32))
+        best = np.empty(len(x), dtype=np.float32)
+        for start in range(0, len(x), ASSIGN_BLOCK):
+            best[start:start + ASSIGN_BLOCK] = (x[start:start + ASSIGN_BLOCK] @ self.centroids.T).max(axis=1)
+        return float(1.0 - best.mean()) if len(best) else 0.0
+
+    # --- entraînement ---
+    @classmethod
+    def train(cls, embeddings: np.ndarray, nlist: int, version: int = 1,
+              iterations: int = 20, seed: int = 0) -> "IVFCodebook":
+        """k-means sphérique (Lloyd), centroïdes initialisés sur des points tirés au hasard"""
+        rng = np.random.default_rng(seed)
+        x, valid = l2_normalize(np.array(embeddings, dtype=np.float32))
+        x = x[valid]
+        nlist = min(nlist, len(x))
+        if len(x) > nlist * POINTS_PER_CENTROID:
+            x = x[rng.choice(len(x), nlist * POINTS_PER_CENTROID, replace=False)]
+        centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            book = cls(version, centroids)
+            labels = book.assign(x)
+            counts = np.bincount(labels, minlength=nlist)
+            order = np.argsort(labels, kind='stable')
+            present = np.flatnonzero(counts)
+            sums = np.zeros_like(centroids)
+            sums[present] = np.add.reduceat(x[order], np.cumsum(counts)[present] - counts[present])
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                # cluster vide : réensemencé sur les points les plus mal représentés
+                fit = np.einsum('ij,ij->i', x, centroids[labels])
+                sums[empty] = x[np.argsort(fit)[:len(empty)]]
+            centroids, _ = l2_normalize(sums)
+
+        book = cls(version, centroids, trained_rows=len(embeddings))
+        book.distortion = book.distortion_of(x)
+        return book
+
+
+# --- persistance ClickHouse ---
+
+def ivf_tables_ddl(database: str, table: str = IVF_TABLE) -> Dict[str, str]:
+    return {
+        "ivf_codebooks": f"""
+        CREATE TABLE IF NOT EXISTS {database}.ivf_codebooks (
+            version UInt32,
+            nlist UInt32,
+            trained_rows UInt64,
+            distortion Float32,
+            created_at DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        ORDER BY version
+        """,
+        "ivf_centroids": f"""
+        CREATE TABLE IF NOT EXISTS {database}.ivf_centroids (
+            version UInt32,
+            cluster_id UInt32,
+            centroid Array(Float32)
+        ) ENGINE = MergeTree()
+        ORDER BY (version, cluster_id)
+        """,
+        table: f"""
+        CREATE TABLE IF NOT EXISTS {database}.{table} (
+            cluster_id UInt32,
+            product_id UInt64,
+            embedding Array(Float32),
+            norm Float32,
+            version UInt32
+        ) ENGINE = MergeTree()
+        ORDER BY (cluster_id, product_id)
+        SETTINGS index_granularity = 256
+        """,
+    }
+
+
+def load_codebook(db) -> Optional[IVFCodebook]:
+    """Dernier codebook en base, None si IVF n'a jamais été entraîné"""
+    try:
+        meta = db.query_native(f"""
+            SELECT version, trained_rows, distortion FROM {db.database}.ivf_codebooks
+            ORDER BY version DESC LIMIT 1
+        """)
+    except Exception:
+        return None
+    if not len(meta.get('version', [])):
+        return None
+    version = int(meta['version'][0])
+    columns = db.query_native(f"""
+        SELECT centroid FROM {db.database}.ivf_centroids
+        WHERE version = {{version:UInt32}} ORDER BY cluster_id
+    """, {'version': version})
+    return IVFCodebook(version, np.asarray(columns['centroid'], dtype=np.float32),
+                       int(meta['trained_rows'][0]), float(meta['distortion'][0]))
+
+
+def save_codebook(db, book: IVFCodebook):
+    db.insert_native('ivf_centroids', [
+        ('version', 'UInt32', np.full(book.nlist, book.version, dtype=np.uint32)),
+        ('cluster_id', 'UInt32', np.arange(book.nlist, dtype=np.uint32)),
+        ('centroid', 'Array(Float32)', book.centroids),
+    ])
+    db.insert_native('ivf_codebooks', [
+        ('version', 'UInt32', np.array([book.version])),
+        ('nlist', 'UInt32', np.array([book.nlist])),
+        ('trained_rows', 'UInt64', np.array([book.trained_rows])),
+        ('distortion', 'Float32', np.array([book.distortion])),
+    ])
+
+
+def ivf_columns(book: IVFCodebook, ids: np.ndarray, embeddings: np.ndarray, norms: np.ndarray):
+    return [
+        ('cluster_id', 'UInt32', book.assign(embeddings)),
+        ('product_id', 'UInt64', np.asarray(ids, dtype=np.uint64)),
+        ('embedding', 'Array(Float32)', embeddings),
+        ('norm', 'Float32', np.asarray(norms, dtype=np.float32)),
+        ('version', 'UInt32', np.full(len(ids), book.version, dtype=np.uint32)),
+    ]
+
+
+def _run(db, sql: str, params=None, settings=None):
+    if db.execute_query(sql, params, settings) is None:
+        raise RuntimeError(f"Échec requête IVF : {sql.strip().splitlines()[0]}")
+
+
+def _count(db, sql: str, params=None) -> int:
+    return int(db.query_native(f"SELECT count() AS c FROM {sql}", params)['c'][0])
+
+
+def _copy_assigned(db, book: IVFCodebook, table: str, ids=None) -> int:
+    """product_embeddings -> table, affectés avec `book` ; retourne le nombre de lignes"""
+    copied = 0
+    for batch_ids, embeddings in db.fetch_embeddings(ids):
+        db.insert_native(table, ivf_columns(book, batch_ids, embeddings,
+                                            np.linalg.norm(embeddings, axis=1)))
+        copied += len(batch_ids)
+    return copied
+
+
+# --- jobs ---
+
+def train(db, nlist: Optional[int] = None, sample: int = 0) -> IVFCodebook:
+    """
+    Entraîne un nouveau codebook, reconstruit la table IVF à côté puis bascule
+    (RENAME), et rattrape les inserts arrivés pendant la reconstruction.
+    """
+    for ddl in ivf_tables_ddl(db.database).values():
+        _run(db, ddl)
+    ids = db.fetch_embedding_ids()
+    if not len(ids):
+        raise RuntimeError("product_embeddings vide")
+    nlist = nlist or default_nlist(len(ids))
+    rng = np.random.default_rng()
+    sample_ids = rng.choice(ids, size=min(len(ids), sample or nlist * POINTS_PER_CENTROID), replace=False)
+    x = np.concatenate([e for _, e in db.fetch_embeddings(sample_ids)])
+
+    previous = load_codebook(db)
+    start = time.time()
+    book = IVFCodebook.train(x, nlist, version=(previous.version + 1) if previous else 1)
+    book.trained_rows = len(ids)
+    print(f"🧮 k-means {book.nlist} clusters sur {len(x)} points en {time.time() - start:.1f}s "
+          f"(distorsion {book.distortion:.4f})")
+
+    staging = f"{IVF_TABLE}_v{book.version}"
+    _run(db, f"DROP TABLE IF EXISTS {db.database}.{staging}")
+    _run(db, ivf_tables_ddl(db.database, staging)[staging])
+    copied = _copy_assigned(db, book, staging)
+
+    # codebook publié juste avant la bascule : les écrivains le rechargent sous IVF_RELOAD_S
+    save_codebook(db, book)
+    _run(db, f"""
+        RENAME TABLE {db.database}.{IVF_TABLE} TO {db.database}.{IVF_TABLE}_old,
+                     {db.database}.{staging} TO {db.database}.{IVF_TABLE}
+    """)
+    _run(db, f"DROP TABLE IF EXISTS {db.database}.{IVF_TABLE}_old")
+    print(f"✅ {IVF_TABLE} v{book.version} : {copied} lignes")
+    reconcile(db, book)
+    return book
+
+
+def reconcile(db, book: Optional[IVFCodebook] = None) -> int:
+    """
+    Remet la table IVF en phase avec product_embeddings et le codebook courant :
+    supprime les lignes affectées avec une ancienne version (écrivain pas encore
+    rechargé) et ajoute les produits manquants.
+    """
+    book = book or load_codebook(db)
+    if book is None:
+        print("ℹ️ Aucun codebook IVF (python -m database.ivf train)")
+        return 0
+    table = f"{db.database}.{IVF_TABLE}"
+    stale = _count(db, f"{table} WHERE version != {{v:UInt32}}", {'v': book.version})
+    if stale:
+        _run(db, f"ALTER TABLE {table} DELETE WHERE version != {{v:UInt32}}",
+             {'v': book.version}, settings={'mutations_sync': 1})
+    missing = db.query_native(f"""
+        SELECT product_id FROM {db.database}.product_embeddings
+        WHERE norm > 0 AND product_id NOT IN (SELECT product_id FROM {table})
+    """).get('product_id', np.empty(0, dtype=np.uint64))
+    added = _copy_assigned(db, book, IVF_TABLE, missing) if len(missing) else 0
+    print(f"🔁 IVF v{book.version} : {stale} ligne(s) obsolète(s) réaffectée(s), {added} ajoutée(s)")
+    return added
+
+
+def drift(db, book: Optional[IVFCodebook] = None) -> Dict:
+    """
+    Indicateurs de dérive du codebook :
+    - distorsion des produits les plus récents vs distorsion d'entraînement
+    - croissance de la table depuis l'entraînement (nlist devient trop petit)
+    - déséquilibre : plus gros cluster / taille moyenne
+    """
+    book = book or load_codebook(db)
+    if book is None:
+        return {"trained": False, "recluster": True, "reasons": ["aucun codebook"]}
+    recent = db.query_native(f"""
+        SELECT product_id FROM {db.database}.product_embeddings
+        WHERE norm > 0 ORDER BY product_id DESC LIMIT {DRIFT_SAMPLE}
+    """).get('product_id', [])
+    x = [e for _, e in db.fetch_embeddings(recent)]
+    recent_distortion = book.distortion_of(np.concatenate(x)) if x else 0.0
+    sizes = db.query_native(f"""
+        SELECT count() AS n FROM {db.database}.{IVF_TABLE} GROUP BY cluster_id
+    """).get('n', np.zeros(1))
+    rows = int(np.sum(sizes))
+    imbalance = float(np.max(sizes) / max(np.mean(sizes), 1)) if len(sizes) else 0.0
+
+    reasons = []
+    if recent_distortion > book.distortion * (1 + DRIFT_TOLERANCE):
+        reasons.append(f"distorsion {recent_distortion:.4f} > {book.distortion:.4f} x {1 + DRIFT_TOLERANCE}")
+    if rows > book.trained_rows * DRIFT_MAX_GROWTH:
+        reasons.append(f"{rows} lignes > {book.trained_rows} x {DRIFT_MAX_GROWTH}")
+    if imbalance > DRIFT_MAX_IMBALANCE:
+        reasons.append(f"déséquilibre {imbalance:.1f} > {DRIFT_MAX_IMBALANCE}")
+    return {
+        "trained": True,
+        "version": book.version,
+        "nlist": book.nlist,
+        "train_distortion": round(book.distortion, 5),
+        "recent_distortion": round(recent_distortion, 5),
+        "rows": rows,
+        "trained_rows": book.trained_rows,
+        "imbalance": round(imbalance, 2),
+        "recluster": bool(reasons),
+        "reasons": reasons,
+    }
+
+
+def watch(db, interval_s: float = 3600, nlist: Optional[int] = None):
+    """Boucle : réconciliation, puis ré-entraînement si une dérive est détectée"""
+    while True:
+        try:
+            report = drift(db)
+            print(f"[IVF] {report}")
+            if report["recluster"]:
+                train(db, nlist=nlist)
+            else:
+                reconcile(db)
+        except Exception as e:
+            print(f"❌ [IVF] {e}")
+        time.sleep(interval_s)
+
+
+if __name__ == "__main__":
+    from database.clickhouse_setup import ClickHouseVectorDB
+
+    parser = argparse.ArgumentParser(description="Codebook IVF et table product_embeddings_ivf")
+    parser.add_argument("command", choices=["train", "reconcile", "drift", "watch"])
+    parser.add_argument("--host", default="http://localhost:8123")
+    parser.add_argument("--database", default="vinted_lens")
+    parser.add_argument("--nlist", type=int, default=None, help="défaut : ~4·sqrt(N)")
+    parser.add_argument("--sample", type=int, default=0, help="points d'entraînement (défaut 256/cluster)")
+    parser.add_argument("--interval", type=float, default=3600, help="watch : secondes entre contrôles")
+    args = parser.parse_args()
+
+    db = ClickHouseVectorDB(host=args.host, database=args.database)
+    if args.command == "train":
+        train(db, nlist=args.nlist, sample=args.sample)
+    elif args.command == "reconcile":
+        reconcile(db)
+    elif args.command == "drift":
+        print(drift(db))
+    else:
+        watch(db, args.interval, nlist=args.nlist)
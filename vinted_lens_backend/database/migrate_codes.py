@@ -0,0 +1,46 @@
+# database/migrate_codes.py
+# Crée et remplit product_codes : codes de signe 512 bits (8 x UInt64) de chaque
+# embedding, utilisés par le mode de recherche `binary` (préfiltre Hamming).
+# Les nouveaux produits reçoivent leur code à l'insert (add_products).
+#
+# Calcul côté serveur, même convention que utils.vector_ops.sign_codes :
+# bit i du mot k = embedding[64·k + i] > 0.
+#
+# Usage : python -m database.migrate_codes [--dry-run] [--chunk 500000]
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.clickhouse_setup import ClickHouseVectorDB, CODES_TABLE, CODE_WORDS
+from database.migrate_compact import backfill_table
+
+
+def word_sql(k: int) -> str:
+    return (f"arraySum(i -> bitShiftLeft(toUInt64(embedding[{64 * k} + i + 1] > 0), i), range(64))"
+            f" AS w{k}")
+
+
+SELECT_CODES = ("\n        SELECT product_id, "
+                + ", ".join(word_sql(k) for k in range(CODE_WORDS))
+                + "\n        FROM {db}.product_embeddings\n        WHERE {where}")
+
+
+def backfill(db: ClickHouseVectorDB, chunk: int = 500000, dry_run: bool = False) -> bool:
+    columns = "product_id, " + ", ".join(f"w{k}" for k in range(CODE_WORDS))
+    return backfill_table(db, CODES_TABLE, db.codes_table_ddl(), columns, SELECT_CODES,
+                          chunk=chunk, dry_run=dry_run)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crée et remplit les codes binaires des embeddings")
+    parser.add_argument("--host", default="http://localhost:8123")
+    parser.add_argument("--database", default="vinted_lens")
+    parser.add_argument("--chunk", type=int, default=500000, help="lignes par INSERT ... SELECT")
+    parser.add_argument("--dry-run", action="store_true", help="affiche le SQL sans l'exécuter")
+    args = parser.parse_args()
+
+    ok = backfill(ClickHouseVectorDB(host=args.host, database=args.database),
+                  chunk=args.chunk, dry_run=args.dry_run)
+    sys.exit(0 if ok else 1)
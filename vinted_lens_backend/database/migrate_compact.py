@@ -0,0 +1,115 @@
+# database/migrate_compact.py
+# Crée et remplit la copie compacte des embeddings (phase 1 de la recherche) :
+#   - int8     : product_embeddings_int8 (Array(Int8) + échelle par ligne, ~0.5 Ko/ligne)
+#   - bfloat16 : product_embeddings_bf16 (Array(BFloat16), ~1 Ko/ligne)
+# product_embeddings (Float32) n'est pas modifiée : elle sert au re-rank exact.
+#
+# Le backfill est fait côté serveur (INSERT ... SELECT), par tranches d'ids, et
+# reprend là où il s'est arrêté (ids absents de la table compacte uniquement).
+# Activer ensuite : EMBEDDING_LAYOUT=int8 (ou bfloat16), EMBEDDING_RERANK=200.
+#
+# Usage : python -m database.migrate_compact --layout int8 [--dry-run] [--chunk 200000]
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.clickhouse_setup import ClickHouseVectorDB, COMPACT_TABLES, BFLOAT16_SETTINGS
+from database.migrate_schema import count
+
+# Même quantification que utils.vector_ops.quantize_int8
+SELECT_COMPACT = {
+    'int8': """
+        SELECT product_id,
+               arrayMap(x -> toInt8(greatest(-127, least(127, round(x / s)))), embedding),
+               s, norm
+        FROM (
+            SELECT product_id, embedding, norm,
+                   if(arrayMax(arrayMap(x -> abs(x), embedding)) > 0,
+                      arrayMax(arrayMap(x -> abs(x), embedding)) / 127, 1) AS s
+            FROM {db}.product_embeddings
+            WHERE {where}
+        )""",
+    'bfloat16': """
+        SELECT product_id, CAST(embedding, 'Array(BFloat16)'), norm
+        FROM {db}.product_embeddings
+        WHERE {where}""",
+}
+INSERT_COLUMNS = {
+    'int8': "product_id, embedding, scale, norm",
+    'bfloat16': "product_id, embedding, norm",
+}
+
+
+def id_range(db: ClickHouseVectorDB) -> tuple:
+    columns = db.query_native(
+        f"SELECT min(product_id) AS lo, max(product_id) AS hi FROM {db.database}.product_embeddings"
+    )
+    return int(columns['lo'][0]), int(columns['hi'][0])
+
+
+def backfill_table(db: ClickHouseVectorDB, table: str, ddl: str, columns: str, select: str,
+                   chunk: int = 200000, dry_run: bool = False, settings=None) -> bool:
+    """
+    Crée `table` puis la remplit depuis product_embeddings par INSERT ... SELECT,
+    tranche d'ids par tranche d'ids ; `select` reçoit {db} et {where}.
+    Reprend là où un run précédent s'est arrêté (ids déjà présents ignorés).
+    """
+    print(f"➡️  Crée {table}")
+    if dry_run:
+        print(ddl)
+    elif db.execute_query(ddl, settings=settings) is None:
+        print(f"❌ Échec création {table}")
+        return False
+
+    total = count(db, "product_embeddings")
+    if not total:
+        print("ℹ️ product_embeddings vide, rien à copier")
+        return True
+
+    # tranches de `chunk` ids environ (les ids sont croissants mais pas denses)
+    lo, hi = id_range(db)
+    step = max(1, (hi - lo + 1) * chunk // total)
+    start = lo
+    while start <= hi:
+        end = start + step
+        where = (f"product_id >= {start} AND product_id < {end} AND norm > 0 "
+                 f"AND product_id NOT IN (SELECT product_id FROM {db.database}.{table} "
+                 f"WHERE product_id >= {start} AND product_id < {end})")
+        sql = f"INSERT INTO {db.database}.{table} ({columns})" + select.format(db=db.database, where=where)
+        if dry_run:
+            print(sql)
+            break
+        if db.execute_query(sql, settings=settings) is None:
+            print(f"❌ Échec tranche [{start}, {end})")
+            return False
+        print(f"  {count(db, table)}/{total} lignes")
+        start = end
+
+    if not dry_run:
+        copied = count(db, table)
+        print(f"✅ {table} : {copied} lignes ({total} dans product_embeddings)")
+        if copied < total:
+            print("⚠️ Lignes manquantes (norme nulle ?) : elles ne seront pas trouvées en phase 1")
+    return True
+
+
+def backfill(db: ClickHouseVectorDB, layout: str, chunk: int = 200000, dry_run: bool = False) -> bool:
+    return backfill_table(db, COMPACT_TABLES[layout], db.compact_table_ddl(layout),
+                          INSERT_COLUMNS[layout], SELECT_COMPACT[layout], chunk=chunk, dry_run=dry_run,
+                          settings=BFLOAT16_SETTINGS if layout == 'bfloat16' else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crée et remplit la copie compacte des embeddings")
+    parser.add_argument("--layout", choices=sorted(COMPACT_TABLES), default="int8")
+    parser.add_argument("--host", default="http://localhost:8123")
+    parser.add_argument("--database", default="vinted_lens")
+    parser.add_argument("--chunk", type=int, default=200000, help="lignes par INSERT ... SELECT")
+    parser.add_argument("--dry-run", action="store_true", help="affiche le SQL sans l'exécuter")
+    args = parser.parse_args()
+
+    ok = backfill(ClickHouseVectorDB(host=args.host, database=args.database),
+                  args.layout, chunk=args.chunk, dry_run=args.dry_run)
+    sys.exit(0 if ok else 1)
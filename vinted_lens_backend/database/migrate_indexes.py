@@ -0,0 +1,46 @@
+# database/migrate_indexes.py
+# Index de saut de products utilisés par les recherches filtrées (database/filter_planner.py) :
+#   minmax sur price, set sur category / size, bloom_filter sur brand (voir SKIP_INDEXES)
+#
+# ADD INDEX ne couvre que les parts écrites ensuite ; MATERIALIZE INDEX (mutation
+# asynchrone) les construit sur les données existantes.
+#
+# Usage : python -m database.migrate_indexes [--dry-run] [--no-materialize]
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.clickhouse_setup import ClickHouseVectorDB, SKIP_INDEXES
+
+
+def migrate(db: ClickHouseVectorDB, dry_run: bool = False, materialize: bool = True) -> bool:
+    steps = db.skip_index_ddl()
+    if materialize:
+        steps += db.skip_index_ddl(materialize=True)
+    for sql in steps:
+        print(f"➡️  {sql}")
+        if dry_run:
+            continue
+        if db.execute_query(sql) is None:
+            print("❌ Échec")
+            return False
+    if not dry_run:
+        print(f"✅ {len(SKIP_INDEXES)} index de saut sur products"
+              + (" (matérialisation en cours : system.mutations)" if materialize else ""))
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajoute les index de saut de products")
+    parser.add_argument("--host", default="http://localhost:8123")
+    parser.add_argument("--database", default="vinted_lens")
+    parser.add_argument("--dry-run", action="store_true", help="affiche le SQL sans l'exécuter")
+    parser.add_argument("--no-materialize", action="store_true",
+                        help="n'indexe que les nouvelles parts")
+    args = parser.parse_args()
+
+    ok = migrate(ClickHouseVectorDB(host=args.host, database=args.database),
+                 dry_run=args.dry_run, materialize=not args.no_materialize)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,107 @@
+# database/migrate_schema.py
+# Migration vers le schéma dénormalisé :
+#   - products : métadonnées seulement, ORDER BY id (phase 2 = lookup clé primaire)
+#   - product_embeddings : seule copie de l'embedding (phase 1 = scan étroit)
+#
+# Étapes :
+#   1. complète product_embeddings avec les produits qui n'y ont pas encore de ligne
+#   2. crée products_v2 (nouveau schéma, recréée si un run précédent s'est arrêté
+#      en cours de copie) et y copie les métadonnées
+#   3. bascule : products -> products_legacy, products_v2 -> products
+#   4. (option --drop-legacy) supprime l'ancienne table, seulement si les comptes concordent
+#
+# Usage : python -m database.migrate_schema [--dry-run] [--drop-legacy]
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.clickhouse_setup import ClickHouseVectorDB
+
+METADATA_COLUMNS = ("id, title, price, platform, image_url, category, color, "
+                    "brand, size, condition, created_at, updated_at")
+
+
+def table_columns(db: ClickHouseVectorDB, table: str) -> list:
+    columns = db.query_native(
+        "SELECT name FROM system.columns WHERE database = {db:String} AND table = {table:String}",
+        {'db': db.database, 'table': table},
+    )
+    return list(columns.get('name', []))
+
+
+def count(db: ClickHouseVectorDB, table: str) -> int:
+    return int(db.query_native(f"SELECT count() AS c FROM {db.database}.{table}")['c'][0])
+
+
+def migrate(db: ClickHouseVectorDB, dry_run: bool = False, drop_legacy: bool = False) -> bool:
+    columns = table_columns(db, "products")
+    if not columns:
+        print("ℹ️ Table products absente : init_database() crée directement le nouveau schéma")
+        return db.init_database()
+    if "embedding" not in columns:
+        print("✅ products est déjà au schéma dénormalisé, rien à faire")
+        return True
+
+    steps = [
+        ("Complète product_embeddings depuis products.embedding", f"""
+        INSERT INTO {db.database}.product_embeddings (product_id, embedding, norm)
+        SELECT id, embedding, sqrt(arraySum(x -> x * x, embedding))
+        FROM {db.database}.products
+        WHERE length(embedding) > 0
+          AND id NOT IN (SELECT product_id FROM {db.database}.product_embeddings)
+        """),
+        # products_v2 ne survit qu'à un run interrompu avant la bascule : copie partielle
+        ("Supprime un products_v2 incomplet", f"DROP TABLE IF EXISTS {db.database}.products_v2"),
+        ("Crée products_v2", db.products_table_ddl("products_v2")),
+        ("Copie les métadonnées", f"""
+        INSERT INTO {db.database}.products_v2 ({METADATA_COLUMNS})
+        SELECT {METADATA_COLUMNS} FROM {db.database}.products
+        """),
+        ("Bascule products -> products_legacy, products_v2 -> products", f"""
+        RENAME TABLE {db.database}.products TO {db.database}.products_legacy,
+                     {db.database}.products_v2 TO {db.database}.products
+        """),
+    ]
+
+    before = count(db, "products")
+    for label, sql in steps:
+        print(f"➡️  {label}")
+        if dry_run:
+            print(sql)
+            continue
+        if db.execute_query(sql) is None:
+            print(f"❌ Échec à l'étape : {label}")
+            return False
+
+    if not dry_run:
+        after = count(db, "products")
+        embeddings = count(db, "product_embeddings")
+        print(f"✅ Migration terminée : {before} -> {after} produits, {embeddings} embeddings")
+        if after != before:
+            print("⚠️ Nombre de produits différent : vérifier products_legacy avant suppression")
+            return False
+
+    if drop_legacy:
+        sql = f"DROP TABLE {db.database}.products_legacy"
+        print("➡️  Supprime products_legacy")
+        if dry_run:
+            print(sql)
+        elif db.execute_query(sql) is None:
+            print("❌ Échec à l'étape : Supprime products_legacy")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migre products vers le schéma sans embedding")
+    parser.add_argument("--host", default="http://localhost:8123")
+    parser.add_argument("--database", default="vinted_lens")
+    parser.add_argument("--dry-run", action="store_true", help="affiche le SQL sans l'exécuter")
+    parser.add_argument("--drop-legacy", action="store_true", help="supprime l'ancienne table")
+    args = parser.parse_args()
+
+    ok = migrate(ClickHouseVectorDB(host=args.host, database=args.database),
+                 dry_run=args.dry_run, drop_legacy=args.drop_legacy)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,184 @@
+# database/native_format.py
+# Décodage du format Native (colonnaire, binaire) de ClickHouse renvoyé par l'interface HTTP
+
+import re
+import numpy as np
+from typing import Dict, List, Tuple, Union
+
+# Types à largeur fixe -> dtype NumPy little-endian
+FIXED_TYPES = {
+    'UInt8': '<u1', 'UInt16': '<u2', 'UInt32': '<u4', 'UInt64': '<u8',
+    'Int8': '<i1', 'Int16': '<i2', 'Int32': '<i4', 'Int64': '<i8',
+    'Float32': '<f4', 'Float64': '<f8',
+    'Date': '<u2', 'DateTime': '<u4', 'Bool': '<u1',
+    'BFloat16': '<u2',      # bits bruts : utils.vector_ops.to_bfloat16 / from_bfloat16
+}
+
+FIXED_STRING_RE = re.compile(r'^FixedString\((\d+)\)$')
+DATETIME_RE = re.compile(r"^DateTime\('.*'\)$")
+
+Column = Union[np.ndarray, List]
+
+
+class NativeReader:
+    """Curseur sur un buffer Native"""
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def eof(self) -> bool:
+        return self.pos >= len(self.data)
+
+    def read_varint(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read_bytes(self, n: int) -> memoryview:
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def read_string(self) -> str:
+        return bytes(self.read_bytes(self.read_varint())).decode('utf-8', errors='replace')
+
+    def read_array(self, dtype: str, count: int) -> np.ndarray:
+        dt = np.dtype(dtype)
+        # copie : le buffer de la réponse HTTP n'est pas conservé
+        return np.frombuffer(self.read_bytes(count * dt.itemsize), dtype=dt).copy()
+
+
+def _read_column(reader: NativeReader, type_name: str, rows: int) -> Column:
+    """Lit `rows` valeurs d'une colonne du type donné"""
+    if DATETIME_RE.match(type_name):
+        type_name = 'DateTime'
+
+    if type_name in FIXED_TYPES:
+        return reader.read_array(FIXED_TYPES[type_name], rows)
+
+    if type_name == 'String':
+        return [reader.read_string() for _ in range(rows)]
+
+    match = FIXED_STRING_RE.match(type_name)
+    if match:
+        width = int(match.group(1))
+        return reader.read_array(f'S{width}', rows)
+
+    if type_name.startswith('Nullable(') and type_name.endswith(')'):
+        null_map = reader.read_array('<u1', rows).astype(bool)
+        values = _read_column(reader, type_name[9:-1], rows)
+        return [None if is_null else v for v, is_null in zip(values, null_map)]
+
+    if type_name.startswith('Array(') and type_name.endswith(')'):
+        offsets = reader.read_array('<u8', rows)
+        total = int(offsets[-1]) if rows else 0
+        flat = _read_column(reader, type_name[6:-1], total)
+        if isinstance(flat, np.ndarray) and rows:
+            lengths = np.diff(offsets, prepend=0)
+            # embeddings de même dimension -> matrice (rows, dim) sans copie supplémentaire
+            if np.all(lengths == lengths[0]):
+                return flat.reshape(rows, int(lengths[0]))
+            return np.split(flat, offsets[:-1].astype(np.int64))
+        starts = np.concatenate([[0], offsets[:-1]]).astype(np.int64)
+        return [flat[s:e] for s, e in zip(starts, offsets.astype(np.int64))]
+
+    raise NotImplementedError(f"Type Native non supporté: {type_name}")
+
+
+def _concat(parts: List[Column]) -> Column:
+    if all(isinstance(p, np.ndarray) for p in parts):
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+    out = []
+    for p in parts:
+        out.extend(p if isinstance(p, list) else list(p))
+    return out
+
+
+def decode_native(data: bytes) -> Tuple[Dict[str, Column], Dict[str, str]]:
+    """
+    Décode une réponse `FORMAT Native` (un ou plusieurs blocs).
+
+    Returns:
+        (colonnes, types) : nom -> np.ndarray (types numériques, Array numériques
+        de longueur constante en 2D) ou list (String, Nullable), et nom -> type ClickHouse
+    """
+    reader = NativeReader(data)
+    columns: Dict[str, List[Column]] = {}
+    types: Dict[str, str] = {}
+
+    while not reader.eof():
+        n_columns = reader.read_varint()
+        n_rows = reader.read_varint()
+        for _ in range(n_columns):
+            name = reader.read_string()
+            type_name = reader.read_string()
+            types[name] = type_name
+            columns.setdefault(name, []).append(_read_column(reader, type_name, n_rows))
+
+    return {name: _concat(parts) for name, parts in columns.items()}, types
+
+
+# --- encodage (INSERT ... FORMAT Native) ---
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return _varint(len(data)) + data
+
+
+def _write_column(type_name: str, values: Column, rows: int) -> bytes:
+    if type_name in FIXED_TYPES:
+        return np.ascontiguousarray(values, dtype=FIXED_TYPES[type_name]).tobytes()
+
+    if type_name == 'String':
+        return b''.join(_string('' if v is None else str(v)) for v in values)
+
+    if type_name.startswith('Array(') and type_name.endswith(')'):
+        inner = type_name[6:-1]
+        if isinstance(values, np.ndarray) and values.ndim == 2:
+            # matrice (rows, dim) : offsets réguliers, données à plat sans boucle Python
+            offsets = np.arange(1, rows + 1, dtype='<u8') * values.shape[1]
+            return offsets.tobytes() + _write_column(inner, values.reshape(-1), values.size)
+        lengths = np.fromiter((len(v) for v in values), dtype='<u8', count=rows)
+        flat = np.concatenate([np.asarray(v) for v in values]) if rows else np.empty(0)
+        return np.cumsum(lengths, dtype='<u8').tobytes() + _write_column(inner, flat, len(flat))
+
+    raise NotImplementedError(f"Type Native non supporté en écriture: {type_name}")
+
+
+def encode_native(columns: List[Tuple[str, str, Column]]) -> bytes:
+    """
+    Encode un bloc Native (corps d'un `INSERT ... FORMAT Native`).
+
+    Args:
+        columns: [(nom, type ClickHouse, valeurs)] ; numériques en np.ndarray,
+            Array(Float32) en matrice (rows, dim), String en liste
+
+    Returns:
+        un bloc unique, toutes les colonnes de même longueur
+    """
+    rows = len(columns[0][2]) if columns else 0
+    parts = [_varint(len(columns)), _varint(rows)]
+    for name, type_name, values in columns:
+        if len(values) != rows:
+            raise ValueError(f"Colonne {name}: {len(values)} valeurs au lieu de {rows}")
+        parts += [_string(name), _string(type_name), _write_column(type_name, values, rows)]
+    return b''.join(parts)
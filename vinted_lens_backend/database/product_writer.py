@@ -0,0 +1,133 @@
+# database/product_writer.py
+# Tampon d'écriture des produits : regroupe les ajouts unitaires en inserts Native par lot
+
+import os
+import time
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_FLUSH_SIZE = int(os.environ.get("PRODUCT_FLUSH_SIZE", "500"))
+DEFAULT_FLUSH_INTERVAL_S = float(os.environ.get("PRODUCT_FLUSH_INTERVAL_S", "2.0"))
+
+
+class ProductWriter:
+    """
+    Accumule (métadonnées, embedding) et écrit via `db.add_products` :
+
+    - dès que `flush_size` produits sont en attente
+    - au plus tard `flush_interval_s` après le premier ajout en attente (thread de fond)
+    - à `flush()` / `close()` (ou en sortie de `with`)
+
+    Les ids sont attribués à l'ajout : l'appelant les connaît avant l'écriture.
+    Un lot en échec est compté (`failed`) puis abandonné, sans bloquer les suivants.
+    """
+
+    def __init__(self, db, flush_size: int = DEFAULT_FLUSH_SIZE,
+                 flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S):
+        self.db = db
+        self.flush_size = max(1, int(flush_size))
+        self.flush_interval_s = flush_interval_s
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()     # un seul insert à la fois, dans l'ordre
+        self._products: List[Dict] = []
+        self._embeddings: List[np.ndarray] = []
+        self._oldest: Optional[float] = None
+        self._closed = threading.Event()
+        self._thread = None
+        if flush_interval_s and flush_interval_s > 0:
+            self._thread = threading.Thread(target=self._flush_loop, name="product-writer", daemon=True)
+            self._thread.start()
+
+        # métriques
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.flush_time_s = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- ajout ---
+    def add(self, product: Dict, embedding: np.ndarray) -> int:
+        return self.add_many([product], np.asarray(embedding, dtype=np.float32)[None, :])[0]
+
+    def add_many(self, products: List[Dict], embeddings: np.ndarray) -> List[int]:
+        """Met en attente un lot ; retourne les ids attribués"""
+        if not len(products):
+            return []
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(products), -1)
+        products = [{k: v for k, v in p.items() if k != 'embedding'} for p in products]
+        # ids générés seulement pour les produits sans id (absent ou None)
+        missing = [p for p in products if p.get('id') is None]
+        for product, pid in zip(missing, self.db.new_product_ids(len(missing)) if missing else []):
+            product['id'] = int(pid)
+        with self._lock:
+            self._products.extend(products)
+            self._embeddings.append(embeddings)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._products) >= self.flush_size
+        if full:
+            self.flush()
+        return [int(p['id']) for p in products]
+
+    @property
+    def pending(self) -> int:
+        return len(self._products)
+
+    # --- écriture ---
+    def _take(self):
+        with self._lock:
+            products, self._products = self._products, []
+            embeddings, self._embeddings = self._embeddings, []
+            self._oldest = None
+        return products, (np.concatenate(embeddings) if embeddings else None)
+
+    def flush(self) -> int:
+        """Écrit tout ce qui est en attente, par lots de flush_size ; retourne le nombre écrit"""
+        with self._flush_lock:
+            products, embeddings = self._take()
+            written = 0
+            for start in range(0, len(products), self.flush_size):
+                batch = products[start:start + self.flush_size]
+                t0 = time.perf_counter()
+                try:
+                    self.db.add_products(batch, embeddings[start:start + len(batch)])
+                    written += len(batch)
+                    self.batches += 1
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"❌ Erreur insert lot produits ({len(batch)}): {e}")
+                self.flush_time_s += time.perf_counter() - t0
+            self.written += written
+            return written
+
+    def _flush_loop(self):
+        while not self._closed.wait(min(self.flush_interval_s, 0.5)):
+            oldest = self._oldest
+            if oldest is not None and time.monotonic() - oldest >= self.flush_interval_s:
+                self.flush()
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "pending": self.pending,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0,
+            "flush_time_s": round(self.flush_time_s, 3),
+            "flush_size": self.flush_size,
+            "flush_interval_s": self.flush_interval_s,
+        }
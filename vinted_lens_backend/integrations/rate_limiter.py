@@ -0,0 +1,161 @@
+# integrations/rate_limiter.py
+# Limitation de débit adaptative (AIMD) des appels Vinted, par classe d'endpoint
+
+import time
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+
+# Budgets par classe d'endpoint : (débit initial req/s, rafale, débit min, débit max)
+DEFAULT_BUDGETS: Dict[str, Tuple[float, float, float, float]] = {
+    "catalog": (1.1, 3, 0.2, 3.0),      # /api/v2/catalog/items
+    "facets":  (0.5, 2, 0.1, 1.0),      # /api/v2/faceted_categories
+    "images":  (20.0, 40, 2.0, 60.0),   # CDN photos
+}
+
+THROTTLE_STATUSES = (429, 403)
+RECENT_WINDOW_S = 60.0      # fenêtre de current_rate()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After en secondes (entier) ou date HTTP -> délai en secondes"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Seau à jetons partagé entre threads et tâches asyncio, à débit adaptatif (AIMD).
+
+    - rafales jusqu'à `burst` requêtes, puis `rate` requêtes/s
+    - succès : +`increase` req/s (jusqu'à max_rate)
+    - 429/403 : débit divisé par 2 (jusqu'à min_rate) ; Retry-After bloque le seau
+    - la réservation se fait sous verrou, l'attente en dehors : `acquire` (time.sleep)
+      et `aacquire` (asyncio.sleep) peuvent être mélangés sur le même seau
+    """
+
+    def __init__(self, rate: float, burst: float = 1, min_rate: Optional[float] = None,
+                 max_rate: Optional[float] = None, increase: float = 0.05, name: str = "bucket"):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate if min_rate is not None else rate / 10)
+        self.max_rate = float(max_rate if max_rate is not None else rate)
+        self.increase = increase
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._recent = deque()          # horodatages des requêtes (fenêtre RECENT_WINDOW_S)
+
+        # métriques
+        self.requests = 0
+        self.throttled = 0
+        self.waited_s = 0.0
+
+    def _reserve(self) -> float:
+        """Prend un jeton (éventuellement à crédit) et retourne l'attente nécessaire"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate, self._blocked_until - now)
+            self.requests += 1
+            self.waited_s += wait
+            self._recent.append(now + wait)
+            # élagué ici aussi : sans appel à current_rate() la deque grossirait sans fin
+            while self._recent[0] < now - RECENT_WINDOW_S:
+                self._recent.popleft()
+            return wait
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # --- adaptation ---
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def observe(self, status_code: int, headers: Optional[Mapping[str, str]] = None) -> bool:
+        """Adapte le débit à une réponse ; True si le serveur a demandé de ralentir"""
+        if status_code in THROTTLE_STATUSES:
+            self.on_throttle(parse_retry_after((headers or {}).get("Retry-After")))
+            return True
+        if status_code < 400:
+            self.on_success()
+        return False
+
+    def current_rate(self, window_s: float = RECENT_WINDOW_S) -> float:
+        """Débit effectif observé (req/s) sur la fenêtre"""
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] < now - window_s:
+                self._recent.popleft()
+            recent = [t for t in self._recent if t <= now]
+            if not recent:
+                return 0.0
+            return len(recent) / max(1.0, min(window_s, now - recent[0]))
+
+    def stats(self) -> Dict:
+        return {
+            "rate_limit": round(self.rate, 3),
+            "current_rate": round(self.current_rate(), 3),
+            "burst": self.burst,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "waited_s": round(self.waited_s, 2),
+            "blocked_for_s": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+        }
+
+
+class RateLimiter:
+    """Un seau par classe d'endpoint (catalog, facets, images), partagé par tous les workers"""
+
+    def __init__(self, budgets: Optional[Dict[str, Tuple[float, float, float, float]]] = None):
+        self.buckets: Dict[str, TokenBucket] = {}
+        for name, (rate, burst, min_rate, max_rate) in (budgets or DEFAULT_BUDGETS).items():
+            self.buckets[name] = TokenBucket(rate, burst, min_rate, max_rate, name=name)
+
+    def bucket(self, endpoint: str) -> TokenBucket:
+        if endpoint not in self.buckets:
+            # classe inconnue : budget prudent du catalogue
+            self.buckets[endpoint] = TokenBucket(*DEFAULT_BUDGETS["catalog"], name=endpoint)
+        return self.buckets[endpoint]
+
+    def acquire(self, endpoint: str):
+        self.bucket(endpoint).acquire()
+
+    async def aacquire(self, endpoint: str):
+        await self.bucket(endpoint).aacquire()
+
+    def observe(self, endpoint: str, status_code: int, headers=None) -> bool:
+        return self.bucket(endpoint).observe(status_code, headers)
+
+    def stats(self) -> Dict:
+        return {name: bucket.stats() for name, bucket in self.buckets.items()}
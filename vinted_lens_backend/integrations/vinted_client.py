@@ -1,47 +1,135 @@
-import time
 import requests
 from typing import Optional, Dict, Any
 
+from integrations.rate_limiter import RateLimiter, DEFAULT_BUDGETS
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401  (HTTP/2 pour httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+BROWSER_HEADERS = {
+    "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                   "AppleWebKit/537.36 (KHTML, like Gecko) "
+                   "Chrome/118.0.0.0 Safari/537.36"),
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Connection": "keep-alive",
+}
+CSRF_COOKIES = ("vinted_csrf", "csrf_token", "secure_vinted_csrf")
+
+# Taille max d'une photo téléchargée (au-delà : ResponseTooLargeError)
+MAX_IMAGE_BYTES = 15 * 1024 * 1024
+
+
+class ResponseTooLargeError(ValueError):
+    """Corps de réponse au-delà de la taille autorisée (lecture interrompue)"""
+
+
+def _items_params(query: str, page: int, per_page: int) -> Dict[str, Any]:
+    return {
+        "search_text": query,
+        "order": "newest_first",
+        "page": page,
+        "per_page": per_page,
+    }
+
+
+def _catalog_params(params: dict) -> Dict[str, Any]:
+    p = dict(params or {})
+    p.setdefault("order", "newest_first")
+    p.setdefault("page", 1)
+    p.setdefault("per_page", 20)
+    p.setdefault("screen_name", "catalog")
+    return p
+
+
+def _facet_params(catalog_ids: str, search_text: str) -> Dict[str, Any]:
+    return {
+        "catalog_ids": catalog_ids,
+        "filter_search_text": search_text,
+        "brand_ids": "",
+        "size_ids": "",
+        "status_ids": "",
+        "color_ids": "",
+        "material_ids": "",
+    }
+
+
+def _json_dict(r, default: dict) -> dict:
+    """JSON d'une réponse (requests ou httpx) si c'est un dict, sinon `default`"""
+    try:
+        js = r.json()
+        if not isinstance(js, dict):
+            print("[VINTED] WARN: JSON n'est pas un dict, type=", type(js))
+            return default
+        return js
+    except Exception as je:
+        print("[VINTED] JSON parse error:", je)
+        print(r.text[:800])
+        return default
+
+
 class VintedClient:
     """
     Client HTTP pour endpoints privés Vinted.
-    - Gère session, en-têtes réalistes, rate-limit
+    - Gère session, en-têtes réalistes, rate-limit adaptatif par classe d'endpoint
+      (RateLimiter partageable entre threads / tâches asyncio / clients)
     - Récupère le token CSRF via un GET initial sur la home
     - Ajoute les en-têtes XHR attendus (X-Requested-With, Referer, X-CSRF-Token)
     """
 
-    def __init__(self, base="https://www.vinted.fr", min_interval_s: float = 0.8):
+    def __init__(self, base="https://www.vinted.fr", min_interval_s: float = 0.8,
+                 limiter: Optional[RateLimiter] = None, max_retries: int = 2):
         self.base = base.rstrip("/")
         self.session = requests.Session()
-        self.session.headers.update({
-            "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                           "AppleWebKit/537.36 (KHTML, like Gecko) "
-                           "Chrome/118.0.0.0 Safari/537.36"),
-            "Accept": "application/json, text/plain, */*",
-            "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Connection": "keep-alive",
-        })
-        self._last_call = 0.0
+        self.session.headers.update(BROWSER_HEADERS)
+        self._init_limits(min_interval_s, limiter, max_retries)
+
+    def _init_limits(self, min_interval_s: float, limiter: Optional[RateLimiter], max_retries: int):
         self.min_interval_s = min_interval_s
+        self.max_retries = max_retries
         self._csrf_token: Optional[str] = None
+        if limiter is None:
+            # débit initial du catalogue = ancien intervalle fixe, adapté ensuite aux réponses
+            budgets = dict(DEFAULT_BUDGETS)
+            _, burst, min_rate, max_rate = budgets["catalog"]
+            budgets["catalog"] = (1.0 / min_interval_s, burst, min_rate, max_rate)
+            limiter = RateLimiter(budgets)
+        self.limiter = limiter
 
     # --- utils ---
-    def _sleep_if_needed(self):
-        elapsed = time.time() - self._last_call
-        if elapsed < self.min_interval_s:
-            time.sleep(self.min_interval_s - elapsed)
-        self._last_call = time.time()
+    @staticmethod
+    def endpoint_class(url: str) -> str:
+        """Budget de rate-limit applicable à une URL"""
+        if "/api/v2/faceted_categories" in url:
+            return "facets"
+        if "/api/" in url:
+            return "catalog"
+        return "images"
+
+    def rate_stats(self) -> Dict[str, Any]:
+        return self.limiter.stats()
 
     def _ensure_csrf(self):
         """Charge la home pour obtenir les cookies (dont vinted_csrf) puis mémorise le token."""
         if self._csrf_token:
             return
         # 1) un GET sur la home pour récupérer les Set-Cookie
-        resp = self.session.get(self.base + "/", timeout=12)
-        # 2) extraire le cookie vinted_csrf (nom fréquemment utilisé côté Vinted)
-        csrf = (self.session.cookies.get("vinted_csrf")
-                or self.session.cookies.get("csrf_token")
-                or self.session.cookies.get("secure_vinted_csrf"))
+        self.session.get(self.base + "/", timeout=12)
+        # 2) mémoriser le token CSRF
+        self._remember_csrf(self.session.cookies)
+
+    def _remember_csrf(self, cookies):
+        # extraire le cookie vinted_csrf (nom fréquemment utilisé côté Vinted)
+        csrf = next((cookies.get(name) for name in CSRF_COOKIES if cookies.get(name)), None)
         if csrf:
             self._csrf_token = csrf
         # Pas d'exception si pas trouvé: certains GET passent sans CSRF ; on l'ajoutera si dispo.
@@ -61,13 +149,18 @@ class VintedClient:
     # --- requêtes ---
     def get(self, path: str, params: Optional[Dict[str, Any]] = None,
             referer: Optional[str] = None) -> requests.Response:
-        self._sleep_if_needed()
         url = path if path.startswith("http") else f"{self.base}{path}"
+        endpoint = self.endpoint_class(url)
         self._ensure_csrf()
         headers = self._with_xhr_headers(extra_ref=referer)
-        print(f"[VINTED] GET {url} params={params or {}}")
-        resp = self.session.get(url, params=params, headers=headers, timeout=12)
-        print(f"[VINTED] -> {resp.status_code} {len(resp.content)} bytes")
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(endpoint)
+            print(f"[VINTED] GET {url} params={params or {}}")
+            resp = self.session.get(url, params=params, headers=headers, timeout=12)
+            print(f"[VINTED] -> {resp.status_code} {len(resp.content)} bytes")
+            # 429/403 : le seau ralentit (et respecte Retry-After) avant la nouvelle tentative
+            if not self.limiter.observe(endpoint, resp.status_code, resp.headers):
+                break
         return resp
 
     # --- API de recherche ---
@@ -75,12 +168,7 @@ class VintedClient:
         """
         Appelle l'API privée Vinted pour récupérer une page JSON d'articles.
         """
-        params = {
-            "search_text": query,
-            "order": "newest_first",
-            "page": page,
-            "per_page": per_page,
-        }
+        params = _items_params(query, page, per_page)
         # référer proche de ce que fait l'app web (utile pour certains contrôles côté serveur)
         r = self.get("/api/v2/catalog/items", params=params,
                      referer=f"{self.base}/catalog?search_text={query}")
@@ -92,15 +180,7 @@ class VintedClient:
         Appelle /api/v2/faceted_categories pour récupérer les sous-catégories
         d'un ou plusieurs catalog_ids (CSV). Ex: "10" ou "10,11".
         """
-        params = {
-            "catalog_ids": catalog_ids,
-            "filter_search_text": search_text,
-            "brand_ids": "",
-            "size_ids": "",
-            "status_ids": "",
-            "color_ids": "",
-            "material_ids": "",
-        }
+        params = _facet_params(catalog_ids, search_text)
 
         print(f"[VINTED] GET {self.base}/api/v2/faceted_categories params={params}")
         try:
@@ -108,42 +188,133 @@ class VintedClient:
                          referer=f"{self.base}/catalog?catalog_ids={catalog_ids}")
             print(f"[VINTED] -> {r.status_code} {len(r.content)} bytes")
             r.raise_for_status()
-            try:
-                js = r.json()
-                if not isinstance(js, dict):
-                    print("[VINTED] WARN: JSON n'est pas un dict, type=", type(js))
-                    return {}
-                return js
-            except Exception as je:
-                print("[VINTED] JSON parse error:", je)
-                print(r.text[:800])
-                return {}
+            return _json_dict(r, {})
         except Exception as e:
             print("[VINTED] REQUEST ERROR:", repr(e))
             return {}
 
     def search_by_params(self, params: dict, referer_query: str = "") -> dict:
-        p = dict(params or {})
-        p.setdefault("order", "newest_first")
-        p.setdefault("page", 1)
-        p.setdefault("per_page", 20)
-        p.setdefault("screen_name", "catalog")
+        p = _catalog_params(params)
         print(f"[VINTED] GET {self.base}/api/v2/catalog/items params={p}")
         try:
             r = self.get("/api/v2/catalog/items", params=p,
                          referer=f"{self.base}/catalog{referer_query}")
             print(f"[VINTED] -> {r.status_code} {len(r.content)} bytes")
             r.raise_for_status()
-            try:
-                js = r.json()
-                if not isinstance(js, dict):
-                    print("[VINTED] WARN: JSON n'est pas un dict, type=", type(js))
-                    return {"items": []}
-                return js
-            except Exception as je:
-                print("[VINTED] JSON parse error:", je)
-                print(r.text[:800])
-                return {"items": []}
+            return _json_dict(r, {"items": []})
+        except Exception as e:
+            print("[VINTED] REQUEST ERROR:", repr(e))
+            return {"items": []}
+
+
+class AsyncVintedClient(VintedClient):
+    """
+    Variante asynchrone (httpx) de VintedClient, mêmes méthodes en `await`.
+
+    - API : connexions keep-alive poolées, même logique CSRF/cookies et mêmes
+      budgets de rate-limit (un RateLimiter peut être partagé avec un client synchrone)
+    - CDN photos : client séparé en HTTP/2 (multiplexage de nombreux téléchargements
+      sur peu de connexions) si le paquet `h2` est installé
+    - fetch_image : corps lu en streaming, interrompu au-delà de `max_bytes`
+    """
+
+    def __init__(self, base="https://www.vinted.fr", min_interval_s: float = 0.8,
+                 limiter: Optional[RateLimiter] = None, max_retries: int = 2,
+                 max_connections: int = 8, image_connections: int = 32,
+                 http2: bool = True, max_image_bytes: int = MAX_IMAGE_BYTES):
+        if not HTTPX_AVAILABLE:
+            raise RuntimeError("httpx requis pour AsyncVintedClient")
+        self.base = base.rstrip("/")
+        self.session = httpx.AsyncClient(
+            headers=BROWSER_HEADERS, timeout=12, follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+        )
+        self.cdn = httpx.AsyncClient(
+            headers={"User-Agent": BROWSER_HEADERS["User-Agent"],
+                     "Referer": f"{self.base}/catalog"},
+            timeout=15, follow_redirects=True, http2=http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=image_connections,
+                                max_keepalive_connections=image_connections),
+        )
+        self.max_image_bytes = max_image_bytes
+        self._init_limits(min_interval_s, limiter, max_retries)
+
+    async def aclose(self):
+        await self.session.aclose()
+        await self.cdn.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def _ensure_csrf(self):
+        """Charge la home pour obtenir les cookies (dont vinted_csrf) puis mémorise le token."""
+        if self._csrf_token:
+            return
+        await self.session.get(self.base + "/")
+        self._remember_csrf(self.session.cookies)
+
+    # --- requêtes ---
+    async def get(self, path: str, params: Optional[Dict[str, Any]] = None,
+                  referer: Optional[str] = None) -> "httpx.Response":
+        url = path if path.startswith("http") else f"{self.base}{path}"
+        endpoint = self.endpoint_class(url)
+        await self._ensure_csrf()
+        headers = self._with_xhr_headers(extra_ref=referer)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.aacquire(endpoint)
+            print(f"[VINTED] GET {url} params={params or {}}")
+            resp = await self.session.get(url, params=params, headers=headers)
+            print(f"[VINTED] -> {resp.status_code} {len(resp.content)} bytes")
+            if not self.limiter.observe(endpoint, resp.status_code, resp.headers):
+                break
+        return resp
+
+    async def fetch_image(self, url: str, max_bytes: Optional[int] = None) -> bytes:
+        """Télécharge une photo du CDN en streaming (budget 'images', taille bornée)"""
+        max_bytes = max_bytes or self.max_image_bytes
+        await self.limiter.aacquire("images")
+        async with self.cdn.stream("GET", url) as resp:
+            self.limiter.observe("images", resp.status_code, resp.headers)
+            resp.raise_for_status()
+            declared = resp.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise ResponseTooLargeError(f"Image trop lourde: {declared} octets (> {max_bytes})")
+            chunks, size = [], 0
+            async for chunk in resp.aiter_bytes():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ResponseTooLargeError(f"Image trop lourde: > {max_bytes} octets")
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    # --- API de recherche ---
+    async def search_items(self, query: str, page: int = 1, per_page: int = 20) -> dict:
+        r = await self.get("/api/v2/catalog/items", params=_items_params(query, page, per_page),
+                           referer=f"{self.base}/catalog?search_text={query}")
+        r.raise_for_status()
+        return r.json()
+
+    async def faceted_categories(self, catalog_ids: str, search_text: str = "") -> dict:
+        try:
+            r = await self.get("/api/v2/faceted_categories",
+                               params=_facet_params(catalog_ids, search_text),
+                               referer=f"{self.base}/catalog?catalog_ids={catalog_ids}")
+            r.raise_for_status()
+            return _json_dict(r, {})
+        except Exception as e:
+            print("[VINTED] REQUEST ERROR:", repr(e))
+            return {}
+
+    async def search_by_params(self, params: dict, referer_query: str = "") -> dict:
+        try:
+            r = await self.get("/api/v2/catalog/items", params=_catalog_params(params),
+                               referer=f"{self.base}/catalog{referer_query}")
+            r.raise_for_status()
+            return _json_dict(r, {"items": []})
         except Exception as e:
             print("[VINTED] REQUEST ERROR:", repr(e))
-            return {"items": []}
\ No newline at end of file
+            return {"items": []}
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
 import numpy as np
 from models.clip_model import CLIPService
 from database.clickhouse_setup import ClickHouseVectorDB
+from database.product_writer import ProductWriter
+import asyncio
 import time
 import io
 from PIL import Image
@@ -11,6 +13,7 @@ from PIL import Image
 app = FastAPI(title="Vinted Lens API", version="2.0.0")
 clip_service = CLIPService()
 vector_db = ClickHouseVectorDB()
+product_writer = ProductWriter(vector_db)
 
 # CORS
 app.add_middleware(
@@ -181,15 +184,30 @@ async def get_database_stats():
         }
 
 @app.post("/api/add-product")
-async def add_product_manually():
-    """Endpoint pour ajouter des produits manuellement (développement)"""
+async def add_product_manually(payload: dict = Body(...)):
+    """
+    Endpoint pour ajouter des produits manuellement (développement).
+    Corps : {"products": [{...métadonnées, "embedding": [512 floats]}]} ou un produit seul ;
+    écriture par lots via product_writer (flush=true pour écrire immédiatement).
+    """
     try:
-        added = vector_db.add_sample_products()
+        products = payload.get("products", [payload])
+        embeddings = np.asarray([p.get("embedding") for p in products], dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != 512:
+            raise HTTPException(status_code=400, detail="Chaque produit doit avoir un embedding de 512 dimensions")
+        # add_many peut déclencher un flush (insert ClickHouse) : hors boucle asyncio
+        ids = await asyncio.to_thread(product_writer.add_many, products, embeddings)
+        if payload.get("flush"):
+            await asyncio.to_thread(product_writer.flush)
         return {
             "success": True,
-            "message": f"{added} produits ajoutés",
+            "message": f"{len(ids)} produits ajoutés",
+            "ids": ids,
+            "writer": product_writer.stats(),
             "timestamp": time.time()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         return {
             "success": False,
@@ -197,6 +215,10 @@ async def add_product_manually():
             "timestamp": time.time()
         }
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await asyncio.to_thread(product_writer.close)
+
 if __name__ == "__main__":
     import uvicorn
     print("🔥 Lancement Vinted Lens API avec ClickHouse...")
@@ -1,20 +1,37 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
-import torch
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
 import numpy as np
-import io
+import os
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 # Imports locaux
 try:
-    from database.clickhouse_setup import ClickHouseVectorDB
+    from database.clickhouse_setup import SEARCH_MODES, EMBEDDING_DIM
+    from database.async_clickhouse import AsyncClickHouseVectorDB
+    from database.filter_planner import SearchFilters
     CLICKHOUSE_AVAILABLE = True
 except ImportError:
     CLICKHOUSE_AVAILABLE = False
+    SEARCH_MODES = ()
     print("ClickHouse non disponible")
 
+try:
+    from database.hnsw_index import HNSWIndex, HNSWLIB_AVAILABLE
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+from database.embedding_store import MmapEmbeddingStore
+from models.clip_model import VintedLensCLIP
+from models.backends import configure_cpu_threads
+from models.preprocessing import decode_image, ImageTooLargeError
+from services.batching import MicroBatcher
+from services.fanout import FanOut
+from services.cache import AsyncTTLCache
+from services.query_cache import QueryImageCache, QueryEntry, content_hash, dhash
+
 try:
     import vinted
     VINTED_AVAILABLE = True
@@ -23,34 +40,62 @@ except ImportError:
     VINTED_AVAILABLE = False
     print("Module vinted non disponible")
 
-# Configuration CLIP
+# Configuration CLIP (vision seule ; CLIP_LOCAL_SNAPSHOT = snapshot safetensors local)
 MODEL_NAME = "openai/clip-vit-base-patch32"
+CLIP_LOCAL_SNAPSHOT = os.environ.get("CLIP_LOCAL_SNAPSHOT")
 
-class CLIPService:
-    def __init__(self):
-        print("Chargement du modèle CLIP...")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = CLIPModel.from_pretrained(MODEL_NAME)
-        self.processor = CLIPProcessor.from_pretrained(MODEL_NAME)
-        self.model.to(self.device)
-        print(f"Modèle CLIP chargé sur {self.device}")
-    
-    def encode_image(self, image):
-        try:
-            inputs = self.processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-            return image_features.cpu().numpy().flatten()
-        except Exception as e:
-            print(f"Erreur encoding image: {e}")
-            return np.random.rand(512).astype(np.float32)
+# Configuration index vectoriel en mémoire ("none" = scan exact ClickHouse, "hnsw", "mmap")
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "none")
+EMBEDDING_STORE_PATH = os.environ.get("EMBEDDING_STORE_PATH", "embedding_store")
+HNSW_INDEX_PATH = os.environ.get("HNSW_INDEX_PATH", "hnsw_index.bin")
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "64"))
+INDEX_REFRESH_S = float(os.environ.get("INDEX_REFRESH_S", "300"))
+IVF_RELOAD_S = float(os.environ.get("IVF_RELOAD_S", "60"))
+
+# Micro-batching de l'encodage CLIP (fenêtre courte = p99 bas, longue = débit)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "8"))
+
+# Concurrence : CPU_WORKERS inférences/décodages simultanés par worker uvicorn,
+# chacune avec TORCH_THREADS threads -> WEB_CONCURRENCY x CPU_WORKERS x TORCH_THREADS <= cœurs
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", "2"))
+IO_WORKERS = int(os.environ.get("IO_WORKERS", "8"))
+TORCH_THREADS = int(os.environ.get(
+    "TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // (WEB_CONCURRENCY * CPU_WORKERS)))
+))
+
+# Budget de la phase de recherche (toutes sources en parallèle), hedging optionnel au p95
+SEARCH_BUDGET_MS = float(os.environ.get("SEARCH_BUDGET_MS", "300"))
+SEARCH_HEDGE = os.environ.get("SEARCH_HEDGE", "0") == "1"
+
+# Cache des recherches Vinted (requête + limite -> articles formatés)
+VINTED_CACHE_SIZE = int(os.environ.get("VINTED_CACHE_SIZE", "256"))
+VINTED_CACHE_TTL_S = float(os.environ.get("VINTED_CACHE_TTL_S", "120"))
+VINTED_CACHE_STALE_S = float(os.environ.get("VINTED_CACHE_STALE_S", "600"))
+
+# Cache des images de requête (ré-uploads) ; le TTL borne aussi la fraîcheur sans index
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL_S = float(os.environ.get("QUERY_CACHE_TTL_S", "300"))
+QUERY_CACHE_MAX_DISTANCE = int(os.environ.get("QUERY_CACHE_MAX_DISTANCE", "4"))
+
+# Recherches multi-requêtes : endpoints batch, et coalescence des recherches simples
+# concurrentes en un scan partagé dès SEARCH_COALESCE_MIN recherches en vol (0 = jamais)
+SEARCH_COALESCE_MIN = int(os.environ.get("SEARCH_COALESCE_MIN", "4"))
+SEARCH_BATCH_MAX_SIZE = int(os.environ.get("SEARCH_BATCH_MAX_SIZE", "32"))
+SEARCH_BATCH_MAX_WAIT_MS = float(os.environ.get("SEARCH_BATCH_MAX_WAIT_MS", "5"))
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "10000"))
+SEARCH_BATCH_MAX_IMAGES = int(os.environ.get("SEARCH_BATCH_MAX_IMAGES", "64"))
+SEARCH_BATCH_MAX_LIMIT = 100
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
 
 class VintedService:
     def __init__(self):
+        self.cache = AsyncTTLCache(maxsize=VINTED_CACHE_SIZE, ttl_s=VINTED_CACHE_TTL_S,
+                                   stale_s=VINTED_CACHE_STALE_S, name="vinted_search")
         if VINTED_AVAILABLE:
             try:
                 # Initialisation avec le module vinted correct
@@ -125,6 +170,19 @@ class VintedService:
             traceback.print_exc()
             return None
     
+    async def search_products_async(self, query: str, limit: int = 10, hedge: bool = False):
+        """
+        Variante awaitable et mise en cache (TTL + stale-while-revalidate) :
+        le module vinted est synchrone, l'appel part dans io_executor.
+        hedge : appel doublé par FanOut, envoyé à Vinted sans passer par le cache
+        """
+        loop = asyncio.get_running_loop()
+        return await self.cache.get_or_load(
+            (query, limit),
+            lambda: loop.run_in_executor(io_executor, self.search_products, query, limit),
+            bypass=hedge,
+        )
+    
     def _safe_get(self, item, key, default=""):
         """Extraction sécurisée de valeur"""
         try:
@@ -204,6 +262,13 @@ app = FastAPI(title="Vinted Lens API", version="3.0.0")
 clip_service = None
 vector_db = None
 vinted_service = None
+vector_index = None
+image_batcher = None
+search_batcher = None
+searches_inflight = 0
+search_fanout = FanOut(budget_ms=SEARCH_BUDGET_MS, hedge=SEARCH_HEDGE)
+query_cache = QueryImageCache(maxsize=QUERY_CACHE_SIZE, ttl_s=QUERY_CACHE_TTL_S,
+                              max_distance=QUERY_CACHE_MAX_DISTANCE)
 
 # CORS
 app.add_middleware(
@@ -214,28 +279,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def init_vector_index(db):
+    """Construit (ou recharge) l'index vectoriel configuré et le branche sur la base"""
+    if VECTOR_INDEX == "hnsw":
+        if not HNSWLIB_AVAILABLE:
+            print("VECTOR_INDEX=hnsw mais hnswlib absent - scan exact conservé")
+            return None
+        index = HNSWIndex(M=HNSW_M, ef_search=HNSW_EF_SEARCH)
+        if index.load(HNSW_INDEX_PATH):
+            index.update(db)
+        else:
+            index.build(db)
+        index.save(HNSW_INDEX_PATH)
+    elif VECTOR_INDEX == "mmap":
+        # Lecture seule : le store est alimenté par `python -m database.embedding_store`
+        # et partagé entre workers via le page cache
+        if not MmapEmbeddingStore.exists(EMBEDDING_STORE_PATH):
+            print(f"Store mmap absent ({EMBEDDING_STORE_PATH}) - scan exact conservé")
+            return None
+        index = MmapEmbeddingStore(EMBEDDING_STORE_PATH)
+        print(f"Store mmap: {len(index)} vecteurs ({index.dtype.name})")
+    else:
+        return None
+
+    db.attach_index(index)
+    return index
+
+def search_batch(items):
+    """
+    Recherches simples coalescées : items = [(embedding, limit, mode)], un
+    search_similar_many par mode (à la plus grande limite, tronquée ensuite)
+    """
+    results = [None] * len(items)
+    groups = {}
+    for i, (_, _, mode) in enumerate(items):
+        groups.setdefault(mode, []).append(i)
+    for mode, rows in groups.items():
+        limit = max(items[i][1] for i in rows)
+        found = vector_db.search_similar_many(np.stack([items[i][0] for i in rows]), limit, mode)
+        for i, products in zip(rows, found):
+            results[i] = products[:items[i][1]]
+    return results
+
 def init_services():
-    global clip_service, vector_db, vinted_service
+    global clip_service, vector_db, vinted_service, vector_index, image_batcher, search_batcher
     
     print("Initialisation des services...")
     
-    # CLIP
+    # CLIP : aucun poids chargé ici, voir warmup_clip()
     try:
-        clip_service = CLIPService()
-        print("CLIP Service initialisé")
+        configure_cpu_threads(TORCH_THREADS)
+        clip_service = VintedLensCLIP(MODEL_NAME, local_path=CLIP_LOCAL_SNAPSHOT)
+        image_batcher = MicroBatcher(clip_service.encode_images, max_batch_size=BATCH_MAX_SIZE,
+                                     max_wait_ms=BATCH_MAX_WAIT_MS, executor=cpu_executor,
+                                     name="clip_image")
+        print("CLIP Service initialisé (chargement différé)")
     except Exception as e:
         print(f"Erreur CLIP: {e}")
     
     # ClickHouse
     if CLICKHOUSE_AVAILABLE:
         try:
-            vector_db = ClickHouseVectorDB()
+            vector_db = AsyncClickHouseVectorDB(executor=cpu_executor)
             stats = vector_db.get_stats()
             print(f"ClickHouse connecté - {stats['total_products']} produits")
             
             if stats['total_products'] == 0:
                 print("Ajout de produits d'exemple...")
                 vector_db.add_sample_products()
+
+            vector_index = init_vector_index(vector_db)
+            if vector_db.ivf_nprobe > 0 and vector_db.refresh_ivf(force=True) is None:
+                print("IVF_NPROBE défini mais aucun codebook (python -m database.ivf train) : scan complet")
+            if SEARCH_COALESCE_MIN > 0:
+                search_batcher = MicroBatcher(search_batch, max_batch_size=SEARCH_BATCH_MAX_SIZE,
+                                              max_wait_ms=SEARCH_BATCH_MAX_WAIT_MS, executor=io_executor,
+                                              name="clickhouse_search")
                 
         except Exception as e:
             print(f"ClickHouse indisponible: {e}")
@@ -245,26 +364,77 @@ def init_services():
     if VINTED_AVAILABLE:
         try:
             vinted_service = VintedService()
+            # le hedging se cale sur les appels Vinted réels, pas sur les hits du cache
+            search_fanout.attach("vinted", vinted_service.cache.load_latency)
             print(f"Service Vinted - Disponible: {vinted_service.available}")
         except Exception as e:
             print(f"Erreur service Vinted: {e}")
             vinted_service = None
 
-# Initialisation
-init_services()
+async def warmup_clip():
+    """Charge la tour vision et exécute un premier forward hors de la boucle asyncio"""
+    if clip_service is None:
+        return
+    try:
+        ready = await asyncio.get_running_loop().run_in_executor(cpu_executor, clip_service.warmup)
+        print(f"CLIP prêt: {ready}")
+    except Exception as e:
+        print(f"Erreur warm-up CLIP: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    """Initialisation au démarrage du worker (et non à l'import du module)"""
+    init_services()
+    asyncio.create_task(warmup_clip())
+    if vector_index is not None:
+        asyncio.create_task(index_refresh_loop())
+    if vector_db is not None and vector_db.ivf_nprobe > 0:
+        asyncio.create_task(ivf_refresh_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if vector_db is not None:
+        await vector_db.aclose()
+    cpu_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+
+async def ivf_refresh_loop():
+    """Recharge le codebook IVF après un ré-entraînement (python -m database.ivf watch)"""
+    while True:
+        await asyncio.sleep(IVF_RELOAD_S)
+        try:
+            before = vector_db.ivf.version if vector_db.ivf else None
+            book = await asyncio.to_thread(vector_db.refresh_ivf, True)
+            if book is not None and book.version != before:
+                query_cache.bump_generation()
+        except Exception as e:
+            print(f"Erreur rafraîchissement IVF: {e}")
+
+async def index_refresh_loop():
+    """Ajoute périodiquement les nouveaux produits à l'index (sans reconstruction)"""
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_S)
+        try:
+            added = await asyncio.to_thread(vector_index.update, vector_db)
+            if added:
+                query_cache.bump_generation()
+        except Exception as e:
+            print(f"Erreur rafraîchissement index: {e}")
 
 @app.get("/health")
 async def health_check():
     try:
-        db_stats = vector_db.get_stats() if vector_db else {"total_products": 0}
+        db_stats = await vector_db.aget_stats() if vector_db else {"total_products": 0}
         vinted_status = vinted_service.available if vinted_service else False
         
         return {
             "status": "healthy",
             "services": {
-                "clip_loaded": clip_service is not None,
+                "clip_loaded": clip_service is not None and clip_service.is_loaded,
+                "clip_ready": clip_service is not None and clip_service.is_ready,
                 "database_connected": vector_db is not None,
                 "vinted_available": vinted_status,
+                "vector_index": VECTOR_INDEX if vector_index is not None else "none",
             },
             "data": {
                 "products_count": db_stats.get('total_products', 0),
@@ -280,24 +450,101 @@ async def health_check():
             "timestamp": time.time()
         }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness : 200 seulement une fois la tour vision chargée et chauffée"""
+    if clip_service is None or not clip_service.is_ready:
+        raise HTTPException(status_code=503, detail="Modèle CLIP en cours de chargement")
+    return {"status": "ready", "model": clip_service.get_model_info(), "timestamp": time.time()}
+
+async def embed_query(image_bytes: bytes, digest: str) -> QueryEntry:
+    """Décodage réduit (~224px, EXIF, limite de pixels) puis CLIP, sauf image quasi identique en cache"""
+    loop = asyncio.get_running_loop()
+    image = await loop.run_in_executor(cpu_executor, decode_image, image_bytes)
+    phash = dhash(image)
+    entry = query_cache.lookup_perceptual(digest, phash)
+    if entry is None:
+        entry = query_cache.put(digest, phash, await image_batcher.submit(image))
+    return entry
+
+async def local_search(entry: QueryEntry, limit: int, mode: str, filters=None, report=None):
+    """
+    Recherche ClickHouse, ou réhydratation du classement mis en cache si l'index n'a pas bougé.
+    Avec des filtres, le plan exécuté (prefilter / postfilter) est écrit dans report["filter_plan"].
+    """
+    key = f"{mode}?{filters.key()}" if filters else mode
+    ranked = query_cache.ranked(entry, limit, key)
+    if ranked is not None:
+        if filters and report is not None:
+            report["filter_plan"] = {"strategy": "cached"}
+        return await vector_db.awith_metadata(*ranked)
+    global searches_inflight
+    generation = query_cache.generation
+    searches_inflight += 1
+    try:
+        if filters:
+            results, plan = await vector_db.asearch_filtered(entry.embedding, limit, filters, mode)
+            if report is not None:
+                report["filter_plan"] = plan.describe()
+        elif (search_batcher is not None and searches_inflight >= SEARCH_COALESCE_MIN
+              and vector_db.batchable(mode)):
+            # charge élevée : regroupée avec les recherches concurrentes en un scan partagé
+            results = await search_batcher.submit((entry.embedding, limit, mode))
+        else:
+            results = await vector_db.asearch_similar(entry.embedding, limit=limit, mode=mode)
+    finally:
+        searches_inflight -= 1
+    query_cache.set_ranked(entry, limit, generation,
+                           [p['id'] for p in results], [p['similarity'] for p in results], key)
+    return results
+
 @app.post("/api/search-similar")
-async def search_similar_products(file: UploadFile = File(...)):
+async def search_similar_products(file: UploadFile = File(...), mode: Optional[str] = Query(None),
+                                  platform: Optional[str] = Query(None),
+                                  category: Optional[str] = Query(None),
+                                  brand: Optional[str] = Query(None),
+                                  size: Optional[str] = Query(None),
+                                  price_min: Optional[float] = Query(None, ge=0),
+                                  price_max: Optional[float] = Query(None, ge=0)):
+    """
+    mode : exact (scan Float32), binary (préfiltre Hamming + re-rank) ou ann
+    (index / IVF / compact selon la configuration) ; défaut SEARCH_MODE.
+    platform / category / brand / size / price_min / price_max : filtres, planifiés
+    en prefilter ou postfilter selon leur sélectivité (performance.filter_plan)
+    """
     start_time = time.time()
     
     if not clip_service:
         raise HTTPException(status_code=503, detail="Service CLIP non disponible")
+    if not clip_service.is_ready:
+        raise HTTPException(status_code=503, detail="Modèle CLIP en cours de chargement")
     
     try:
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="Le fichier doit être une image")
+        if mode is not None and mode not in SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"mode inconnu: {mode} ({', '.join(SEARCH_MODES)})")
+        search_mode = mode or (vector_db.search_mode if vector_db else "ann")
+        if price_min is not None and price_max is not None and price_min > price_max:
+            raise HTTPException(status_code=400, detail="price_min > price_max")
+        filters = None
+        if CLICKHOUSE_AVAILABLE:
+            filters = SearchFilters(platform=platform, category=category, brand=brand, size=size,
+                                    price_min=price_min, price_max=price_max) or None
         
-        # Traitement image
+        # Embedding : cache (hash exact / perceptuel) sinon décodage réduit + CLIP,
+        # un seul calcul pour des uploads identiques simultanés
         image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        
-        # Embedding
         embedding_start = time.time()
-        embedding = clip_service.encode_image(image)
+        digest = content_hash(image_bytes)
+        query_entry = query_cache.lookup_exact(digest)
+        cache_status = "exact"
+        if query_entry is None:
+            cache_status = "miss"
+            try:
+                query_entry = await query_cache.coalesce(digest, lambda: embed_query(image_bytes, digest))
+            except ImageTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
         embedding_time = time.time() - embedding_start
         
         # Recherche hybride : ClickHouse + Vinted AUTHENTIQUE
@@ -305,36 +552,47 @@ async def search_similar_products(file: UploadFile = File(...)):
         all_results = []
         sources_used = []
         
-        # 1. Recherche ClickHouse (base locale)
+        # Les sources partent en parallèle sous un budget commun (SEARCH_BUDGET_MS) :
+        # une source en retard est coupée plutôt que d'allonger la réponse
+        sources = {}
+        report = {}
         if vector_db and CLICKHOUSE_AVAILABLE:
-            try:
-                local_results = vector_db.search_similar(embedding, limit=8)
-                all_results.extend(local_results)
-                sources_used.append(f"clickhouse:{len(local_results)}")
-                print(f"ClickHouse: {len(local_results)} résultats")
-            except Exception as e:
-                print(f"Erreur ClickHouse: {e}")
-        
-        # 2. Recherche Vinted AUTHENTIQUE uniquement
+            sources["clickhouse"] = lambda: local_search(query_entry, limit=8, mode=search_mode,
+                                                         filters=filters, report=report)
         if vinted_service and vinted_service.available:
-            try:
-                vinted_query = "vêtement mode"
-                vinted_results = vinted_service.search_products(vinted_query, limit=6)
-                
-                if vinted_results is not None and len(vinted_results) > 0:
-                    all_results.extend(vinted_results)
-                    sources_used.append(f"vinted:{len(vinted_results)}")
-                    print(f"Vinted: {len(vinted_results)} produits authentiques")
-                else:
-                    print("Vinted: Aucun résultat authentique")
-                    sources_used.append("vinted:0")
-                    
-            except Exception as e:
-                print(f"Erreur Vinted: {e}")
-                sources_used.append("vinted:error")
+            vinted_query = "vêtement mode"
+            sources["vinted"] = lambda hedge=False: vinted_service.search_products_async(
+                vinted_query, limit=6, hedge=hedge)
         else:
             sources_used.append("vinted:unavailable")
         
+        outcomes = await search_fanout.run(sources, hedgeable=("vinted",))
+        sources_cut = []
+        source_times = {}
+        
+        for name in ("clickhouse", "vinted"):
+            outcome = outcomes.get(name)
+            if outcome is None:
+                continue
+            source_times[name] = round(outcome.elapsed, 3)
+            if outcome.status == "timeout":
+                print(f"{name}: coupé après {SEARCH_BUDGET_MS:.0f}ms")
+                sources_cut.append(name)
+                sources_used.append(f"{name}:timeout")
+            elif outcome.status == "error":
+                print(f"Erreur {name}: {outcome.error}")
+                sources_used.append(f"{name}:error")
+            elif outcome.value:
+                items = outcome.value
+                if filters and name == "vinted":
+                    # ClickHouse filtre côté serveur ; Vinted est filtré ici
+                    items = [item for item in items if filters.matches(item)]
+                all_results.extend(items)
+                sources_used.append(f"{name}:{len(items)}" + (" (hedged)" if outcome.hedged else ""))
+                print(f"{name}: {len(items)} résultats")
+            else:
+                sources_used.append(f"{name}:0")
+        
         search_time = time.time() - search_start
         total_time = time.time() - start_time
         
@@ -348,7 +606,13 @@ async def search_similar_products(file: UploadFile = File(...)):
                     "total_time": round(total_time, 3),
                     "embedding_time": round(embedding_time, 3),
                     "search_time": round(search_time, 3),
+                    "search_budget_ms": SEARCH_BUDGET_MS,
+                    "source_times": source_times,
+                    "sources_cut": sources_cut,
                     "sources_attempted": sources_used,
+                    "query_cache": cache_status,
+                    "search_mode": search_mode,
+                    "filter_plan": report.get("filter_plan"),
                     "results_count": 0
                 }
             }
@@ -363,7 +627,13 @@ async def search_similar_products(file: UploadFile = File(...)):
                 "total_time": round(total_time, 3),
                 "embedding_time": round(embedding_time, 3),
                 "search_time": round(search_time, 3),
+                "search_budget_ms": SEARCH_BUDGET_MS,
+                "source_times": source_times,
+                "sources_cut": sources_cut,
                 "sources_used": sources_used,
+                "query_cache": cache_status,
+                "search_mode": search_mode,
+                "filter_plan": report.get("filter_plan"),
                 "results_count": len(final_results)
             },
             "metadata": {
@@ -375,6 +645,8 @@ async def search_similar_products(file: UploadFile = File(...)):
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         return {
             "success": False,
@@ -386,6 +658,130 @@ async def search_similar_products(file: UploadFile = File(...)):
             }
         }
 
+def parse_search_mode(mode: Optional[str]) -> str:
+    if mode is not None and mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode inconnu: {mode} ({', '.join(SEARCH_MODES)})")
+    return mode or vector_db.search_mode
+
+def parse_batch_limit(limit) -> int:
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limit doit être un entier")
+    if not 1 <= limit <= SEARCH_BATCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit entre 1 et {SEARCH_BATCH_MAX_LIMIT}")
+    return limit
+
+def batch_search_error(error: Exception, start_time: float, queries: int, search_mode: str) -> dict:
+    """Échec ClickHouse d'une recherche multi-requêtes : erreur explicite, pas de listes vides"""
+    print(f"Erreur recherche multi-requêtes: {error}")
+    return {
+        "success": False,
+        "error": str(error),
+        "results": [],
+        "performance": {
+            "total_time": round(time.time() - start_time, 3),
+            "queries": queries,
+            "search_mode": search_mode,
+            "error": True
+        }
+    }
+
+@app.post("/api/search-batch")
+async def search_batch_embeddings(payload: dict = Body(...)):
+    """
+    Recherche multi-requêtes sur des embeddings déjà calculés (jobs de recommandation, QA).
+
+    Body JSON :
+        {"embeddings": [[512 floats], ...], "limit": 10, "mode": null,
+         "filters": {"platform": ..., "category": ..., "brand": ..., "size": ...,
+                     "price_min": ..., "price_max": ...}}
+
+    Returns:
+        results[i] = top-k de embeddings[i], calculés en scans partagés (search_similar_many)
+    """
+    if not vector_db:
+        raise HTTPException(status_code=503, detail="ClickHouse non disponible")
+    start_time = time.time()
+    search_mode = parse_search_mode(payload.get("mode"))
+    limit = parse_batch_limit(payload.get("limit", 10))
+    try:
+        embeddings = np.asarray(payload.get("embeddings") or [], dtype=np.float32)
+        filters = SearchFilters(**(payload.get("filters") or {}))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Requête invalide: {e}")
+    if embeddings.ndim != 2 or not len(embeddings) or embeddings.shape[1] != EMBEDDING_DIM:
+        raise HTTPException(status_code=400,
+                            detail=f"embeddings : matrice (N, {EMBEDDING_DIM}) non vide attendue")
+    if not np.isfinite(embeddings).all():
+        raise HTTPException(status_code=400, detail="embeddings : valeurs non finies")
+    if len(embeddings) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"{len(embeddings)} requêtes > {SEARCH_BATCH_MAX_QUERIES}")
+
+    try:
+        results = await vector_db.asearch_similar_many(embeddings, limit, mode=search_mode,
+                                                       filters=filters or None)
+    except Exception as e:
+        return batch_search_error(e, start_time, len(embeddings), search_mode)
+    return {
+        "success": True,
+        "results": results,
+        "performance": {
+            "total_time": round(time.time() - start_time, 3),
+            "queries": len(embeddings),
+            "search_mode": search_mode,
+            "shared_scan": vector_db.batchable(search_mode),
+        }
+    }
+
+@app.post("/api/search-similar-batch")
+async def search_similar_batch(files: List[UploadFile] = File(...), mode: Optional[str] = Query(None),
+                               limit: int = Query(10, ge=1, le=SEARCH_BATCH_MAX_LIMIT)):
+    """
+    Plusieurs images en une requête : encodages CLIP regroupés par le micro-batcher,
+    puis une seule recherche multi-requêtes (ClickHouse uniquement, pas de source Vinted)
+    """
+    if not clip_service or not clip_service.is_ready:
+        raise HTTPException(status_code=503, detail="Modèle CLIP en cours de chargement")
+    if not vector_db:
+        raise HTTPException(status_code=503, detail="ClickHouse non disponible")
+    if len(files) > SEARCH_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"{len(files)} images > {SEARCH_BATCH_MAX_IMAGES}")
+    search_mode = parse_search_mode(mode)
+    start_time = time.time()
+
+    async def embed(file: UploadFile) -> QueryEntry:
+        if not (file.content_type or "").startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"{file.filename} : le fichier doit être une image")
+        image_bytes = await file.read()
+        digest = content_hash(image_bytes)
+        entry = query_cache.lookup_exact(digest)
+        if entry is None:
+            try:
+                entry = await query_cache.coalesce(digest, lambda: embed_query(image_bytes, digest))
+            except ImageTooLargeError as e:
+                raise HTTPException(status_code=413, detail=f"{file.filename} : {e}")
+        return entry
+
+    entries = await asyncio.gather(*(embed(f) for f in files))
+    embedding_time = time.time() - start_time
+    try:
+        results = await vector_db.asearch_similar_many(np.stack([e.embedding for e in entries]),
+                                                       limit, mode=search_mode)
+    except Exception as e:
+        return batch_search_error(e, start_time, len(entries), search_mode)
+    return {
+        "success": True,
+        "results": results,
+        "performance": {
+            "total_time": round(time.time() - start_time, 3),
+            "embedding_time": round(embedding_time, 3),
+            "queries": len(entries),
+            "search_mode": search_mode,
+            "shared_scan": vector_db.batchable(search_mode),
+        }
+    }
+
 @app.get("/api/test-vinted")
 async def test_vinted():
     """Test de l'API Vinted authentique"""
@@ -404,7 +800,7 @@ async def test_vinted():
         }
     
     try:
-        results = vinted_service.search_products("t-shirt", limit=3)
+        results = await vinted_service.search_products_async("t-shirt", limit=3)
         
         if results is None:
             return {
@@ -426,6 +822,25 @@ async def test_vinted():
             "module_available": VINTED_AVAILABLE
         }
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Métriques internes (micro-batching CLIP...)"""
+    return {
+        "clip_batching": image_batcher.stats() if image_batcher else None,
+        "search_batching": search_batcher.stats() if search_batcher else None,
+        "search_fanout": search_fanout.stats(),
+        "vinted_cache": vinted_service.cache.stats() if vinted_service else None,
+        "query_cache": query_cache.stats(),
+        "embedding_storage": {
+            "layout": vector_db.embedding_layout, "rerank": vector_db.rerank,
+            "ivf_nprobe": vector_db.ivf_nprobe,
+            "ivf_version": vector_db.ivf.version if vector_db.ivf else None,
+            "ivf_nlist": vector_db.ivf.nlist if vector_db.ivf else None,
+        } if vector_db else None,
+        "filter_planner": vector_db.planner.stats() if vector_db else None,
+        "timestamp": time.time()
+    }
+
 @app.get("/api/stats")
 async def get_stats():
     """Statistiques des sources de données"""
@@ -434,7 +849,7 @@ async def get_stats():
     # Stats ClickHouse
     if vector_db:
         try:
-            db_stats = vector_db.get_stats()
+            db_stats = await asyncio.to_thread(vector_db.get_stats)
             stats["clickhouse"] = {
                 "available": True,
                 "products": db_stats.get('total_products', 0),
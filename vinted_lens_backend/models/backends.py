@@ -0,0 +1,209 @@
+# models/backends.py
+# Backends d'inférence CPU pour la tour vision de CLIP (fp32, int8 dynamique, ONNX Runtime)
+
+import os
+import copy
+import time
+import logging
+import numpy as np
+import torch
+from torch import nn
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+
+def configure_cpu_threads(num_threads: int):
+    """
+    Threads intra-op par inférence. À dimensionner avec le nombre d'inférences
+    concurrentes (executor) et de workers uvicorn pour ne pas sursouscrire les cœurs.
+    """
+    num_threads = max(1, int(num_threads))
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # déjà fixé (ne peut être modifié qu'avant le premier travail parallèle)
+        pass
+    logger.info(f"🧵 torch: {num_threads} thread(s) intra-op")
+
+
+class VisionTower(nn.Module):
+    """Tour vision + projection de CLIP : pixel_values -> image features (non normalisées)"""
+
+    def __init__(self, vision_model: nn.Module, visual_projection: nn.Module):
+        super().__init__()
+        self.vision_model = vision_model
+        self.visual_projection = visual_projection
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        pooled = self.vision_model(pixel_values=pixel_values).pooler_output
+        return self.visual_projection(pooled)
+
+    @classmethod
+    def from_clip(cls, model: nn.Module) -> "VisionTower":
+        return cls(model.vision_model, model.visual_projection).eval()
+
+
+class InferenceBackend:
+    """Interface commune : encode(pixel_values (N, 3, 224, 224)) -> np.ndarray (N, 512)"""
+
+    name = "base"
+
+    def encode(self, pixel_values) -> np.ndarray:
+        raise NotImplementedError
+
+    def info(self) -> Dict:
+        return {"backend": self.name}
+
+
+class TorchBackend(InferenceBackend):
+    """PyTorch fp32 (référence)"""
+
+    name = "torch"
+
+    def __init__(self, tower: VisionTower, device: str = "cpu"):
+        self.device = device
+        self.tower = tower.to(device).eval()
+
+    def encode(self, pixel_values) -> np.ndarray:
+        pixel_values = torch.as_tensor(pixel_values).to(self.device)
+        with torch.no_grad():
+            return self.tower(pixel_values).cpu().numpy()
+
+
+class TorchInt8Backend(TorchBackend):
+    """PyTorch avec quantification dynamique int8 des couches Linear (CPU uniquement)"""
+
+    name = "torch_int8"
+
+    def __init__(self, tower: VisionTower, device: str = "cpu"):
+        # copie : la tour fp32 reste intacte (référence de parité, encode_text...)
+        quantized = torch.quantization.quantize_dynamic(
+            copy.deepcopy(tower).cpu().eval(), {nn.Linear}, dtype=torch.qint8
+        )
+        super().__init__(quantized, device="cpu")
+
+
+class OnnxBackend(InferenceBackend):
+    """Graphe ONNX de la tour vision exécuté par ONNX Runtime (exporté au premier chargement)"""
+
+    name = "onnx"
+
+    def __init__(self, tower: VisionTower, onnx_path: str, num_threads: int = 0):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime requis pour le backend onnx")
+
+        if not os.path.exists(onnx_path):
+            self.export(tower, onnx_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # même budget de threads que torch (voir configure_cpu_threads)
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def export(tower: VisionTower, onnx_path: str, opset: int = 17):
+        start_time = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+        dummy = torch.zeros(1, 3, 224, 224)
+        torch.onnx.export(
+            copy.deepcopy(tower).cpu().eval(), (dummy,), onnx_path,
+            input_names=["pixel_values"], output_names=["image_features"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_features": {0: "batch"}},
+            opset_version=opset,
+        )
+        logger.info(f"📦 Tour vision exportée en ONNX ({onnx_path}) en {time.time() - start_time:.1f}s")
+
+    def encode(self, pixel_values) -> np.ndarray:
+        if isinstance(pixel_values, torch.Tensor):
+            pixel_values = pixel_values.cpu().numpy()
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        return self.session.run(None, {self.input_name: pixel_values})[0]
+
+    def info(self) -> Dict:
+        return {"backend": self.name, "onnx_path": self.onnx_path}
+
+
+BACKENDS = ("torch", "torch_int8", "onnx")
+
+
+def create_backend(name: str, tower: VisionTower, device: str = "cpu",
+                   onnx_path: Optional[str] = None) -> InferenceBackend:
+    """Instancie le backend demandé à partir de la tour vision fp32"""
+    if name == "torch":
+        return TorchBackend(tower, device=device)
+    if name == "torch_int8":
+        return TorchInt8Backend(tower)
+    if name == "onnx":
+        return OnnxBackend(tower, onnx_path or "clip_vision.onnx")
+    raise ValueError(f"Backend inconnu: {name} (disponibles: {', '.join(BACKENDS)})")
+
+
+# ---------- Parité avec fp32 ----------
+def parity_images(n: int = 16, size: int = 256, seed: int = 0) -> List:
+    """
+    Jeu d'images fixe et reproductible (dégradés, aplats, bandes, bruit) :
+    aucune dépendance réseau ni fichier, identique sur toutes les machines.
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    images = []
+    for i in range(n):
+        kind = i % 4
+        color = rng.uniform(0, 255, 3)
+        if kind == 0:      # dégradé
+            arr = np.stack([xx * color[0], yy * color[1], (1 - xx) * color[2]], axis=-1)
+        elif kind == 1:    # aplat + rectangle
+            arr = np.ones((size, size, 3)) * color
+            x0, y0 = rng.integers(0, size // 2, 2)
+            arr[y0:y0 + size // 3, x0:x0 + size // 3] = 255 - color
+        elif kind == 2:    # bandes
+            freq = rng.integers(2, 12)
+            arr = (np.sin(xx[..., None] * freq * np.pi * 2) * 0.5 + 0.5) * color
+        else:              # bruit coloré
+            arr = rng.uniform(0, 1, (size, size, 3)) * color
+        images.append(Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), "RGB"))
+    return images
+
+
+def check_parity(reference: InferenceBackend, candidate: InferenceBackend,
+                 pixel_values, threshold: float = 0.99) -> Dict:
+    """
+    Compare les embeddings normalisés d'un backend à la référence fp32.
+
+    Returns:
+        dict: cosinus min/moyen par image, accord du plus proche voisin, passed
+    """
+    ref = reference.encode(pixel_values)
+    cand = candidate.encode(pixel_values)
+    ref = ref / np.linalg.norm(ref, axis=1, keepdims=True)
+    cand = cand / np.linalg.norm(cand, axis=1, keepdims=True)
+
+    cosines = np.sum(ref * cand, axis=1)
+    # même voisin le plus proche dans le jeu (hors soi-même) ?
+    ref_sim, cand_sim = ref @ ref.T, cand @ cand.T
+    np.fill_diagonal(ref_sim, -np.inf)
+    np.fill_diagonal(cand_sim, -np.inf)
+    nn_agreement = float(np.mean(ref_sim.argmax(axis=1) == cand_sim.argmax(axis=1)))
+
+    return {
+        "backend": candidate.name,
+        "images": int(len(cosines)),
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "nn_agreement": round(nn_agreement, 3),
+        "threshold": threshold,
+        "passed": bool(cosines.min() >= threshold),
+    }
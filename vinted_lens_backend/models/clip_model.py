@@ -2,14 +2,20 @@
 # Service CLIP principal pour Vinted Lens
 
 import torch
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPTokenizer, CLIPVisionModelWithProjection, CLIPTextModelWithProjection
 import numpy as np
 from PIL import Image
 import io
+import os
 import time
-from typing import Union, List, Optional
+import threading
+from typing import Union, List, Optional, Dict
 import logging
 
+from utils.vector_ops import l2_normalize
+from models.preprocessing import preprocess_batch, PREPROCESS_VERSION
+from models.backends import VisionTower, TorchBackend, create_backend, parity_images, check_parity, BACKENDS
+
 # Configuration logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,42 +26,147 @@ class VintedLensCLIP:
     Gère l'encoding d'images en embeddings vectoriels
     """
     
-    def __init__(self, model_name: str = "openai/clip-vit-base-patch32"):
+    def __init__(self, model_name: str = "openai/clip-vit-base-patch32",
+                 backend: Optional[str] = None, onnx_path: Optional[str] = None,
+                 parity_threshold: float = 0.99, local_path: Optional[str] = None):
         self.model_name = model_name
-        self.model = None
-        self.processor = None
+        # Snapshot local safetensors (voir save_snapshot) : aucun accès réseau / hub
+        self.local_path = local_path or os.environ.get("CLIP_LOCAL_SNAPSHOT")
+        self.model = None          # tour vision + projection uniquement
+        self.processor = preprocess_batch   # prétraitement NumPy (models/preprocessing.py)
+        self.text_model = None     # chargé à la demande par encode_text
+        self.tokenizer = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.is_loaded = False
+        self.is_ready = False      # chargé + warm-up effectué
+        self._load_lock = threading.Lock()
+        
+        # Backend d'inférence de la tour vision : torch | torch_int8 | onnx
+        self.backend_name = backend or os.environ.get("CLIP_BACKEND", "torch")
+        self.onnx_path = onnx_path or os.environ.get("CLIP_ONNX_PATH", "clip_vision.onnx")
+        self.parity_threshold = parity_threshold
+        self.backend = None
+        self.tower = None
+        self.parity_report = None
         
-        logger.info(f"🤖 VintedLensCLIP initialisé - Device: {self.device}")
+        logger.info(f"🤖 VintedLensCLIP initialisé - Device: {self.device} - Backend: {self.backend_name}")
+    
+    def _pretrained_kwargs(self) -> Dict:
+        """Source des poids : snapshot local memory-mappé ou hub"""
+        if self.local_path:
+            return {"pretrained_model_name_or_path": self.local_path,
+                    "local_files_only": True, "use_safetensors": True}
+        return {"pretrained_model_name_or_path": self.model_name}
     
     def load_model(self) -> bool:
-        """Charge le modèle CLIP en mémoire"""
+        """Charge la tour vision CLIP (et sa projection) en mémoire"""
         if self.is_loaded:
-            logger.info("✅ Modèle déjà chargé")
             return True
         
-        try:
-            start_time = time.time()
-            logger.info(f"📥 Chargement {self.model_name}...")
-            
-            # Chargement modèle et processor
-            self.model = CLIPModel.from_pretrained(self.model_name)
-            self.processor = CLIPProcessor.from_pretrained(self.model_name)
-            self.model.to(self.device)
-            
-            # Mode évaluation (pas d'entraînement)
-            self.model.eval()
-            
-            load_time = time.time() - start_time
-            self.is_loaded = True
-            
-            logger.info(f"✅ Modèle chargé en {load_time:.2f}s sur {self.device}")
+        with self._load_lock:
+            if self.is_loaded:
+                return True
+            try:
+                start_time = time.time()
+                logger.info(f"📥 Chargement vision {self.local_path or self.model_name}...")
+                
+                # Vision seule : les poids texte du checkpoint ne sont pas lus
+                # (safetensors est mappé en mémoire, seuls les tenseurs utiles sont chargés)
+                self.model = CLIPVisionModelWithProjection.from_pretrained(**self._pretrained_kwargs())
+                self.model.to(self.device)
+                
+                # Mode évaluation (pas d'entraînement)
+                self.model.eval()
+                
+                self.tower = VisionTower.from_clip(self.model)
+                self.backend = self._load_backend(self.backend_name)
+                
+                load_time = time.time() - start_time
+                self.is_loaded = True
+                
+                logger.info(f"✅ Modèle chargé en {load_time:.2f}s sur {self.device}")
+                return True
+                
+            except Exception as e:
+                logger.error(f"❌ Erreur chargement modèle: {e}")
+                return False
+    
+    def warmup(self) -> bool:
+        """Hook de readiness : charge la tour vision et exécute un premier forward"""
+        if self.is_ready:
             return True
-            
-        except Exception as e:
-            logger.error(f"❌ Erreur chargement modèle: {e}")
+        if not self.load_model():
             return False
+        start_time = time.time()
+        self._encode_pixels(torch.zeros(1, 3, 224, 224))
+        self.is_ready = True
+        logger.info(f"🔥 Warm-up CLIP en {time.time() - start_time:.2f}s")
+        return True
+    
+    def _load_text_model(self):
+        """Tour texte + tokenizer, chargés seulement au premier encode_text"""
+        if self.text_model is not None:
+            return
+        with self._load_lock:
+            if self.text_model is not None:
+                return
+            start_time = time.time()
+            self.text_model = CLIPTextModelWithProjection.from_pretrained(**self._pretrained_kwargs())
+            self.tokenizer = CLIPTokenizer.from_pretrained(
+                self.local_path or self.model_name, local_files_only=bool(self.local_path)
+            )
+            self.text_model.to(self.device).eval()
+            logger.info(f"📥 Tour texte chargée en {time.time() - start_time:.2f}s")
+    
+    def save_snapshot(self, path: str):
+        """Télécharge le checkpoint complet et l'écrit en safetensors pour un chargement local"""
+        from transformers import CLIPModel, CLIPProcessor
+        model = CLIPModel.from_pretrained(self.model_name)
+        model.save_pretrained(path, safe_serialization=True)
+        CLIPProcessor.from_pretrained(self.model_name).save_pretrained(path)
+        logger.info(f"💾 Snapshot safetensors écrit dans {path}")
+    
+    def _load_backend(self, name: str):
+        """Crée le backend demandé ; hors fp32, il doit passer le contrôle de parité"""
+        if name == "torch":
+            return TorchBackend(self.tower, device=self.device)
+        
+        try:
+            backend = create_backend(name, self.tower, device=self.device, onnx_path=self.onnx_path)
+            self.parity_report = self.check_parity(backend)
+        except Exception as e:
+            logger.error(f"❌ Backend {name} indisponible ({e}) - retour à torch fp32")
+            self.backend_name = "torch"
+            return TorchBackend(self.tower, device=self.device)
+        
+        if not self.parity_report["passed"]:
+            logger.error(f"❌ Backend {name} rejeté, parité insuffisante: {self.parity_report} "
+                         f"- retour à torch fp32")
+            self.backend_name = "torch"
+            return TorchBackend(self.tower, device=self.device)
+        
+        logger.info(f"✅ Backend {name} validé: {self.parity_report}")
+        return backend
+    
+    def check_parity(self, backend, images: Optional[List[Image.Image]] = None) -> Dict:
+        """
+        Compare un backend (instance ou nom) à la référence fp32 sur un jeu d'images fixe
+        
+        Returns:
+            dict: cosinus min/moyen, accord du plus proche voisin, passed
+        """
+        if isinstance(backend, str):
+            backend = create_backend(backend, self.tower, device=self.device, onnx_path=self.onnx_path)
+        images = images or parity_images()
+        pixel_values = self.processor(images)
+        reference = TorchBackend(self.tower, device=self.device)
+        return check_parity(reference, backend, pixel_values, threshold=self.parity_threshold)
+    
+    def _encode_pixels(self, pixel_values) -> np.ndarray:
+        """pixel_values (N, 3, 224, 224) -> embeddings L2-normalisés (N, 512)"""
+        features = self.backend.encode(pixel_values)
+        # Normalisation L2 pour similarité cosinus (en place sur la sortie float32 du backend)
+        return l2_normalize(features)[0]
     
     def encode_image(self, image: Union[Image.Image, bytes, io.BytesIO]) -> Optional[np.ndarray]:
         """
@@ -74,25 +185,9 @@ class VintedLensCLIP:
         try:
             start_time = time.time()
             
-            # Conversion vers PIL si nécessaire
-            if isinstance(image, (bytes, io.BytesIO)):
-                if isinstance(image, bytes):
-                    image = io.BytesIO(image)
-                image = Image.open(image)
-            
-            # Conversion RGB si nécessaire
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Traitement CLIP
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
-                # Normalisation L2 pour similarité cosinus
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-            embedding = image_features.cpu().numpy().flatten()
+            # Décodage réduit + resize/crop + normalisation CLIP
+            pixel_values = self.processor([image])
+            embedding = self._encode_pixels(pixel_values)[0]
             encode_time = time.time() - start_time
             
             logger.info(f"⚡ Embedding généré en {encode_time:.3f}s - Shape: {embedding.shape}")
@@ -103,6 +198,26 @@ class VintedLensCLIP:
             logger.error(f"❌ Erreur encoding image: {e}")
             return None
     
+    def encode_images(self, images: List[Union[Image.Image, bytes, io.BytesIO]]) -> np.ndarray:
+        """
+        Encode plusieurs images en un seul forward pass
+        
+        Args:
+            images: Liste d'images PIL, bytes ou BytesIO
+            
+        Returns:
+            np.ndarray: Embeddings normalisés (N, 512)
+        """
+        if not self.is_loaded and not self.load_model():
+            raise RuntimeError("Modèle CLIP non chargé")
+        
+        start_time = time.time()
+        # Un seul tenseur (N, 3, 224, 224) normalisé d'un coup
+        pixel_values = self.processor(list(images))
+        embeddings = self._encode_pixels(pixel_values)
+        logger.info(f"⚡ Batch de {len(images)} embeddings en {time.time() - start_time:.3f}s")
+        return embeddings
+    
     def encode_text(self, texts: Union[str, List[str]]) -> Optional[np.ndarray]:
         """
         Encode du texte en embedding vectoriel
@@ -113,19 +228,17 @@ class VintedLensCLIP:
         Returns:
             np.ndarray: Embeddings normalisés ou None si erreur
         """
-        if not self.is_loaded:
-            if not self.load_model():
-                return None
-        
         try:
+            self._load_text_model()
+            
             if isinstance(texts, str):
                 texts = [texts]
             
             # Traitement CLIP
-            inputs = self.processor(text=texts, return_tensors="pt", padding=True).to(self.device)
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.device)
             
             with torch.no_grad():
-                text_features = self.model.get_text_features(**inputs)
+                text_features = self.text_model(**inputs).text_embeds
                 text_features = text_features / text_features.norm(dim=-1, keepdim=True)
             
             embeddings = text_features.cpu().numpy()
@@ -155,12 +268,23 @@ class VintedLensCLIP:
         """
         return np.dot(embeddings, query_embedding)
     
+    @property
+    def model_version(self) -> str:
+        """Étiquette des embeddings produits (modèle, backend effectif, prétraitement)"""
+        return f"{self.model_name}:{self.backend_name}:{PREPROCESS_VERSION}"
+    
     def get_model_info(self) -> dict:
         """Retourne les informations du modèle"""
         return {
             "model_name": self.model_name,
             "device": self.device,
+            "backend": self.backend_name,
+            "parity": self.parity_report,
             "is_loaded": self.is_loaded,
+            "is_ready": self.is_ready,
+            "text_loaded": self.text_model is not None,
+            "local_snapshot": self.local_path,
+            "model_version": self.model_version,
             "embedding_dim": 512,  # CLIP ViT-B/32
             "input_resolution": 224
         }
@@ -176,15 +300,22 @@ def get_clip_service() -> VintedLensCLIP:
     return _clip_service
 
 class CLIPService(VintedLensCLIP):
-    def encode_image_pil(self, img):
+    def encode_image_pil(self, img) -> np.ndarray:
         emb = self.encode_image(img)
         if emb is None:
             raise RuntimeError("CLIPService: échec encode_image")
-        # retourne une list[float] pour ClickHouse (Float32)
-        return [float(x) for x in emb]
+        # np.ndarray float32 (512,) contigu, écrit tel quel par add_products (Native)
+        return emb
 
 # Test du service
 if __name__ == "__main__":
+    import sys
+    
+    # python -m models.clip_model snapshot <dossier> : prépare le snapshot local
+    if len(sys.argv) == 3 and sys.argv[1] == "snapshot":
+        VintedLensCLIP().save_snapshot(sys.argv[2])
+        sys.exit(0)
+    
     # Test rapide du service
     clip = VintedLensCLIP()
     
@@ -192,5 +323,12 @@ if __name__ == "__main__":
         print("✅ Service CLIP opérationnel")
         info = clip.get_model_info()
         print(f"📊 Info: {info}")
+        
+        # Parité de chaque backend disponible avec fp32
+        for name in BACKENDS[1:]:
+            try:
+                print(f"🔬 Parité {name}: {clip.check_parity(name)}")
+            except Exception as e:
+                print(f"⚠️ Backend {name} indisponible: {e}")
     else:
         print("❌ Erreur initialisation service CLIP")
\ No newline at end of file
@@ -0,0 +1,89 @@
+# models/preprocessing.py
+# Décodage et prétraitement rapides des images pour CLIP (uploads API et ingestion)
+
+import io
+import numpy as np
+from PIL import Image, ImageOps
+from typing import List, Union
+
+# Normalisation CLIP (identique à CLIPImageProcessor)
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+INPUT_SIZE = 224
+
+# À incrémenter si le prétraitement change les pixels (invalide les embeddings en cache)
+PREPROCESS_VERSION = "np1"
+
+# Au-delà, l'image est refusée avant décodage (≈ 40 Mpx, ex. 8000x5000)
+MAX_PIXELS = 40_000_000
+
+# Garde-fou PIL contre les "decompression bombs" aligné sur notre limite
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+
+class ImageTooLargeError(ValueError):
+    """Image dont la résolution dépasse la limite autorisée"""
+
+
+def decode_image(data: Union[bytes, io.BytesIO, Image.Image], size: int = INPUT_SIZE,
+                 max_pixels: int = MAX_PIXELS) -> Image.Image:
+    """
+    Décode une image en RGB directement à une résolution proche de `size`.
+
+    - la taille est lue dans l'en-tête : refus avant tout décodage si > max_pixels
+    - JPEG : mode draft (décodage DCT réduit 1/2, 1/4, 1/8) -> côté court >= size
+    - orientation EXIF appliquée (photos de smartphone)
+    """
+    if isinstance(data, Image.Image):
+        image = data
+    else:
+        try:
+            image = Image.open(io.BytesIO(data) if isinstance(data, bytes) else data)
+        except Image.DecompressionBombError as e:
+            # au-delà de 2 x MAX_IMAGE_PIXELS, PIL refuse avant notre propre contrôle
+            raise ImageTooLargeError(f"Image trop grande: {e}") from e
+
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"Image trop grande: {width}x{height} (> {max_pixels} pixels)")
+
+    if image.format == "JPEG":
+        # draft garantit que les deux côtés restent >= à la taille demandée
+        image.draft("RGB", (size, size))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def resize_center_crop(image: Image.Image, size: int = INPUT_SIZE) -> np.ndarray:
+    """Côté court à `size` (bicubique) puis crop central -> uint8 (size, size, 3)"""
+    width, height = image.size
+    scale = size / min(width, height)
+    new_w, new_h = max(size, round(width * scale)), max(size, round(height * scale))
+    if (new_w, new_h) != (width, height):
+        # reducing_gap : pré-réduction entière rapide avant le filtre bicubique
+        image = image.resize((new_w, new_h), Image.BICUBIC, reducing_gap=3.0)
+
+    left, top = (new_w - size) // 2, (new_h - size) // 2
+    return np.asarray(image.crop((left, top, left + size, top + size)), dtype=np.uint8)
+
+
+def preprocess_batch(images: List[Union[bytes, Image.Image]], size: int = INPUT_SIZE) -> np.ndarray:
+    """
+    Images (bytes ou PIL) -> tenseur CLIP (N, 3, size, size) float32.
+    La normalisation est faite une seule fois, vectorisée, sur tout le batch.
+    """
+    if not images:
+        return np.empty((0, 3, size, size), dtype=np.float32)
+
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for i, image in enumerate(images):
+        batch[i] = resize_center_crop(decode_image(image, size=size), size=size)
+
+    pixels = batch.astype(np.float32)
+    pixels *= 1.0 / 255.0
+    pixels -= CLIP_MEAN
+    pixels /= CLIP_STD
+    return np.ascontiguousarray(pixels.transpose(0, 3, 1, 2))
@@ -0,0 +1,122 @@
+# services/batching.py
+# Micro-batching asynchrone : regroupe les requêtes concurrentes en un seul appel batché
+
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    File d'attente devant une fonction batchée (ex: encodage CLIP).
+
+    Chaque appel à submit() dépose un élément et attend son résultat. Un worker
+    collecte les éléments pendant au plus `max_wait_ms` (ou jusqu'à `max_batch_size`),
+    appelle `batch_fn(items)` une seule fois dans un executor, puis résout le
+    future de chaque appelant avec le résultat correspondant.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 8.0,
+                 executor=None, name: str = "batch"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.name = name
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # métriques
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = Counter()
+        self._wait_ms = deque(maxlen=1000)
+        self._run_ms = deque(maxlen=1000)
+
+    def _ensure_worker(self):
+        # créé à la première requête pour être lié à la boucle asyncio du serveur
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """Ajoute un élément au prochain batch et attend son résultat"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        self.requests += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _collect(self) -> list:
+        """Premier élément (bloquant) puis tout ce qui arrive avant l'échéance"""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self._wait_ms.append((started - enqueued) * 1000)
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: {len(results)} résultats pour {len(items)} éléments")
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            self._run_ms.append((time.perf_counter() - started) * 1000)
+            self.batches += 1
+            self.batch_sizes[len(batch)] += 1
+
+    @staticmethod
+    def _percentiles(values) -> dict:
+        if not values:
+            return {"p50": 0.0, "p99": 0.0}
+        arr = np.fromiter(values, dtype=np.float64)
+        return {"p50": round(float(np.percentile(arr, 50)), 2),
+                "p99": round(float(np.percentile(arr, 99)), 2)}
+
+    def stats(self) -> dict:
+        """Métriques pour régler le compromis débit / p99"""
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "avg_batch_size": (round(sum(k * v for k, v in self.batch_sizes.items()) / self.batches, 2)
+                               if self.batches else 0.0),
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_wait_ms": self._percentiles(self._wait_ms),
+            "batch_run_ms": self._percentiles(self._run_ms),
+        }
@@ -0,0 +1,141 @@
+# services/cache.py
+# Cache asynchrone TTL + LRU avec stale-while-revalidate et coalescence des appels
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from services.fanout import LatencyTracker
+
+
+class AsyncTTLCache:
+    """
+    Cache clé -> résultat d'un appel distant.
+
+    - frais (âge < ttl_s) : servi directement
+    - périmé (âge < ttl_s + stale_s) : servi immédiatement, un seul
+      rafraîchissement part en tâche de fond
+    - absent / trop vieux : appel au loader ; les appels concurrents sur la
+      même clé attendent le même future (un seul appel amont)
+
+    Les résultats `None` (erreur amont) ne sont pas mis en cache. Un appelant
+    annulé (ex: budget de latence dépassé) n'annule pas l'appel partagé, qui
+    remplit quand même le cache pour la requête suivante.
+
+    `load_latency` ne mesure que les appels amont réels (pas les hits) : c'est
+    la latence sur laquelle caler un hedging.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl_s: float = 60.0, stale_s: float = 300.0,
+                 name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self.name = name
+
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()   # clé -> (valeur, t_stockage)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.load_latency = LatencyTracker()
+
+        # métriques
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable], shared: bool = True):
+        start = time.perf_counter()
+        try:
+            value = await loader()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            if shared:
+                self._inflight.pop(key, None)
+        if value is None:
+            self.errors += 1
+        else:
+            self.load_latency.record(time.perf_counter() - start)
+            self._store(key, value)
+        return value
+
+    def _start_load(self, key: Hashable, loader: Callable[[], Awaitable]) -> asyncio.Future:
+        future = asyncio.ensure_future(self._load(key, loader))
+        # évite "exception was never retrieved" pour un rafraîchissement sans attente
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        return future
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable],
+                          bypass: bool = False) -> Any:
+        """
+        bypass : appel amont direct, sans lire le cache ni rejoindre l'appel en
+        cours (second appel d'un hedging) ; le résultat est tout de même stocké
+        """
+        if bypass:
+            self.bypassed += 1
+            return await self._load(key, loader, shared=False)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl_s:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if age < self.ttl_s + self.stale_s:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start_load(key, loader)
+                return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            future = self._start_load(key, loader)
+        return await asyncio.shield(future)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl_s,
+            "stale_s": self.stale_s,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+            "inflight": len(self._inflight),
+            "load_latency": self.load_latency.stats(),
+        }
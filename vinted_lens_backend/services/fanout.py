@@ -0,0 +1,158 @@
+# services/fanout.py
+# Interrogation concurrente de plusieurs sources sous un budget de latence commun
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import numpy as np
+
+
+class LatencyTracker:
+    """Fenêtre glissante des latences réussies d'une source (secondes)"""
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """None tant que la fenêtre est trop courte pour être significative"""
+        if len(self._samples) < self.min_samples:
+            return None
+        return float(np.percentile(self._samples, p))
+
+    def stats(self) -> Dict:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": len(self._samples),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+@dataclass
+class SourceResult:
+    status: str                 # ok | timeout | error
+    value: Any = None
+    elapsed: float = 0.0
+    hedged: bool = False
+    error: Optional[str] = None
+
+
+class FanOut:
+    """
+    Lance toutes les sources en parallèle et rend la main à l'échéance :
+    une source qui n'a pas répondu est annulée et marquée `timeout`.
+
+    Hedging (optionnel, sources idempotentes uniquement) : si le premier appel
+    dépasse le p95 observé de la source, un second appel est lancé via
+    `factory(hedge=True)` (la source peut ainsi contourner un cache / une
+    coalescence) ; le premier des deux qui répond gagne.
+    """
+
+    def __init__(self, budget_ms: float = 300.0, hedge: bool = False):
+        self.budget_ms = budget_ms
+        self.hedge = hedge
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self.timeouts: Dict[str, int] = {}
+        self.hedges: Dict[str, int] = {}
+        self._external = set()
+
+    def attach(self, name: str, tracker: LatencyTracker):
+        """
+        Latences mesurées par la source elle-même (ex: appels amont réels d'un cache,
+        sans les hits) : le seuil de hedging en vient et run() ne les enregistre pas
+        """
+        self.trackers[name] = tracker
+        self._external.add(name)
+
+    def tracker(self, name: str) -> LatencyTracker:
+        if name not in self.trackers:
+            self.trackers[name] = LatencyTracker()
+        return self.trackers[name]
+
+    async def _timed(self, name: str, factory: Callable[[], Awaitable], hedgeable: bool):
+        """Retourne (valeur, hedged, durée)"""
+        start = time.perf_counter()
+        value, hedged = await self._call(name, factory, hedgeable)
+        return value, hedged, time.perf_counter() - start
+
+    async def _call(self, name: str, factory: Callable[[], Awaitable], hedgeable: bool):
+        """Retourne (valeur, hedged)"""
+        hedge_after = self.tracker(name).percentile(95) if (self.hedge and hedgeable) else None
+        first = asyncio.ensure_future(factory())
+        if hedge_after is None:
+            return await first, False
+
+        # appelant annulé (budget dépassé) : aucun appel ne doit survivre
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return first.result(), False
+
+            self.hedges[name] = self.hedges.get(name, 0) + 1
+            pending.add(asyncio.ensure_future(factory(hedge=True)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), True
+            # les deux ont échoué : on remonte l'erreur du premier appel
+            return first.result(), True
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def run(self, sources: Dict[str, Callable[[], Awaitable]],
+                  hedgeable: tuple = (), budget_ms: Optional[float] = None) -> Dict[str, SourceResult]:
+        """
+        Args:
+            sources: nom -> fabrique de coroutine (appelée une fois, deux si hedging)
+            hedgeable: noms des sources pouvant être doublées sans effet de bord ;
+                leur fabrique accepte l'argument `hedge`
+            budget_ms: échéance de cet appel (défaut : self.budget_ms)
+        """
+        budget_s = (budget_ms if budget_ms is not None else self.budget_ms) / 1000.0
+        start = time.perf_counter()
+        tasks = {
+            asyncio.ensure_future(self._timed(name, factory, name in hedgeable)): name
+            for name, factory in sources.items()
+        }
+        done, pending = await asyncio.wait(tasks, timeout=budget_s) if tasks else (set(), set())
+
+        results = {}
+        for task in pending:
+            task.cancel()
+            name = tasks[task]
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+            results[name] = SourceResult("timeout", elapsed=budget_s)
+
+        for task in done:
+            name = tasks[task]
+            if task.exception() is not None:
+                results[name] = SourceResult("error", elapsed=time.perf_counter() - start,
+                                             error=str(task.exception()))
+                continue
+            value, hedged, elapsed = task.result()
+            if name not in self._external:
+                self.tracker(name).record(elapsed)
+            results[name] = SourceResult("ok", value=value, elapsed=elapsed, hedged=hedged)
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "budget_ms": self.budget_ms,
+            "hedge": self.hedge,
+            "sources": {
+                name: {**tracker.stats(),
+                       "timeouts": self.timeouts.get(name, 0),
+                       "hedges": self.hedges.get(name, 0)}
+                for name, tracker in self.trackers.items()
+            },
+        }
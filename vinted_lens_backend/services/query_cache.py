@@ -0,0 +1,170 @@
+# services/query_cache.py
+# Cache des images de requête : hash exact + hash perceptuel -> embedding et classement
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8   # dHash 8x8 -> 64 bits
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """
+    Hash perceptuel par différence (dHash) : niveaux de gris (hash_size+1) x hash_size,
+    un bit par comparaison de pixels voisins. Stable à la recompression JPEG et au
+    redimensionnement, ce qui suffit pour reconnaître un ré-upload.
+    """
+    small = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR),
+                       dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a: np.ndarray, b: int) -> np.ndarray:
+    """Distances de Hamming entre un tableau de hash uint64 et un hash"""
+    x = np.bitwise_xor(a, np.uint64(b))
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+@dataclass
+class QueryEntry:
+    phash: int
+    embedding: np.ndarray
+    created_at: float = field(default_factory=time.monotonic)
+    # mode de recherche -> (limit, génération, ids, scores)
+    ranked: Dict[str, Tuple[int, int, np.ndarray, np.ndarray]] = field(default_factory=dict)
+
+
+class QueryImageCache:
+    """
+    Cache mémoire borné (LRU) devant /api/search-similar.
+
+    - clé exacte : sha256 des octets envoyés (évite décodage + CLIP + scan)
+    - clé perceptuelle : dHash à distance de Hamming <= `max_distance`
+      (recompression, léger redimensionnement : évite CLIP + scan)
+    - le classement mémorisé est lié à la génération de l'index : il est
+      ignoré dès que l'index a intégré de nouveaux produits (bump_generation)
+      et, dans tous les cas, après `ttl_s`
+    - les requêtes identiques simultanées partagent un seul calcul (coalesce)
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl_s: float = 300.0, max_distance: int = 4):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.max_distance = max_distance
+        self.generation = 0
+
+        self._entries: "OrderedDict[str, QueryEntry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # métriques
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.ranked_hits = 0
+        self.ranked_misses = 0
+        self.evictions = 0
+
+    def _expired(self, entry: QueryEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_s
+
+    def bump_generation(self):
+        """À appeler quand l'index intègre de nouveaux produits"""
+        self.generation += 1
+
+    # --- embeddings ---
+    def lookup_exact(self, digest: str) -> Optional[QueryEntry]:
+        entry = self._entries.get(digest)
+        if entry is None or self._expired(entry):
+            return None
+        self._entries.move_to_end(digest)
+        self.exact_hits += 1
+        return entry
+
+    def lookup_perceptual(self, digest: str, phash: int) -> Optional[QueryEntry]:
+        """Entrée la plus proche en Hamming ; enregistrée aussi sous `digest`"""
+        if not self._entries or self.max_distance < 0:
+            return None
+        digests = list(self._entries.keys())
+        hashes = np.fromiter((e.phash for e in self._entries.values()), dtype=np.uint64,
+                             count=len(digests))
+        distances = hamming(hashes, phash)
+        best = int(np.argmin(distances))
+        entry = self._entries[digests[best]]
+        if distances[best] > self.max_distance or self._expired(entry):
+            return None
+        self.perceptual_hits += 1
+        self._store(digest, entry)
+        return entry
+
+    def put(self, digest: str, phash: int, embedding: np.ndarray) -> QueryEntry:
+        self.misses += 1
+        entry = QueryEntry(phash=phash, embedding=np.asarray(embedding, dtype=np.float32))
+        self._store(digest, entry)
+        return entry
+
+    def _store(self, digest: str, entry: QueryEntry):
+        self._entries[digest] = entry
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def coalesce(self, digest: str, compute: Callable[[], Awaitable[QueryEntry]]) -> QueryEntry:
+        """Un seul calcul par digest en vol ; les autres appelants attendent son résultat"""
+        future = self._inflight.get(digest)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(compute())
+        self._inflight[digest] = future
+        future.add_done_callback(lambda f: self._inflight.pop(digest, None))
+        return await asyncio.shield(future)
+
+    # --- classement ---
+    def ranked(self, entry: QueryEntry, limit: int, mode: str = "") -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        ranked = entry.ranked.get(mode)
+        if ranked is None or ranked[0] < limit or ranked[1] != self.generation or self._expired(entry):
+            self.ranked_misses += 1
+            return None
+        self.ranked_hits += 1
+        return ranked[2][:limit], ranked[3][:limit]
+
+    def set_ranked(self, entry: QueryEntry, limit: int, generation: int, ids: List, scores: List,
+                   mode: str = ""):
+        """`generation` : valeur lue avant la recherche (ignoré si l'index a bougé entre-temps)"""
+        if generation != self.generation:
+            return
+        entry.ranked[mode] = (limit, generation, np.asarray(ids, dtype=np.uint64),
+                              np.asarray(scores, dtype=np.float32))
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.perceptual_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl_s,
+            "max_distance": self.max_distance,
+            "generation": self.generation,
+            "exact_hits": self.exact_hits,
+            "perceptual_hits": self.perceptual_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "ranked_hits": self.ranked_hits,
+            "ranked_misses": self.ranked_misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.perceptual_hits) / lookups, 3) if lookups else None,
+            "inflight": len(self._inflight),
+        }
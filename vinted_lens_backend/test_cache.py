@@ -0,0 +1,155 @@
+import os, sys, time, asyncio
+sys.path.append(os.path.dirname(__file__))
+
+from services.cache import AsyncTTLCache
+
+
+class FakeLoader:
+    """Appel amont simulé : compte les appels, valeur numérotée par appel"""
+
+    def __init__(self, delay: float = 0.0, value: str = "v"):
+        self.delay, self.value = delay, value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.delay)
+        return f"{self.value}{call}"
+
+
+def _age(cache: AsyncTTLCache, key, seconds: float):
+    """Vieillit une entrée sans attendre"""
+    value, _ = cache._entries[key]
+    cache._entries[key] = (value, time.monotonic() - seconds)
+
+
+def test_fresh_entry_is_a_hit():
+    async def scenario():
+        cache, loader = AsyncTTLCache(ttl_s=60), FakeLoader()
+        first = await cache.get_or_load("robe", loader)
+        second = await cache.get_or_load("robe", loader)
+        return cache, loader, first, second
+
+    cache, loader, first, second = asyncio.run(scenario())
+    assert first == second == "v1" and loader.calls == 1
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert len(cache.load_latency._samples) == 1, "un hit ne compte pas comme latence amont"
+
+
+def test_stale_entry_served_with_one_refresh():
+    async def scenario():
+        cache, loader = AsyncTTLCache(ttl_s=10, stale_s=100), FakeLoader(delay=0.02)
+        await cache.get_or_load("robe", loader)
+        _age(cache, "robe", 20)
+        stale = await asyncio.gather(*(cache.get_or_load("robe", loader) for _ in range(5)))
+        calls_while_refreshing = loader.calls
+        await asyncio.sleep(0.05)
+        fresh = await cache.get_or_load("robe", loader)
+        return cache, loader, stale, calls_while_refreshing, fresh
+
+    cache, loader, stale, calls_while_refreshing, fresh = asyncio.run(scenario())
+    assert stale == ["v1"] * 5, "l'entrée périmée doit être servie sans attendre"
+    assert calls_while_refreshing == 2 and cache.refreshes == 1, "un seul rafraîchissement"
+    assert fresh == "v2" and loader.calls == 2
+    assert (cache.stale_hits, cache.hits) == (5, 1)
+
+
+def test_expired_entry_is_reloaded():
+    async def scenario():
+        cache, loader = AsyncTTLCache(ttl_s=10, stale_s=10), FakeLoader()
+        await cache.get_or_load("robe", loader)
+        _age(cache, "robe", 30)
+        return cache, await cache.get_or_load("robe", loader)
+
+    cache, value = asyncio.run(scenario())
+    assert value == "v2" and cache.misses == 2 and cache.stale_hits == 0
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        cache, loader = AsyncTTLCache(), FakeLoader(delay=0.02)
+        values = await asyncio.gather(*(cache.get_or_load("robe", loader) for _ in range(8)))
+        return cache, loader, values
+
+    cache, loader, values = asyncio.run(scenario())
+    assert values == ["v1"] * 8 and loader.calls == 1
+    assert (cache.misses, cache.coalesced) == (1, 7)
+    assert not cache._inflight
+
+
+def test_cancelled_caller_does_not_cancel_shared_load():
+    async def scenario():
+        cache, loader = AsyncTTLCache(), FakeLoader(delay=0.03)
+        try:
+            await asyncio.wait_for(cache.get_or_load("robe", loader), timeout=0.005)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.05)
+        return cache, loader, await cache.get_or_load("robe", loader)
+
+    cache, loader, value = asyncio.run(scenario())
+    assert value == "v1" and loader.calls == 1 and cache.hits == 1
+
+
+def test_bypass_skips_cache_and_inflight_load():
+    async def scenario():
+        cache, loader = AsyncTTLCache(), FakeLoader(delay=0.02)
+        await cache.get_or_load("robe", loader)
+        hedged = await cache.get_or_load("robe", loader, bypass=True)
+        # un appel partagé en cours n'est pas rejoint non plus
+        _age(cache, "robe", 10 ** 6)
+        shared = asyncio.ensure_future(cache.get_or_load("robe", loader))
+        await asyncio.sleep(0)
+        bypassed = await cache.get_or_load("robe", loader, bypass=True)
+        return cache, loader, hedged, await shared, bypassed
+
+    cache, loader, hedged, shared, bypassed = asyncio.run(scenario())
+    assert hedged == "v2", "bypass ne doit pas servir l'entrée fraîche"
+    assert {shared, bypassed} == {"v3", "v4"} and loader.calls == 4
+    assert cache.bypassed == 2 and cache.hits == 0 and cache.coalesced == 0
+
+
+def test_none_is_not_cached():
+    async def scenario():
+        cache, calls = AsyncTTLCache(), []
+
+        async def failing():
+            calls.append(1)
+            return None
+        await cache.get_or_load("robe", failing)
+        await cache.get_or_load("robe", failing)
+        return cache, calls
+
+    cache, calls = asyncio.run(scenario())
+    assert len(calls) == 2 and cache.errors == 2 and not cache._entries
+
+
+def test_lru_eviction():
+    async def scenario():
+        cache, loader = AsyncTTLCache(maxsize=2), FakeLoader()
+        await cache.get_or_load("a", loader)
+        await cache.get_or_load("b", loader)
+        await cache.get_or_load("a", loader)       # "a" redevient la plus récente
+        await cache.get_or_load("c", loader)       # évince "b"
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert list(cache._entries) == ["a", "c"] and cache.evictions == 1
+    assert cache.stats()["size"] == 2
+
+
+def main():
+    test_fresh_entry_is_a_hit()
+    test_stale_entry_served_with_one_refresh()
+    test_expired_entry_is_reloaded()
+    test_concurrent_misses_share_one_load()
+    test_cancelled_caller_does_not_cancel_shared_load()
+    test_bypass_skips_cache_and_inflight_load()
+    test_none_is_not_cached()
+    test_lru_eviction()
+    print("[OK] Cache TTL : hits, stale-while-revalidate, coalescence et LRU")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,13 @@
 import sys
 import os
 import numpy as np
-import time
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
 try:
     from database.clickhouse_setup import ClickHouseVectorDB
+    from database.product_writer import ProductWriter
     DB_AVAILABLE = True
 except Exception as e:
     print(f"ClickHouse non disponible: {e}")
@@ -31,55 +31,43 @@ class RobustProductCollector:
         added_count = 0
         error_count = 0
         
+        brands = ["Zara", "H&M", "Nike", "Adidas"]
+        colors = ["noir", "blanc", "bleu", "rouge"]
+        categories = ["tops", "bottoms", "shoes"]
+        
+        # Un seul lot : un INSERT Native par table au lieu de deux requêtes par produit
+        products = []
+        embeddings = np.empty((count, 512), dtype=np.float32)
         for i in range(count):
-            try:
-                # Données simplifiées pour éviter erreurs SQL
-                np.random.seed(i + 1000)  # Seed différent pour éviter doublons
-                
-                brands = ["Zara", "H&M", "Nike", "Adidas"]
-                colors = ["noir", "blanc", "bleu", "rouge"]
-                categories = ["tops", "bottoms", "shoes"]
-                
-                brand = np.random.choice(brands)
-                color = np.random.choice(colors)
-                category = np.random.choice(categories)
-                
-                # Prix simple
-                price = round(np.random.uniform(10, 50), 2)
-                
-                # Embedding normalisé
-                embedding = np.random.rand(512).astype(np.float32)
-                embedding = embedding / np.linalg.norm(embedding)
-                
-                product_data = {
-                    "title": f"{brand} {color} {category}",  # Titre simplifié
-                    "price": price,
-                    "platform": "batch",
-                    "image_url": f"https://example.com/{i}.jpg",
-                    "embedding": embedding,
-                    "category": category,
-                    "color": color,
-                    "brand": brand,
-                    "size": "M",
-                    "condition": "bon"  # Condition simplifiée
-                }
-                
-                product_id = self.vector_db.add_product(product_data)
-                if product_id:
-                    added_count += 1
-                    if added_count % 25 == 0:
-                        print(f"  {added_count}/{count} produits OK")
-                else:
-                    error_count += 1
-                
-                # Pause pour éviter surcharge ClickHouse
-                time.sleep(0.05)
-                
-            except Exception as e:
-                error_count += 1
-                if error_count % 10 == 0:
-                    print(f"  Erreurs: {error_count}")
-                continue
+            np.random.seed(i + 1000)  # Seed différent pour éviter doublons
+            
+            brand = np.random.choice(brands)
+            color = np.random.choice(colors)
+            category = np.random.choice(categories)
+            
+            # Prix simple
+            price = round(np.random.uniform(10, 50), 2)
+            
+            # Embedding normalisé
+            embedding = np.random.rand(512).astype(np.float32)
+            embeddings[i] = embedding / np.linalg.norm(embedding)
+            
+            products.append({
+                "title": f"{brand} {color} {category}",  # Titre simplifié
+                "price": price,
+                "platform": "batch",
+                "image_url": f"https://example.com/{i}.jpg",
+                "category": category,
+                "color": color,
+                "brand": brand,
+                "size": "M",
+                "condition": "bon"  # Condition simplifiée
+            })
+        
+        with ProductWriter(self.vector_db, flush_interval_s=0) as writer:
+            writer.add_many(products, embeddings)
+        added_count = writer.written
+        error_count = writer.failed
         
         print(f"Terminé: {added_count} ajoutés, {error_count} erreurs")
         return added_count
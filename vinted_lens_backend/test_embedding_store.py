@@ -0,0 +1,73 @@
+import os, sys, tempfile
+sys.path.append(os.path.dirname(__file__))
+
+import numpy as np
+
+from database.embedding_store import MmapEmbeddingStore, EMBEDDINGS_FILE, IDS_FILE
+
+DIM = 8
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def test_append_and_search():
+    path = tempfile.mkdtemp()
+    store = MmapEmbeddingStore.create(path, dim=DIM, dtype="float32")
+    vecs = _vectors(20)
+    assert store.append(np.arange(1, 21), vecs) == 20
+    assert store.append([], np.empty((0, DIM))) == 0
+
+    ids, scores = store.search(vecs[7], k=3)
+    assert int(ids[0]) == 8, f"top-1 attendu 8, obtenu {ids[0]}"
+    assert abs(float(scores[0]) - 1.0) < 1e-5
+
+    many_ids, _ = store.search_many(vecs[[3, 11]], k=1)
+    assert many_ids[:, 0].tolist() == [4, 12]
+
+
+def test_reader_sees_published_rows_only():
+    path = tempfile.mkdtemp()
+    writer = MmapEmbeddingStore.create(path, dim=DIM, dtype="float16")
+    reader = MmapEmbeddingStore(path)
+    assert len(reader) == 0
+
+    writer.append([1, 2, 3], _vectors(3))
+    # le lecteur re-mappe à la recherche suivante (nouvelle publication de meta.json)
+    ids, _ = reader.search(_vectors(1)[0], k=10)
+    assert len(reader) == 3 and sorted(ids.tolist()) == [1, 2, 3]
+
+
+def test_append_after_crash_is_aligned():
+    path = tempfile.mkdtemp()
+    store = MmapEmbeddingStore.create(path, dim=DIM, dtype="float32")
+    vecs = _vectors(3, seed=1)
+    store.append([1, 2], vecs[:2])
+
+    # crash simulé : données écrites, meta.json jamais publié
+    with open(os.path.join(path, EMBEDDINGS_FILE), "ab") as f:
+        f.write(b"\xff" * (DIM * 4 * 5 + 3))
+    with open(os.path.join(path, IDS_FILE), "ab") as f:
+        f.write(b"\xff" * 13)
+
+    reopened = MmapEmbeddingStore(path, writable=True)
+    assert len(reopened) == 2, "les lignes non publiées ne doivent pas être visibles"
+    reopened.append([3], vecs[2:])
+
+    assert reopened.ids.tolist() == [1, 2, 3]
+    expected = vecs[2] / np.linalg.norm(vecs[2])
+    assert np.allclose(reopened.embeddings[2], expected, atol=1e-6), "ligne ajoutée décalée"
+    assert os.path.getsize(os.path.join(path, EMBEDDINGS_FILE)) == 3 * DIM * 4
+    assert os.path.getsize(os.path.join(path, IDS_FILE)) == 3 * 8
+
+
+def main():
+    test_append_and_search()
+    test_reader_sees_published_rows_only()
+    test_append_after_crash_is_aligned()
+    print("[OK] Store mmap : ajout, publication et reprise après crash")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(__file__))
+
+from services.fanout import FanOut, LatencyTracker
+
+
+class FakeSource:
+    """Fabrique de coroutines : latence fixe par appel, annulations et appels hedgés comptés"""
+
+    def __init__(self, delay: float, value="ok", hedge_delay: float = None, error: str = None):
+        self.delay, self.value, self.error = delay, value, error
+        self.hedge_delay = hedge_delay if hedge_delay is not None else delay
+        self.calls, self.hedged_calls, self.cancelled = 0, 0, 0
+
+    def __call__(self, hedge: bool = False):
+        self.calls += 1
+        self.hedged_calls += hedge
+        return self._run(self.hedge_delay if hedge else self.delay, hedge)
+
+    async def _run(self, delay: float, hedge: bool):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise RuntimeError(self.error)
+        return f"{self.value}:hedge" if hedge else self.value
+
+
+def _warm(fanout: FanOut, name: str, seconds: float):
+    """Fenêtre de latences suffisante pour que le p95 existe"""
+    tracker = fanout.tracker(name)
+    for _ in range(tracker.min_samples):
+        tracker.record(seconds)
+
+
+async def _settle():
+    # run() annule sans attendre : laisse les CancelledError se propager
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_budget_cuts_off_slow_sources():
+    async def scenario():
+        fanout = FanOut(budget_ms=50)
+        fast, slow, broken = FakeSource(0.0, "db"), FakeSource(1.0), FakeSource(0.0, error="boom")
+        results = await fanout.run({"clickhouse": fast, "vinted": slow, "other": broken})
+        await _settle()
+        return fanout, slow, results
+
+    fanout, slow, results = asyncio.run(scenario())
+    assert results["clickhouse"].status == "ok" and results["clickhouse"].value == "db"
+    assert results["vinted"].status == "timeout" and slow.cancelled == 1
+    assert results["other"].status == "error" and results["other"].error == "boom"
+    assert fanout.timeouts == {"vinted": 1}
+    # seules les réponses réussies alimentent la fenêtre de latence
+    assert len(fanout.tracker("clickhouse")._samples) == 1
+    assert "vinted" not in fanout.trackers or not fanout.tracker("vinted")._samples
+
+
+def test_hedge_after_p95():
+    async def scenario():
+        fanout = FanOut(budget_ms=500, hedge=True)
+        _warm(fanout, "vinted", 0.01)
+        source = FakeSource(1.0, "vinted", hedge_delay=0.0)
+        results = await fanout.run({"vinted": source}, hedgeable=("vinted",))
+        await _settle()
+        return fanout, source, results
+
+    fanout, source, results = asyncio.run(scenario())
+    result = results["vinted"]
+    assert result.status == "ok" and result.hedged and result.value == "vinted:hedge"
+    assert result.elapsed < 0.2, f"le hedge doit répondre bien avant le premier appel: {result.elapsed}"
+    assert (source.calls, source.hedged_calls) == (2, 1)
+    assert source.cancelled == 1, "le premier appel perdant doit être annulé"
+    assert fanout.hedges == {"vinted": 1}
+
+
+def test_no_hedge_before_p95_or_when_not_hedgeable():
+    async def scenario():
+        fanout = FanOut(budget_ms=500, hedge=True)
+        _warm(fanout, "vinted", 0.05)
+        _warm(fanout, "clickhouse", 0.001)
+        quick, pinned = FakeSource(0.0, "vinted"), FakeSource(0.02, "db")
+        results = await fanout.run({"vinted": quick, "clickhouse": pinned}, hedgeable=("vinted",))
+        return fanout, quick, pinned, results
+
+    fanout, quick, pinned, results = asyncio.run(scenario())
+    assert not results["vinted"].hedged and quick.calls == 1
+    assert not results["clickhouse"].hedged and pinned.calls == 1, "source non hedgeable doublée"
+    assert fanout.hedges == {}
+
+
+def test_external_tracker_is_not_recorded():
+    async def scenario():
+        fanout = FanOut(budget_ms=500)
+        tracker = LatencyTracker()
+        fanout.attach("vinted", tracker)
+        await fanout.run({"vinted": FakeSource(0.0)})
+        return tracker
+
+    assert not asyncio.run(scenario())._samples, "attach() : la source mesure elle-même"
+
+
+def test_budget_cancels_both_in_flight_calls():
+    async def scenario():
+        fanout = FanOut(budget_ms=80, hedge=True)
+        _warm(fanout, "vinted", 0.01)
+        source = FakeSource(1.0, hedge_delay=1.0)
+        results = await fanout.run({"vinted": source}, hedgeable=("vinted",))
+        await _settle()
+        return fanout, source, results
+
+    fanout, source, results = asyncio.run(scenario())
+    assert results["vinted"].status == "timeout"
+    assert (source.calls, source.hedged_calls) == (2, 1)
+    assert source.cancelled == 2, f"appels survivants après l'échéance: {2 - source.cancelled}"
+    assert fanout.timeouts == {"vinted": 1} and fanout.hedges == {"vinted": 1}
+
+
+def main():
+    test_budget_cuts_off_slow_sources()
+    test_hedge_after_p95()
+    test_no_hedge_before_p95_or_when_not_hedgeable()
+    test_external_tracker_is_not_recorded()
+    test_budget_cancels_both_in_flight_calls()
+    print("[OK] Fan-out : budget, hedging et annulation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os, sys, threading, time
+sys.path.append(os.path.dirname(__file__))
+
+import numpy as np
+
+from database.filter_planner import FilterPlanner, SearchFilters, PRICE_QUANTILES
+
+
+class FakeStatsDB:
+    """query_native minimal : 100 000 produits, prix uniformes sur [0, 100]"""
+    database = "vinted_lens"
+    total = 100000
+    values = {
+        'platform': {'vinted': 90000, 'leboncoin': 10000},
+        'category': {'robe': 20000, 'jean': 5000},
+        'brand': {'zara': 4000, 'nike': 1000},
+        'size': {'M': 30000},
+    }
+    distinct = {'platform': 2, 'category': 12, 'brand': 502, 'size': 10}
+
+    def __init__(self):
+        self.queries = 0
+
+    def query_native(self, query: str, params=None, settings=None):
+        self.queries += 1
+        if 'GROUP BY' in query:
+            col = next(c for c in self.values if f"SELECT {c} AS value" in query)
+            return {'value': list(self.values[col]), 'c': np.array(list(self.values[col].values()))}
+        q = np.linspace(0, 100, PRICE_QUANTILES + 1)[1:-1]
+        return {'total': np.array([self.total]), 'price_lo': np.array([0.0]),
+                'price_hi': np.array([100.0]), 'price_q': [q],
+                **{f'u_{c}': np.array([n]) for c, n in self.distinct.items()}}
+
+
+def _planner(**kwargs) -> FilterPlanner:
+    planner = FilterPlanner(FakeStatsDB(), **kwargs)
+    planner.refresh()
+    return planner
+
+
+def test_selectivity_estimates():
+    stats = _planner().column_stats
+    assert stats.selectivity(SearchFilters()) == 1.0
+    assert abs(stats.selectivity(SearchFilters(platform='vinted')) - 0.9) < 1e-9
+    # filtres indépendants : produit des fractions
+    assert abs(stats.selectivity(SearchFilters(category='robe', brand='zara')) - 0.2 * 0.04) < 1e-9
+    # valeur non suivie : lignes restantes réparties sur les valeurs distinctes non suivies
+    untracked = (100000 - 5000) / 500 / 100000
+    assert abs(stats.selectivity(SearchFilters(brand='inconnue')) - untracked) < 1e-9
+    # prix : quantiles uniformes -> fraction de l'intervalle
+    assert abs(stats.selectivity(SearchFilters(price_min=20, price_max=30)) - 0.1) < 1e-6
+    assert abs(stats.selectivity(SearchFilters(price_max=50)) - 0.5) < 1e-6
+
+
+def test_plan_strategies():
+    planner = _planner(prefilter_max_rows=5000, overfetch=2.0, overfetch_max=2000)
+    assert planner.plan(SearchFilters(), 10).strategy == "none"
+
+    narrow = planner.plan(SearchFilters(brand='nike'), 10)         # 1 000 lignes estimées
+    assert narrow.strategy == "prefilter" and narrow.estimated_rows == 1000
+
+    broad = planner.plan(SearchFilters(platform='vinted'), 10)     # 90 % des produits
+    assert broad.strategy == "postfilter"
+    assert broad.fetch == int(np.ceil(10 / 0.9 * 2.0))
+
+    # large mais sur-échantillonnage trop coûteux : prefilter
+    costly = planner.plan(SearchFilters(category='robe'), 500)     # 500 / 0.2 * 2 = 5 000 candidats
+    assert costly.strategy == "prefilter" and "sur-échantillonnage" in costly.reason
+    assert planner.stats()["plans"] == {"none": 1, "prefilter": 2, "postfilter": 1}
+
+
+def test_plan_without_stats_is_prefilter():
+    planner = FilterPlanner(FakeStatsDB())
+    plan = planner.plan(SearchFilters(platform='vinted'), 10)
+    assert plan.strategy == "prefilter" and plan.reason == "statistiques indisponibles"
+
+
+def test_filters_validation_and_matching():
+    for bad in (dict(price_min="abc"), dict(price_min=-1), dict(price_min=10, price_max=5),
+                dict(price_max=float('nan')), dict(brand=3)):
+        try:
+            SearchFilters(**bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"filtre invalide accepté: {bad}")
+
+    filters = SearchFilters(platform='vinted', price_min=10, price_max=20)
+    assert filters.matches({'platform': 'vinted', 'price': '15'})
+    assert not filters.matches({'platform': 'vinted', 'price': 25})
+    assert not filters.matches({'platform': 'leboncoin', 'price': 15})
+
+    params = {}
+    assert filters.conditions(params) == ["platform = {platform:String}",
+                                          "price >= {price_min:Float32}", "price <= {price_max:Float32}"]
+    assert params == {'platform': 'vinted', 'price_min': 10.0, 'price_max': 20.0}
+
+
+def test_refresh_is_single_flight():
+    db = FakeStatsDB()
+    planner = FilterPlanner(db, ttl_s=60)
+    slow = db.query_native
+
+    def query_native(*args, **kwargs):
+        time.sleep(0.01)
+        return slow(*args, **kwargs)
+    db.query_native = query_native
+
+    threads = [threading.Thread(target=planner.refresh) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # un chargement = 1 requête de synthèse + 1 par colonne d'égalité
+    assert db.queries == 1 + len(FakeStatsDB.values), f"{db.queries} requêtes"
+
+
+def main():
+    test_selectivity_estimates()
+    test_plan_strategies()
+    test_plan_without_stats_is_prefilter()
+    test_filters_validation_and_matching()
+    test_refresh_is_single_flight()
+    print("[OK] Planificateur de filtres : sélectivité, stratégies et rafraîchissement")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os, sys
+sys.path.append(os.path.dirname(__file__))
+
+import numpy as np
+
+from database.native_format import decode_native, encode_native
+from database.clickhouse_setup import format_query_param
+from utils.vector_ops import to_bfloat16, from_bfloat16
+
+
+def test_round_trip_insert_columns():
+    rng = np.random.default_rng(0)
+    ids = np.array([1, 2**63 + 5, 42], dtype=np.uint64)
+    embeddings = rng.normal(size=(3, 512)).astype(np.float32)
+    titles = ["robe", "veste en jean", "été \\ 'quote'"]
+    columns, types = decode_native(encode_native([
+        ('id', 'UInt64', ids),
+        ('title', 'String', titles),
+        ('embedding', 'Array(Float32)', embeddings),
+        ('norm', 'Float32', np.linalg.norm(embeddings, axis=1)),
+    ]))
+
+    assert types == {'id': 'UInt64', 'title': 'String',
+                     'embedding': 'Array(Float32)', 'norm': 'Float32'}
+    assert columns['id'].tolist() == ids.tolist()
+    assert columns['title'] == titles
+    # Array(Float32) de dimension constante -> matrice (rows, dim), bits identiques
+    assert columns['embedding'].shape == (3, 512)
+    assert np.array_equal(columns['embedding'], embeddings)
+
+
+def test_round_trip_compact_types():
+    rng = np.random.default_rng(1)
+    embeddings = rng.normal(size=(4, 16)).astype(np.float32)
+    codes = rng.integers(-128, 128, size=(4, 16)).astype(np.int8)
+    columns, _ = decode_native(encode_native([
+        ('bf16', 'Array(BFloat16)', to_bfloat16(embeddings)),
+        ('q', 'Array(Int8)', codes),
+        ('ragged', 'Array(UInt32)', [np.array([1, 2], dtype=np.uint32), np.array([], dtype=np.uint32),
+                                     np.array([3], dtype=np.uint32), np.array([4, 5, 6], dtype=np.uint32)]),
+    ]))
+
+    assert np.array_equal(columns['q'], codes)
+    restored = from_bfloat16(columns['bf16'])
+    assert np.allclose(restored, embeddings, rtol=1 / 128), "BFloat16 : 8 bits de mantisse"
+    assert [list(v) for v in columns['ragged']] == [[1, 2], [], [3], [4, 5, 6]]
+
+
+def test_multiple_blocks_are_concatenated():
+    block = lambda start: encode_native([('id', 'UInt64', np.arange(start, start + 3, dtype=np.uint64)),
+                                         ('name', 'String', [f"p{i}" for i in range(start, start + 3)])])
+    columns, _ = decode_native(block(0) + block(3))
+    assert columns['id'].tolist() == list(range(6))
+    assert columns['name'] == [f"p{i}" for i in range(6)]
+
+
+def test_encode_rejects_ragged_columns():
+    try:
+        encode_native([('a', 'UInt8', np.zeros(2)), ('b', 'UInt8', np.zeros(3))])
+    except ValueError:
+        return
+    raise AssertionError("colonnes de longueurs différentes acceptées")
+
+
+def test_query_param_escaping():
+    assert format_query_param("l'été \\ ok") == "l\\'été \\\\ ok"
+    assert format_query_param(["a'b", "c\\d"]) == "['a\\'b','c\\\\d']"
+    assert format_query_param(np.array([1, 2], dtype=np.uint64)) == "[1,2]"
+    vec = np.random.default_rng(2).normal(size=8).astype(np.float32)
+    parsed = np.array(format_query_param(vec)[1:-1].split(','), dtype=np.float32)
+    assert np.array_equal(parsed, vec), "les float32 doivent se relire à l'identique"
+
+
+def main():
+    test_round_trip_insert_columns()
+    test_round_trip_compact_types()
+    test_multiple_blocks_are_concatenated()
+    test_encode_rejects_ragged_columns()
+    test_query_param_escaping()
+    print("[OK] Format Native : encodage / décodage et paramètres typés")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os, sys, io, asyncio
+sys.path.append(os.path.dirname(__file__))
+
+import numpy as np
+from PIL import Image
+
+from services.query_cache import QueryImageCache, content_hash, dhash
+
+
+def _photo(seed: int, size: int = 256) -> Image.Image:
+    """Image lisse (gradients + taches) : assez de structure pour un dHash stable"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    channels = []
+    for _ in range(3):
+        c = rng.uniform(0.2, 1.0) * np.sin(rng.uniform(2, 8) * x + rng.uniform(0, 6))
+        c += rng.uniform(0.2, 1.0) * np.cos(rng.uniform(2, 8) * y + rng.uniform(0, 6))
+        for cx, cy in rng.uniform(0.1, 0.9, size=(3, 2)):
+            c += np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / 0.01)
+        channels.append((c - c.min()) / (c.max() - c.min()) * 255)
+    return Image.fromarray(np.stack(channels, axis=-1).astype(np.uint8))
+
+
+def _jpeg(image: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _embedding(seed: int) -> np.ndarray:
+    v = np.random.default_rng(seed).normal(size=512).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_recompressed_jpeg_hits_by_dhash():
+    cache = QueryImageCache(max_distance=4)
+    original = _photo(0)
+    data = _jpeg(original, 95)
+    entry = cache.put(content_hash(data), dhash(Image.open(io.BytesIO(data))), _embedding(0))
+
+    # ré-upload : recompression forte + léger redimensionnement -> octets différents
+    reupload = _jpeg(original.resize((240, 240), Image.LANCZOS), 40)
+    digest = content_hash(reupload)
+    assert digest != content_hash(data) and cache.lookup_exact(digest) is None
+
+    hit = cache.lookup_perceptual(digest, dhash(Image.open(io.BytesIO(reupload))))
+    assert hit is entry and cache.perceptual_hits == 1
+    # désormais enregistrée sous son propre digest : hit exact au prochain envoi
+    assert cache.lookup_exact(digest) is entry and cache.exact_hits == 1
+
+
+def test_distant_image_misses():
+    cache = QueryImageCache(max_distance=4)
+    cache.put("a", dhash(_photo(0)), _embedding(0))
+    other = _photo(1)
+    assert cache.lookup_perceptual("b", dhash(other)) is None
+    assert cache.lookup_perceptual("c", dhash(_photo(0).transpose(Image.FLIP_LEFT_RIGHT))) is None
+    assert cache.perceptual_hits == 0 and "b" not in cache._entries
+
+
+def test_bump_generation_invalidates_ranking():
+    cache = QueryImageCache()
+    entry = cache.put("a", dhash(_photo(0)), _embedding(0))
+    generation = cache.generation
+    cache.set_ranked(entry, 20, generation, [5, 3, 9], [0.9, 0.8, 0.7], mode="ivf")
+
+    ids, scores = cache.ranked(entry, 2, mode="ivf")
+    assert ids.tolist() == [5, 3] and np.allclose(scores, [0.9, 0.8])
+    assert cache.ranked(entry, 50, mode="ivf") is None, "limite plus grande que le classement mémorisé"
+    assert cache.ranked(entry, 2, mode="exact") is None, "classement lié au mode de recherche"
+
+    cache.bump_generation()
+    assert cache.ranked(entry, 2, mode="ivf") is None
+    # recherche lancée avant l'incrément : son classement n'est pas mémorisé
+    cache.set_ranked(entry, 20, generation, [1], [0.5], mode="ivf")
+    assert cache.ranked(entry, 1, mode="ivf") is None
+    assert (cache.ranked_hits, cache.ranked_misses) == (1, 4)
+
+
+def test_concurrent_coalesce_computes_once():
+    async def scenario():
+        cache, calls = QueryImageCache(), []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return cache.put("a", 0, _embedding(0))
+
+        entries = await asyncio.gather(*(cache.coalesce("a", compute) for _ in range(6)))
+        return cache, calls, entries
+
+    cache, calls, entries = asyncio.run(scenario())
+    assert len(calls) == 1 and all(e is entries[0] for e in entries)
+    assert cache.coalesced == 5 and not cache._inflight
+
+
+def test_lru_eviction():
+    cache = QueryImageCache(maxsize=2)
+    for i, digest in enumerate("abc"):
+        cache.put(digest, i, _embedding(i))
+    assert list(cache._entries) == ["b", "c"] and cache.evictions == 1
+
+
+def main():
+    test_recompressed_jpeg_hits_by_dhash()
+    test_distant_image_misses()
+    test_bump_generation_invalidates_ranking()
+    test_concurrent_coalesce_computes_once()
+    test_lru_eviction()
+    print("[OK] Cache des images de requête : dHash, génération et coalescence")
+
+
+if __name__ == "__main__":
+    main()
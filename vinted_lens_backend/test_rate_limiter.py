@@ -0,0 +1,70 @@
+import os, sys, time, asyncio
+sys.path.append(os.path.dirname(__file__))
+
+from integrations.rate_limiter import TokenBucket, RateLimiter, parse_retry_after, RECENT_WINDOW_S
+
+
+def test_burst_then_rate():
+    bucket = TokenBucket(rate=10.0, burst=3)
+    waits = [bucket._reserve() for _ in range(5)]
+    assert waits[:3] == [0.0, 0.0, 0.0], f"rafale attendue sans attente: {waits}"
+    # jetons pris à crédit : 4e requête ~0.1 s, 5e ~0.2 s
+    assert 0.08 < waits[3] < 0.11 and 0.18 < waits[4] < 0.21, waits
+
+
+def test_aimd_adaptation():
+    bucket = TokenBucket(rate=2.0, burst=1, min_rate=0.5, max_rate=2.2, increase=0.1)
+    assert bucket.observe(429) is True
+    assert bucket.rate == 1.0 and bucket.throttled == 1
+    bucket.observe(403)
+    bucket.observe(429)
+    assert bucket.rate == 0.5, "le débit ne descend pas sous min_rate"
+
+    for _ in range(30):
+        assert bucket.observe(200) is False
+    assert abs(bucket.rate - 2.2) < 1e-9, "le débit ne dépasse pas max_rate"
+    bucket.observe(500)
+    assert abs(bucket.rate - 2.2) < 1e-9, "une erreur serveur n'est pas un signal de débit"
+
+
+def test_retry_after_blocks_bucket():
+    bucket = TokenBucket(rate=100.0, burst=10)
+    bucket.observe(429, {"Retry-After": "2"})
+    wait = bucket._reserve()
+    assert 1.9 < wait <= 2.0, f"Retry-After ignoré: {wait}"
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None and parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0     # date passée
+
+
+def test_recent_window_is_pruned_on_acquire():
+    bucket = TokenBucket(rate=1e6, burst=1e6)
+    stale = time.monotonic() - 2 * RECENT_WINDOW_S
+    bucket._recent.extend([stale] * 1000)
+    bucket.acquire()
+    assert len(bucket._recent) == 1, "acquire doit élaguer la fenêtre sans current_rate()"
+
+
+def test_limiter_buckets_and_async_acquire():
+    limiter = RateLimiter({"catalog": (1000.0, 5, 100.0, 1000.0)})
+    asyncio.run(limiter.aacquire("catalog"))
+    limiter.acquire("images")                   # classe inconnue : budget du catalogue par défaut
+    stats = limiter.stats()
+    assert stats["catalog"]["requests"] == 1 and stats["images"]["requests"] == 1
+
+
+def main():
+    test_burst_then_rate()
+    test_aimd_adaptation()
+    test_retry_after_blocks_bucket()
+    test_parse_retry_after()
+    test_recent_window_is_pruned_on_acquire()
+    test_limiter_buckets_and_async_acquire()
+    print("[OK] Limiteur de débit : rafale, AIMD et Retry-After")
+
+
+if __name__ == "__main__":
+    main()
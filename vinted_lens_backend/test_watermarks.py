@@ -0,0 +1,81 @@
+import os, sys, tempfile
+sys.path.append(os.path.dirname(__file__))
+
+from collectors.watermarks import Watermark, WatermarkStore
+
+
+def test_reached_and_resumed():
+    mark = Watermark(max_id=100, max_created_ts=1000, resume_min_id=300, resume_max_id=500)
+    assert mark.reached({"id": 100}) and not mark.reached({"id": 101})
+    # sans id, created_at_ts prend le relais
+    assert mark.reached({"created_at_ts": 999}) and not mark.reached({"created_at_ts": 1001})
+    assert mark.resumed({"id": 400}) and not mark.resumed({"id": 200})
+    assert mark.covers({"id": 50}) and mark.covers({"id": 300}) and not mark.covers({"id": 250})
+
+
+def test_interrupted_run_keeps_mark_and_records_resume_band():
+    mark = Watermark(max_id=100).after_run(500, 0, 300, complete=False)
+    assert mark.max_id == 100, "un run interrompu ne doit pas avancer max_id"
+    assert (mark.resume_min_id, mark.resume_max_id) == (300, 500)
+
+    # le run suivant repart du haut et rejoint la zone de reprise : elle s'étend
+    mark = mark.after_run(600, 0, 250, complete=False, resumed=True)
+    assert mark.max_id == 100
+    assert (mark.resume_min_id, mark.resume_max_id) == (250, 600)
+
+
+def test_complete_run_advances_and_clears_band():
+    mark = Watermark(max_id=100, resume_min_id=250, resume_max_id=600)
+    mark = mark.after_run(700, 1700, 101, complete=True)
+    assert mark.max_id == 700 and mark.max_created_ts == 1700
+    assert (mark.resume_min_id, mark.resume_max_id) == (0, 0)
+
+
+def test_failures_cap_the_mark_below_lowest_failed_id():
+    mark = Watermark(max_id=100, max_created_ts=1000).after_run(500, 1500, 101, complete=True,
+                                                               failed_min=200)
+    assert mark.max_id == 199, "l'id en échec doit être repris au prochain run"
+    assert mark.max_created_ts == 1000, "max_created_ts n'avance pas en cas d'échec"
+
+    # échec sous l'ancien watermark : rien ne recule
+    mark = Watermark(max_id=300).after_run(500, 0, 301, complete=True, failed_min=250)
+    assert mark.max_id == 300
+
+
+def test_empty_run_is_a_no_op():
+    mark = Watermark(max_id=100, resume_min_id=200, resume_max_id=300)
+    assert mark.after_run(0, 0, 0, complete=True) is mark
+
+
+def test_store_persists_runs():
+    path = os.path.join(tempfile.mkdtemp(), "marks.json")
+    store = WatermarkStore(path)
+    store.record_run("catalog:10", 500, 0, 300, complete=False)
+    store.advance("query:robe", 42, 1234)
+
+    reloaded = WatermarkStore(path)
+    mark = reloaded.get("catalog:10")
+    assert mark.max_id == 0 and (mark.resume_min_id, mark.resume_max_id) == (300, 500)
+    assert reloaded.get("query:robe").max_id == 42
+
+    # advance() ne recule jamais et garde une zone de reprise encore au-dessus
+    mark = reloaded.advance("catalog:10", 100)
+    assert mark.max_id == 100 and mark.resume_max_id == 500
+    assert reloaded.advance("catalog:10", 50).max_id == 100
+
+    reloaded.reset("catalog:10")
+    assert WatermarkStore(path).get("catalog:10") is None
+
+
+def main():
+    test_reached_and_resumed()
+    test_interrupted_run_keeps_mark_and_records_resume_band()
+    test_complete_run_advances_and_clears_band()
+    test_failures_cap_the_mark_below_lowest_failed_id()
+    test_empty_run_is_a_no_op()
+    test_store_persists_runs()
+    print("[OK] Watermarks : reprise, avance et échecs")
+
+
+if __name__ == "__main__":
+    main()
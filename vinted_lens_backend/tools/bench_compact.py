@@ -0,0 +1,72 @@
+# tools/bench_compact.py
+# Phase 1 de la recherche selon le stockage des embeddings : Float32 (référence),
+# int8 / bfloat16 seuls, int8 / bfloat16 + re-rank Float32 des meilleurs candidats,
+# et mode binary (préfiltre Hamming sur product_codes + re-rank Float32).
+# Octets lus et durée serveur viennent de system.query_log ; recall@k par rapport au scan Float32.
+#
+# Prérequis : python -m database.migrate_compact --layout int8 (et/ou bfloat16),
+#             python -m database.migrate_codes
+# Usage : python -m tools.bench_compact --queries 50 --rerank 200 --candidates 2000
+
+import os, sys, argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from database.clickhouse_setup import ClickHouseVectorDB, COMPACT_TABLES, CODES_TABLE
+from database.migrate_schema import table_columns
+from tools.bench_search_io import measure
+
+
+def phase1_ids(db: ClickHouseVectorDB, q: np.ndarray, limit: int) -> np.ndarray:
+    """Ids classés de la phase 1 seule (sans métadonnées), dans le mode par défaut de `db`"""
+    columns = db.query_native(*db._exact_search_query(q, limit, mode=db.search_mode))
+    return np.asarray(columns.get('id', []), dtype=np.uint64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockage compact des embeddings : I/O, latence, recall")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=2000, help="mode binary : candidats Hamming")
+    args = parser.parse_args()
+
+    reference = ClickHouseVectorDB(search_mode="exact")
+    ids = reference.fetch_embedding_ids()
+    if not len(ids):
+        print("❌ product_embeddings vide")
+        return
+    rng = np.random.default_rng(0)
+    sample = rng.choice(ids, size=min(args.queries, len(ids)), replace=False)
+    # requêtes = embeddings en base légèrement bruités (pas de correspondance exacte triviale)
+    queries = np.concatenate([e for _, e in reference.fetch_embeddings(sample)])
+    queries += rng.normal(0, 0.02, queries.shape).astype(np.float32)
+    print(f"📊 {len(queries)} requêtes sur {len(ids)} embeddings, recall@{args.limit}")
+
+    truth = [set(phase1_ids(reference, q, args.limit).tolist()) for q in queries]
+
+    variants = [("float32", reference)]
+    if table_columns(reference, CODES_TABLE):
+        variants.append((f"binary+rr{args.candidates}",
+                         ClickHouseVectorDB(search_mode="binary", binary_candidates=args.candidates)))
+    else:
+        print(f"ℹ️ {CODES_TABLE} absente (python -m database.migrate_codes)")
+    for layout, table in COMPACT_TABLES.items():
+        if not table_columns(reference, table):
+            print(f"ℹ️ {table} absente (python -m database.migrate_compact --layout {layout})")
+            continue
+        variants.append((layout, ClickHouseVectorDB(embedding_layout=layout, rerank=0)))
+        variants.append((f"{layout}+rr{args.rerank}",
+                         ClickHouseVectorDB(embedding_layout=layout, rerank=args.rerank)))
+
+    print(f"  {'stockage':16s} {'lu/requête':>12s} {'serveur':>10s} {'total':>10s} {'recall':>8s}")
+    for label, db in variants:
+        found = [phase1_ids(db, q, args.limit) for q in queries]
+        recall = np.mean([len(t & set(f.tolist())) / max(1, len(t)) for t, f in zip(truth, found)])
+        r = measure(db, label.replace('+', '_'), lambda q: phase1_ids(db, q, args.limit), queries)
+        print(f"  {label:16s} {r['mb_per_query']:9.2f} MB {r['server_ms_per_query']:7.1f} ms "
+              f"{r['wall_ms_per_query']:7.1f} ms {recall:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# tools/bench_embedding_path.py
+# Coût CPU / mémoire par article du chemin embedding des collecteurs,
+# sur des sorties de modèle synthétiques (ni CLIP ni ClickHouse requis) :
+#
+# - list : sortie modèle -> list[float] (encode_image_pil) -> np.asarray + normalisation
+#          -> .tolist() (encode_image) -> texte SQL VALUES (ancien add_product)
+# - numpy : matrice float32 (N, 512) -> l2_normalize en place -> bloc Native (add_products)
+#
+# Usage : python -m tools.bench_embedding_path --items 10000
+
+import os, sys, time, argparse, tracemalloc
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from database.native_format import encode_native
+from utils.vector_ops import l2_normalize
+
+DIM = 512
+
+
+def model_outputs(n: int, batch: int, seed: int = 0):
+    """Sorties brutes (non normalisées) d'un backend, par lots de `batch`"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, batch):
+        yield rng.standard_normal((min(batch, n - start), DIM), dtype=np.float32)
+
+
+def list_path(n: int, batch: int, insert_batch: int) -> int:
+    """Chemin d'avant : une liste Python de 512 floats par article, recopiée 4 fois"""
+    total = 0
+    values = []
+    pid = 0
+    for features in model_outputs(n, batch):
+        for row in features:
+            emb = row.reshape(1, -1).flatten()                      # encode_image
+            emb = emb / np.linalg.norm(emb)                          # _encode_pixels
+            vec = [float(x) for x in emb]                            # encode_image_pil
+            v = np.asarray(vec, dtype=np.float32)                    # encode_image (collecteur)
+            v = (v / np.linalg.norm(v)).astype(np.float32).tolist()
+            norm = float(np.linalg.norm(v))                          # add_product
+            values.append(f"({pid}, {v}, {norm})")
+            pid += 1
+            if len(values) >= insert_batch:
+                total += len(("INSERT INTO product_embeddings VALUES " + ",".join(values)).encode())
+                values = []
+    if values:
+        total += len(("INSERT INTO product_embeddings VALUES " + ",".join(values)).encode())
+    return total
+
+
+def numpy_path(n: int, batch: int, insert_batch: int) -> int:
+    """Chemin actuel : matrices float32 contiguës du modèle jusqu'au bloc Native"""
+    total = 0
+    pending = []
+    pid = 0
+    for features in model_outputs(n, batch):
+        embeddings, _ = l2_normalize(features)
+        pending.append(embeddings)
+        if sum(len(e) for e in pending) >= insert_batch:
+            block = np.concatenate(pending)
+            ids = np.arange(pid, pid + len(block), dtype=np.uint64)
+            total += len(encode_native([
+                ('product_id', 'UInt64', ids),
+                ('embedding', 'Array(Float32)', block),
+                ('norm', 'Float32', np.linalg.norm(block, axis=1)),
+            ]))
+            pid += len(block)
+            pending = []
+    if pending:
+        block = np.concatenate(pending)
+        total += len(encode_native([
+            ('product_id', 'UInt64', np.arange(pid, pid + len(block), dtype=np.uint64)),
+            ('embedding', 'Array(Float32)', block),
+            ('norm', 'Float32', np.linalg.norm(block, axis=1)),
+        ]))
+    return total
+
+
+def measure(label: str, fn, n: int, batch: int, insert_batch: int) -> dict:
+    # passe 1 : temps CPU (sans tracemalloc, qui ralentit surtout le chemin Python)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    payload = fn(n, batch, insert_batch)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+
+    # passe 2 : allocations Python/NumPy
+    tracemalloc.start()
+    fn(n, batch, insert_batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'label': label,
+        'cpu_us_per_item': cpu / n * 1e6,
+        'items_per_s': n / wall,
+        'peak_mb': peak / 1e6,
+        'payload_bytes_per_item': payload / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chemin embedding : listes Python vs tableaux float32")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--encode-batch", type=int, default=32)
+    parser.add_argument("--insert-batch", type=int, default=500)
+    args = parser.parse_args()
+
+    results = [measure(label, fn, args.items, args.encode_batch, args.insert_batch)
+               for label, fn in (("list", list_path), ("numpy", numpy_path))]
+
+    print(f"\n{args.items} articles, lots CLIP de {args.encode_batch}, inserts de {args.insert_batch}")
+    print(f"{'chemin':<8} {'CPU µs/art.':>12} {'art./s':>10} {'pic Mo':>8} {'octets/art.':>12}")
+    for r in results:
+        print(f"{r['label']:<8} {r['cpu_us_per_item']:>12.1f} {r['items_per_s']:>10.0f} "
+              f"{r['peak_mb']:>8.1f} {r['payload_bytes_per_item']:>12.0f}")
+    old, new = results
+    print(f"\nCPU x{old['cpu_us_per_item'] / new['cpu_us_per_item']:.1f}, "
+          f"mémoire x{old['peak_mb'] / max(new['peak_mb'], 1e-6):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# tools/bench_search_io.py
+# Octets lus par requête : ancienne recherche (JOIN products x product_embeddings)
+# vs recherche en deux phases (scan étroit + lookup par clé primaire).
+# Les chiffres viennent de system.query_log (read_rows / read_bytes / durée).
+#
+# Usage : python -m tools.bench_search_io --queries 20
+
+import os, sys, time, uuid, argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from database.clickhouse_setup import ClickHouseVectorDB
+
+
+def legacy_join_search(db: ClickHouseVectorDB, q: np.ndarray, limit: int):
+    """Requête d'avant la migration : JOIN complet puis tri"""
+    db.query_native(f"""
+        SELECT p.id, p.title, p.price, p.platform, p.image_url, p.category,
+               p.color, p.brand, p.size, p.condition,
+               dotProduct(e.embedding, {{query_embedding:Array(Float32)}})
+                   / (e.norm * {{query_norm:Float32}}) AS similarity
+        FROM {db.database}.products p
+        JOIN {db.database}.product_embeddings e ON p.id = e.product_id
+        WHERE e.norm > 0
+        ORDER BY similarity DESC
+        LIMIT {{limit:UInt32}}
+    """, {'query_embedding': q, 'query_norm': float(np.linalg.norm(q)), 'limit': limit})
+
+
+def measure(db: ClickHouseVectorDB, label: str, run, queries: np.ndarray) -> dict:
+    tag = f"bench_{label}_{uuid.uuid4().hex[:8]}"
+    db.default_settings = {'log_comment': tag}
+    t0 = time.time()
+    for q in queries:
+        run(q)
+    wall = time.time() - t0
+    db.default_settings = {}
+
+    db.execute_query("SYSTEM FLUSH LOGS")
+    stats = db.query_native("""
+        SELECT sum(read_rows) AS rows, sum(read_bytes) AS bytes, sum(query_duration_ms) AS ms
+        FROM system.query_log
+        WHERE type = 'QueryFinish' AND log_comment = {tag:String}
+    """, {'tag': tag})
+    n = len(queries)
+    return {
+        'label': label,
+        'rows_per_query': int(stats['rows'][0]) / n,
+        'mb_per_query': int(stats['bytes'][0]) / n / 1e6,
+        'server_ms_per_query': int(stats['ms'][0]) / n,
+        'wall_ms_per_query': wall / n * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=12)
+    args = parser.parse_args()
+
+    db = ClickHouseVectorDB()
+    ids = db.fetch_embedding_ids()
+    if not len(ids):
+        print("❌ product_embeddings vide")
+        return
+    rng = np.random.default_rng(0)
+    sample = rng.choice(ids, size=min(args.queries, len(ids)), replace=False)
+    queries = np.concatenate([e for _, e in db.fetch_embeddings(sample)])
+    print(f"📊 {len(queries)} requêtes sur {len(ids)} embeddings")
+
+    results = [
+        measure(db, "join", lambda q: legacy_join_search(db, q, args.limit), queries),
+        measure(db, "two_phase", lambda q: db.search_exact(q, limit=args.limit), queries),
+    ]
+    for r in results:
+        print(f"  {r['label']:10s} rows={r['rows_per_query']:>12.0f}  "
+              f"read={r['mb_per_query']:8.2f} MB  server={r['server_ms_per_query']:7.1f} ms  "
+              f"wall={r['wall_ms_per_query']:7.1f} ms")
+    ratio = results[0]['mb_per_query'] / max(results[1]['mb_per_query'], 1e-9)
+    print(f"➡️  octets lus divisés par {ratio:.1f}")
+
+
+if __name__ == "__main__":
+    main()
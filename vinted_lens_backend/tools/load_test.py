@@ -0,0 +1,109 @@
+# tools/load_test.py
+# Test de charge de /api/search-similar à concurrence croissante.
+# En parallèle, /health est sondé en continu : sa latence montre si la boucle
+# asyncio reste réactive pendant les recherches (elle ne doit pas suivre la charge).
+# Chaque requête envoie une image différente (hash exact et perceptuel distincts) :
+# le cache de requêtes ne sert rien, on mesure décodage + CLIP + recherche.
+# --cached rejoue 16 images fixes pour mesurer le chemin servi par le cache.
+#
+# Usage : python -m tools.load_test --url http://localhost:8000 --levels 1,2,4,8,16 --requests 64 [--cached]
+
+import io, time, asyncio, argparse
+import numpy as np
+import httpx
+from PIL import Image
+
+
+def make_payloads(n: int, seed: int = 0):
+    """
+    Images JPEG synthétiques (reproductibles, sans réseau) : mosaïques de blocs
+    aléatoires, donc dHash différent d'une image à l'autre
+    """
+    rng = np.random.default_rng(seed)
+    payloads = []
+    for _ in range(n):
+        blocks = rng.integers(0, 256, (8, 9, 3), dtype=np.uint8)
+        image = Image.fromarray(blocks, "RGB").resize((512, 512), Image.BILINEAR)
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=90)
+        payloads.append(buf.getvalue())
+    return payloads
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p99_ms": None}
+    arr = np.asarray(latencies) * 1000
+    return {"p50_ms": round(float(np.percentile(arr, 50)), 1),
+            "p99_ms": round(float(np.percentile(arr, 99)), 1)}
+
+
+async def probe_health(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            await client.get("/health")
+            latencies.append(time.perf_counter() - t0)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.05)
+
+
+async def run_level(client: httpx.AsyncClient, payloads, concurrency: int, total: int) -> dict:
+    latencies, errors = [], 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                r = await client.post("/api/search-similar",
+                                      files={"file": ("query.jpg", payloads[i % len(payloads)], "image/jpeg")})
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+            except httpx.HTTPError:
+                errors += 1
+
+    health_latencies, stop = [], asyncio.Event()
+    prober = asyncio.create_task(probe_health(client, stop, health_latencies))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    stop.set()
+    await prober
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "req_per_s": round(len(latencies) / wall, 2),
+        **percentiles(latencies),
+        "health": percentiles(health_latencies),
+    }
+
+
+async def main(url: str, levels, total: int, cached: bool = False):
+    fixed = make_payloads(16) if cached else None
+    limits = httpx.Limits(max_connections=max(levels) + 2)
+    async with httpx.AsyncClient(base_url=url, timeout=60.0, limits=limits) as client:
+        # échauffement : chargement CLIP, connexions
+        await run_level(client, fixed or make_payloads(2, seed=0), 1, 2)
+        print(f"{'conc':>5} {'req/s':>8} {'p50':>8} {'p99':>8} {'health p50':>11} {'health p99':>11} {'err':>4}")
+        for n, level in enumerate(levels):
+            # graine par palier : aucune image ne se répète d'un palier à l'autre
+            payloads = fixed or make_payloads(total, seed=n + 1)
+            r = await run_level(client, payloads, level, total)
+            print(f"{r['concurrency']:>5} {r['req_per_s']:>8} {r['p50_ms']!s:>8} {r['p99_ms']!s:>8} "
+                  f"{r['health']['p50_ms']!s:>11} {r['health']['p99_ms']!s:>11} {r['errors']:>4}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge de la recherche par image")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--levels", default="1,2,4,8,16")
+    parser.add_argument("--requests", type=int, default=64, help="requêtes par palier")
+    parser.add_argument("--cached", action="store_true",
+                        help="rejouer 16 images fixes (chemin servi par le cache de requêtes)")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, [int(x) for x in args.levels.split(",")], args.requests, args.cached))
@@ -0,0 +1,117 @@
+# utils/vector_ops.py
+# Opérations vectorielles NumPy partagées (scoring par blocs, top-k)
+
+import numpy as np
+from typing import Tuple
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices des k meilleurs scores (dernier axe), triés par score décroissant"""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def l2_normalize(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normalisation L2 ligne par ligne, en place quand l'entrée est déjà un
+    tableau float32 contigu (aucune copie sur le chemin CLIP -> ClickHouse).
+
+    Args:
+        embeddings: (512,) ou (N, 512)
+
+    Returns:
+        (embeddings normalisés float32 C-contigus, masque des lignes valides :
+        norme finie et non nulle ; les lignes invalides sont laissées telles quelles)
+    """
+    x = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rows = x.reshape(-1, x.shape[-1])
+    norms = np.sqrt(np.einsum('ij,ij->i', rows, rows))
+    valid = np.isfinite(norms) & (norms > 0)
+    rows /= np.where(valid, norms, 1.0)[:, None]
+    return x, (valid if x.ndim > 1 else valid[0])
+
+
+def blocked_top_k(queries: np.ndarray, embeddings: np.ndarray, k: int = 10,
+                  block_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k exact par produit scalaire, calculé bloc par bloc.
+    Généralise VintedLensCLIP.batch_similarity à une matrice (éventuellement
+    memmap float16) trop grande pour être convertie d'un coup en float32.
+
+    Args:
+        queries: Requête(s) (512,) ou (Q, 512)
+        embeddings: Matrice (N, 512), float16 ou float32
+        k: Nombre de résultats par requête
+        block_size: Lignes traitées par bloc
+
+    Returns:
+        (indices, scores): (Q, k) chacun, ou (k,) si une seule requête
+    """
+    single = queries.ndim == 1
+    q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    n = embeddings.shape[0]
+    k = min(k, n)
+
+    best_idx = np.empty((q.shape[0], 0), dtype=np.int64)
+    best_scores = np.empty((q.shape[0], 0), dtype=np.float32)
+
+    for start in range(0, n, block_size):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        scores = q @ block.T                                   # (Q, b)
+        local = top_k_indices(scores, k)
+        local_scores = np.take_along_axis(scores, local, axis=-1)
+
+        # fusion avec le meilleur courant
+        cand_idx = np.concatenate([best_idx, local + start], axis=1)
+        cand_scores = np.concatenate([best_scores, local_scores], axis=1)
+        keep = top_k_indices(cand_scores, k)
+        best_idx = np.take_along_axis(cand_idx, keep, axis=-1)
+        best_scores = np.take_along_axis(cand_scores, keep, axis=-1)
+
+    if single:
+        return best_idx[0], best_scores[0]
+    return best_idx, best_scores
+
+
+# --- encodages compacts (stockage ClickHouse) ---
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Int8 symétrique avec échelle par ligne : x ≈ q * scale, scale = max|x| / 127.
+
+    Returns:
+        (q int8 (N, dim), scale float32 (N,))
+    """
+    x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    scale = np.abs(x).max(axis=1) / 127.0
+    scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+    q = np.clip(np.rint(x / scale[:, None]), -127, 127).astype(np.int8)
+    return q, scale
+
+
+def to_bfloat16(embeddings: np.ndarray) -> np.ndarray:
+    """float32 -> bits BFloat16 (uint16), arrondi au plus proche pair"""
+    bits = np.ascontiguousarray(embeddings, dtype=np.float32).view(np.uint32)
+    rounding = ((bits >> 16) & 1) + np.uint32(0x7FFF)
+    return ((bits + rounding) >> 16).astype(np.uint16)
+
+
+def from_bfloat16(bits: np.ndarray) -> np.ndarray:
+    return (np.asarray(bits, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+
+
+def sign_codes(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Codes binaires 512 bits (bit i = composante i > 0), en 8 mots uint64 par ligne :
+    le bit i du mot k correspond à la composante 64·k + i (même convention que le SQL de backfill).
+
+    Returns:
+        uint64 (N, dim / 64)
+    """
+    x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    return np.packbits(x > 0, axis=1, bitorder='little').view('<u8')
+